@@ -0,0 +1,103 @@
+"""In-process caches of the API.
+
+The species table is static: it is loaded once at startup and kept in memory,
+lookups only hit the database for species missing from the cache (read-through).
+
+Ticket statuses change, they are kept for a few seconds only, so that clients
+polling a ticket hit the database at most once per TTL. The feedback consumer
+runs in the same process and invalidates a ticket as soon as its status changes.
+
+"""
+
+import logging
+import os
+import time
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from api import crud
+
+logging.basicConfig(level=logging.INFO)
+
+TICKET_CACHE_TTL = float(os.getenv("TICKET_CACHE_TTL_SECONDS", "5"))
+TICKET_CACHE_SIZE = int(os.getenv("TICKET_CACHE_SIZE", "10000"))
+
+
+class BirdCache:
+    """Read-through cache of the species table, by id and by name."""
+
+    def __init__(self) -> None:
+        self._by_id = {}
+        self._by_name = {}
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def _add(self, bird_id: int, name: str) -> None:
+        self._by_id[bird_id] = name
+        self._by_name[name] = bird_id
+
+    async def load(self, session: AsyncSession) -> None:
+        """Load the whole species table."""
+        for bird in await crud.get_birds(session):
+            self._add(bird.id, bird.name)
+        logging.info(f"Bird cache loaded: {len(self)} species")
+
+    async def get_name(self, session: AsyncSession, bird_id: int) -> str | None:
+        """Return the name of a species, or None if it does not exist."""
+        if bird_id not in self._by_id:
+            bird = await crud.get_bird(session, bird_id=bird_id)
+            if bird is None:
+                return None
+            self._add(bird.id, bird.name)
+        return self._by_id[bird_id]
+
+    async def get_id(self, session: AsyncSession, name: str) -> int | None:
+        """Return the id of a species, or None if it does not exist."""
+        if name not in self._by_name:
+            bird = await crud.get_bird(session, name=name)
+            if bird is None:
+                return None
+            self._add(bird.id, bird.name)
+        return self._by_name[name]
+
+    def items(self) -> dict:
+        """Return the cached species, by id."""
+        return dict(self._by_id)
+
+
+class TTLCache:
+    """Bounded in-process cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, ttl: float, maxsize: int) -> None:
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the value of a key, or None if it is missing or expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        return value
+
+    def set(self, key, value) -> None:
+        self._entries.pop(key, None)
+        if len(self._entries) >= self.maxsize:
+            # Dicts keep insertion order: the first entry is the oldest
+            del self._entries[next(iter(self._entries))]
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, key) -> None:
+        self._entries.pop(key, None)
+
+
+bird_cache = BirdCache()
+ticket_cache = TTLCache(TICKET_CACHE_TTL, TICKET_CACHE_SIZE)
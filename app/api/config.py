@@ -14,8 +14,10 @@ class BaseConfig:
     DB_PORT = os.getenv("POSTGRES_PORT")
     DB_NAME = os.getenv("POSTGRES_DB")
 
-    ASYNC_DATABASE_URL: ClassVar[str] = (
-        f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    # Overridable, e.g. with sqlite+aiosqlite:///loadtest.db to run without Postgres
+    ASYNC_DATABASE_URL: ClassVar[str] = os.getenv(
+        "ASYNC_DATABASE_URL",
+        f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}",
     )
     DATABASE_URL: ClassVar[str] = (
         f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
@@ -25,11 +27,24 @@ class BaseConfig:
     MINIO_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY_ID")
     MINIO_SECRET_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
     MINIO_BUCKET = os.getenv("MINIO_BUCKET")
+    # Endpoint reachable by the clients, used to sign direct upload URLs
+    MINIO_PUBLIC_ENDPOINT = os.getenv("MINIO_PUBLIC_ENDPOINT", MINIO_ENDPOINT)
+    MINIO_REGION = os.getenv("MINIO_REGION", "us-east-1")
+    # Required by the bucket notification webhook, which is disabled without it
+    MINIO_WEBHOOK_TOKEN = os.getenv("MINIO_WEBHOOK_TOKEN")
+    # Largest file accepted by the presigned direct uploads
+    MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(1024**3)))
+    UPLOAD_URL_EXPIRY = int(os.getenv("UPLOAD_URL_EXPIRY_SECONDS", "3600"))
+    RESULT_URL_EXPIRY = int(os.getenv("RESULT_URL_EXPIRY_SECONDS", "3600"))
+    # Comment lines sent on idle event streams, so that proxies keep them open
+    TICKET_EVENTS_KEEPALIVE = float(os.getenv("TICKET_EVENTS_KEEPALIVE_SECONDS", "15"))
     
     RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")
     RABBITMQ_PORT = int(os.getenv("RABBITMQ_PORT", "5672"))
     FORWARDING_QUEUE = os.getenv("RABBITMQ_QUEUE_API2INF")
     FEEDBACK_QUEUE = os.getenv("RABBITMQ_QUEUE_INF2API")
+    # Interval between two samples of the queue depths exposed on /metrics
+    QUEUE_DEPTH_INTERVAL = float(os.getenv("QUEUE_DEPTH_INTERVAL_SECONDS", "15"))
 
     def log_config(self):
         logging.info(f"Database Configuration: USER={self.DB_USER}, "
@@ -38,4 +53,6 @@ class BaseConfig:
                      f"BUCKET={self.MINIO_BUCKET}")
         logging.info(f"RabbitMQ Configuration: HOST={self.RABBITMQ_HOST}, "
                      f"PORT={self.RABBITMQ_PORT}, FORWARDING_QUEUE={self.FORWARDING_QUEUE}, "
-                     f"FEEDBACK_QUEUE={self.FEEDBACK_QUEUE}")
\ No newline at end of file
+                     f"FEEDBACK_QUEUE={self.FEEDBACK_QUEUE}")
+        if not self.MINIO_WEBHOOK_TOKEN:
+            logging.warning("MINIO_WEBHOOK_TOKEN is not set, storage notifications are rejected")
\ No newline at end of file
@@ -1,24 +1,65 @@
 
 import asyncio
+import hmac
+import json
 import logging
 import os
-import uuid
-
-from app_utils.minio import ensure_bucket_exists, write_file_to_minio
+import secrets
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import unquote_plus
+
+from app_utils.audio import MAX_HEADER_BYTES, WavStreamReader, parse_wav_header
+from app_utils.clients import (
+    ClientRegistry,
+    amqp_connect,
+    make_minio_client,
+    smtp_connection_factory,
+)
+from app_utils.executors import IO_MAX_WORKERS, run_io, shutdown_executors
+from app_utils.metrics import QUEUE_DEPTH
+from app_utils.minio import (
+    ensure_bucket_exists,
+    make_http_client,
+    read_json_from_minio,
+    read_object_head,
+    stream_file_to_minio,
+    write_file_to_minio,
+    write_json_to_minio,
+)
+from app_utils.publisher import AsyncPublisher
+from app_utils.pubsub import ticket_broker
+from app_utils.tracing import current_traceparent, tracer
+from app_utils.smtplib import EmailDispatcher
 from app_utils.rabbitmq import (
     consume_feedback_messages,
-    get_rabbit_connection,
-    publish_message,
+    get_lane_queues,
+    route_by_duration,
 )
 from api.database import create_db_and_tables, engine, get_async_session
-from app_utils.file_schemas import UploadRecord
+from app_utils.file_schemas import UploadRecord, UploadRequest
 from app_utils.amqp_schemas import InferenceMessage
-from fastapi import FastAPI, File, Form, UploadFile
-from minio import Minio
+from fastapi import (
+    FastAPI,
+    File,
+    Form,
+    Header,
+    HTTPException,
+    Request,
+    UploadFile,
+    WebSocket,
+    WebSocketDisconnect,
+)
+from fastapi.responses import Response, StreamingResponse
+from minio.datatypes import PostPolicy
+from minio.error import S3Error
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
 from config import BaseConfig
 
 from api import crud
+from api.cache import bird_cache, ticket_cache
 
 logging.basicConfig(level=logging.INFO)
 
@@ -28,37 +69,106 @@ config = BaseConfig() # environment settings
 config.log_config()
 
 
-minio_client = None
-rabbitmq_connection = None
-rabbitmq_channel = None
-
-
 #################### CLIENTS ####################
-def initialize_clients():
-    global minio_client, rabbitmq_connection, rabbitmq_channel
+# MinIO calls are blocking and run in the bounded I/O thread pool (see app_utils.executors),
+# RabbitMQ is used through asyncio clients. Clients are built on first use by the registry,
+# from app_utils.clients, which swaps them for in-process stand-ins in load-testing mode
+registry = ClientRegistry()
+
 
-    #======# STORAGE #======#
+def build_minio_client():
     logging.info("Initializing MinIO client...")
-    minio_client = Minio(
+    minio_client = make_minio_client(
         config.MINIO_ENDPOINT,
-        access_key=config.MINIO_ACCESS_KEY,
-        secret_key=config.MINIO_SECRET_KEY,
-        secure=False,
+        config.MINIO_ACCESS_KEY,
+        config.MINIO_SECRET_KEY,
+        # One connection per I/O thread
+        http_client=make_http_client(maxsize=IO_MAX_WORKERS),
     )
     logging.info("Checking if bucket exists...")
     ensure_bucket_exists(minio_client, config.MINIO_BUCKET)
+    return minio_client
+
+
+def build_minio_presign_client():
+    # Signing is done locally, the region is set to skip its lookup on the public endpoint
+    return make_minio_client(
+        config.MINIO_PUBLIC_ENDPOINT,
+        config.MINIO_ACCESS_KEY,
+        config.MINIO_SECRET_KEY,
+        region=config.MINIO_REGION,
+    )
+
+
+async def start_publisher() -> AsyncPublisher:
+    publisher = AsyncPublisher(config.RABBITMQ_HOST, config.RABBITMQ_PORT, connect=amqp_connect)
+    await publisher.start()
+    inference_queues = list(get_lane_queues(config.FORWARDING_QUEUE).values())
+    for queue_name in (*inference_queues, config.FEEDBACK_QUEUE):
+        logging.info(f"Declaring queue: {queue_name}")
+        await publisher.declare_queue(queue_name)
+    return publisher
+
+
+async def start_email_dispatcher() -> EmailDispatcher:
+    email_dispatcher = EmailDispatcher(
+        registry.get("minio"), config.MINIO_BUCKET, connection_factory=smtp_connection_factory()
+    )
+    await email_dispatcher.start()
+    return email_dispatcher
+
+
+async def start_feedback_consumer():
+    """Consume the feedback queue on its own connection, return (stop event, task)."""
+    stop_event = asyncio.Event()
+    task = asyncio.create_task(
+        consume_feedback_messages(
+            config.RABBITMQ_HOST,
+            config.RABBITMQ_PORT,
+            config.FEEDBACK_QUEUE,
+            registry.get("minio"),
+            config.MINIO_BUCKET,
+            stop_event=stop_event,
+            email_dispatcher=await registry.aget("email_dispatcher"),
+            connect=amqp_connect,
+        )
+    )
+    return stop_event, task
+
+
+async def stop_feedback_consumer(feedback_consumer) -> None:
+    stop_event, task = feedback_consumer
+    stop_event.set()
+    await task
 
-    #======# FORWARDING QUEUE #======#
-    logging.info("Connecting to RabbitMQ...")
-    rabbitmq_connection = get_rabbit_connection(config.RABBITMQ_HOST, config.RABBITMQ_PORT)
-    rabbitmq_channel = rabbitmq_connection.channel()
 
-    logging.info(f"Declaring queue: {config.FORWARDING_QUEUE}")
-    rabbitmq_channel.queue_declare(queue=config.FORWARDING_QUEUE, durable=True)
+async def sample_queue_depths() -> None:
+    """Sample the depths of the inference and feedback queues, for /metrics."""
+    queue_names = [*get_lane_queues(config.FORWARDING_QUEUE).values(), config.FEEDBACK_QUEUE]
+    while True:
+        publisher = await registry.aget("publisher")
+        for queue_name in queue_names:
+            try:
+                QUEUE_DEPTH.labels(queue=queue_name).set(await publisher.queue_depth(queue_name))
+            except Exception as e:
+                logging.warning(f"Failed to sample the depth of {queue_name}: {e!r}")
+        await asyncio.sleep(config.QUEUE_DEPTH_INTERVAL)
 
-    #======# FEEDBACK QUEUE #======#
-    logging.info(f"Declaring queue: {config.FEEDBACK_QUEUE}")
-    rabbitmq_channel.queue_declare(queue=config.FEEDBACK_QUEUE, durable=True)
+
+async def start_queue_depth_sampler() -> asyncio.Task:
+    return asyncio.create_task(sample_queue_depths())
+
+
+# Closed in reverse creation order on shutdown: the sampler and the feedback consumer
+# stop before the email dispatcher (waiting for the queued emails) and the publisher
+registry.register("minio", build_minio_client)
+registry.register("minio_presign", build_minio_presign_client)
+registry.register("publisher", start_publisher, close=lambda publisher: publisher.close())
+registry.register(
+    "email_dispatcher", start_email_dispatcher, close=lambda dispatcher: dispatcher.stop()
+)
+registry.register("feedback_consumer", start_feedback_consumer, close=stop_feedback_consumer)
+registry.register("queue_depth_sampler", start_queue_depth_sampler, close=lambda t: t.cancel())
 
 
 @app.on_event("startup")
@@ -66,29 +176,273 @@ async def startup_event() -> None:
     """Startup event handler.
 
     This function is called when the application starts up.
-    It creates a task to consume feedback messages
-    from the specified RabbitMQ queue using the provided RabbitMQ channel,
-    MinIO client, and MinIO bucket.
+    It builds the clients of the storage and the queues, then creates a task
+    to consume feedback messages from the specified RabbitMQ queue,
+    on its own asyncio connection, using the MinIO client and MinIO bucket.
 
     Returns
     -------
         None
 
     """
-    initialize_clients()
+    # Checks the bucket, blocking
+    await run_io(registry.get, "minio")
+    await registry.aget("publisher")
+    await registry.aget("email_dispatcher")
     
     await create_db_and_tables()
     
     async for session in get_async_session():
-        async with session.begin():
-            await crud.populate_bird_table(session)
+        await crud.populate_bird_table(session)
+        await bird_cache.load(session)
     
-    asyncio.create_task(
-        consume_feedback_messages(
-            rabbitmq_channel, config.FEEDBACK_QUEUE, minio_client, config.MINIO_BUCKET
-        )
+    await registry.aget("feedback_consumer")
+    await registry.aget("queue_depth_sampler")
+
+
+@app.on_event("shutdown")
+async def shutdown_event() -> None:
+    """Shutdown event handler, waits for in-flight feedback messages, queued emails,
+    publisher confirms and pending storage calls."""
+    await registry.aclose()
+    shutdown_executors()
+
+
+def read_file(file_path) -> bytes:
+    with open(file_path, "rb") as file:
+        return file.read()
+
+
+async def publish_inference_message(message: dict) -> None:
+    """Enqueue an inference job, once confirmed by the broker.
+
+    Short recordings go to the interactive lane, served first by the workers.
+
+    Raises
+    ------
+        HTTPException: 503 if the broker is unreachable after retries.
+
+    """
+    queue_name = route_by_duration(config.FORWARDING_QUEUE, message.get("audio_length"))
+    # Start of the end-to-end latency, and of the trace, of the ticket
+    message["submitted_at"] = time.time()
+    logging.info(f"Publishing message to RabbitMQ queue {queue_name}...")
+    with tracer.span(
+        "enqueue",
+        ticket_number=message.get("ticket_number"),
+        audio_length=message.get("audio_length"),
+        queue=queue_name,
+    ):
+        message["traceparent"] = current_traceparent()
+        try:
+            publisher = await registry.aget("publisher")
+            await publisher.publish(queue_name, message)
+        except Exception as e:
+            logging.error(f"Failed to publish message: {e!r}")
+            raise HTTPException(status_code=503, detail="Message broker unavailable")
+
+
+# Ticket numbers are the only credential of a ticket: random, and long enough not to be guessed
+TICKET_NUMBER_BYTES = 12
+# New ticket numbers drawn when one is already in use
+TICKET_NUMBER_ATTEMPTS = 3
+
+
+def new_ticket_number() -> str:
+    return secrets.token_urlsafe(TICKET_NUMBER_BYTES)
+
+
+async def record_service_call(message: InferenceMessage, completed_twice_ok=False) -> bool:
+    """Record the service call of an upload, with its audio duration.
+
+    Args:
+    ----
+        message (InferenceMessage): The inference job of the upload.
+        completed_twice_ok (bool): Whether the upload may already be recorded, with the same
+            file: a direct upload is completed by the client and by the storage notification.
+
+    Returns
+    -------
+        bool: False if the ticket number is already used by another upload,
+        whose service call is left unchanged.
+
+    """
+    async for session in get_async_session():
+        try:
+            await crud.create_service_call(
+                session,
+                message.email,
+                message.ticket_number,
+                message.soundfile_minio_path,
+                message.audio_length,
+            )
+        except IntegrityError:
+            # Ticket numbers are unique
+            await session.rollback()
+            if completed_twice_ok:
+                service_call = await crud.get_service_call_by_ticket(
+                    session, message.ticket_number
+                )
+                if service_call.audio_path == message.soundfile_minio_path:
+                    logging.info(f"Service call {message.ticket_number} already recorded")
+                    return True
+            logging.warning(f"Ticket number {message.ticket_number} already in use")
+            return False
+    return True
+
+
+def get_pending_upload_path(ticket_number: str) -> str:
+    return f"pending/{ticket_number}.json"
+
+
+async def complete_upload(ticket_number: str) -> dict:
+    """Enqueue the inference job of a direct upload, once its file is in MinIO.
+
+    The pending job is removed after it is published: completing a ticket twice
+    concurrently (client call and storage notification) may enqueue it twice,
+    but a ticket is never lost.
+
+    Raises
+    ------
+        HTTPException: 404 if the ticket is unknown or already completed,
+        409 if the file has not been uploaded yet, 400 if it is not a valid .wav file.
+
+    """
+    minio_client = registry.get("minio")
+    pending_path = get_pending_upload_path(ticket_number)
+    message_data = await run_io(
+        read_json_from_minio, minio_client, config.MINIO_BUCKET, pending_path
     )
-    
+    if message_data is None:
+        raise HTTPException(status_code=404, detail="Unknown or completed upload")
+
+    audio_path = message_data["soundfile_minio_path"]
+    try:
+        head = await run_io(
+            read_object_head, minio_client, config.MINIO_BUCKET, audio_path, MAX_HEADER_BYTES
+        )
+    except S3Error as e:
+        logging.info(f"Upload {ticket_number} not completed: {e!s}")
+        raise HTTPException(status_code=409, detail="File not uploaded yet")
+    try:
+        header = parse_wav_header(head)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if header is None:
+        raise HTTPException(status_code=400, detail="Invalid WAV file: no data chunk")
+
+    message = InferenceMessage(**{**message_data, "audio_length": header["duration"]})
+    if not await record_service_call(message, completed_twice_ok=True):
+        raise HTTPException(status_code=409, detail="Ticket number already in use")
+    await publish_inference_message(message.dict())
+    await run_io(minio_client.remove_object, config.MINIO_BUCKET, pending_path)
+
+    return {
+        "filename": audio_path,
+        "message": "Fichier enregistré avec succès",
+        "email": message.email,
+        "ticket_number": ticket_number,
+        "duration": header["duration"],
+    }
+
+
+async def get_ticket_status(ticket_number: str) -> dict | None:
+    """Return the status of a ticket, with its results once done,
+    or None if the ticket is unknown.
+
+    Results are returned as presigned URLs of the annotation and spectrogram files,
+    and as inline detections, with the species names of the bird cache.
+    """
+    async for session in get_async_session():
+        service_call = await crud.get_service_call_with_results(session, ticket_number)
+        if service_call is None:
+            return None
+
+        ticket = {
+            "ticket_number": service_call.ticket_number,
+            "status": service_call.status,
+            "audio_length": service_call.audio_length,
+        }
+        if service_call.status != "done" or not service_call.inference_results:
+            return ticket
+
+        # Signing is done locally, no request to MinIO
+        expires = timedelta(seconds=config.RESULT_URL_EXPIRY)
+        minio_presign_client = registry.get("minio_presign")
+        result = service_call.inference_results[-1]
+        ticket["annotation_url"] = minio_presign_client.presigned_get_object(
+            config.MINIO_BUCKET, result.annotation_path, expires=expires
+        )
+        ticket["spectrogram_url"] = minio_presign_client.presigned_get_object(
+            config.MINIO_BUCKET, result.spectrogram_path, expires=expires
+        )
+        ticket["detections"] = [
+            {
+                "bird_id": detection.bird_id,
+                "species": await bird_cache.get_name(session, detection.bird_id),
+                "t_start": detection.t_start,
+                "t_end": detection.t_end,
+                "f_start": detection.f_start,
+                "f_end": detection.f_end,
+                "score": detection.score,
+            }
+            for detection in service_call.detections
+        ]
+        return ticket
+
+
+async def follow_ticket(ticket_number: str, queue: asyncio.Queue, ticket: dict):
+    """Yield the ticket, then the ticket again every time its status changes, until done.
+
+    When no event was received for `TICKET_EVENTS_KEEPALIVE` seconds, the ticket is read
+    again: events only reach the API process running the feedback consumer that received
+    them, the subscriber may be served by another one. None is yielded if it is unchanged.
+    The subscription queue is closed when the generator ends.
+    """
+    try:
+        yield ticket
+        while ticket["status"] != "done":
+            try:
+                await asyncio.wait_for(queue.get(), config.TICKET_EVENTS_KEEPALIVE)
+            except asyncio.TimeoutError:
+                status = ticket["status"]
+                ticket = await get_ticket(ticket_number)
+                yield ticket if ticket["status"] != status else None
+                continue
+            # The cached ticket is invalidated before the event is published
+            ticket = await get_ticket(ticket_number)
+            yield ticket
+    finally:
+        ticket_broker.unsubscribe(ticket_number, queue)
+
+
+async def subscribe_ticket(ticket_number: str):
+    """Subscribe to the events of a ticket and return the queue and the current ticket.
+
+    The subscription is made before reading the ticket, so that no event is missed.
+
+    Raises
+    ------
+        HTTPException: 404 if the ticket is unknown.
+
+    """
+    queue = ticket_broker.subscribe(ticket_number)
+    try:
+        return queue, await get_ticket(ticket_number)
+    except HTTPException:
+        ticket_broker.unsubscribe(ticket_number, queue)
+        raise
+
+
+async def format_ticket_events(updates):
+    """Format ticket updates as server-sent events."""
+    async for ticket in updates:
+        if ticket is None:
+            yield ": keepalive\n\n"
+        else:
+            yield f"event: {ticket['status']}\ndata: {json.dumps(ticket)}\n\n"
+
+
 #################### ROUTES ####################
 @app.get("/healthcheck")
 def healthcheck() -> dict:
@@ -102,6 +456,107 @@ def healthcheck() -> dict:
     """
     return {"status": "ok"}
 
+@app.get("/metrics")
+def metrics() -> Response:
+    """Prometheus metrics endpoint."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/birds")
+async def list_birds() -> dict:
+    """List the species known to the model, by id, from the in-process cache."""
+    return bird_cache.items()
+
+
+@app.get("/tickets/{ticket_number}")
+async def get_ticket(ticket_number: str) -> dict:
+    """Ticket status endpoint.
+
+    Returns the status of a ticket (queued, processing or done) and, once done,
+    the URLs of its result files and its detections.
+    Statuses are cached for a few seconds, so that polling clients are cheap.
+
+    Args:
+    ----
+        ticket_number (str): The ticket number returned by the upload.
+
+    Returns
+    -------
+        dict: A dictionary containing the ticket number, status and audio length,
+        and the annotation URL, spectrogram URL and detections once done.
+
+    Raises:
+    ------
+        HTTPException: 404 if the ticket is unknown.
+
+    """
+    ticket = ticket_cache.get(ticket_number)
+    if ticket is None:
+        ticket = await get_ticket_status(ticket_number)
+        if ticket is None:
+            raise HTTPException(status_code=404, detail="Unknown ticket")
+        ticket_cache.set(ticket_number, ticket)
+    return ticket
+
+
+@app.get("/tickets/{ticket_number}/events")
+async def ticket_events(ticket_number: str) -> StreamingResponse:
+    """Ticket server-sent events endpoint.
+
+    Streams the ticket, as returned by `GET /tickets/{ticket_number}`, once on connection
+    and then on every status change, the event name being the status.
+    The stream ends once the ticket is done.
+
+    Raises
+    ------
+        HTTPException: 404 if the ticket is unknown.
+
+    """
+    queue, ticket = await subscribe_ticket(ticket_number)
+    return StreamingResponse(
+        format_ticket_events(follow_ticket(ticket_number, queue, ticket)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.websocket("/ws/tickets/{ticket_number}")
+async def ticket_websocket(websocket: WebSocket, ticket_number: str) -> None:
+    """Ticket WebSocket endpoint.
+
+    Sends the ticket as JSON on connection and on every status change,
+    and closes the connection once the ticket is done.
+    Unknown tickets are rejected with the policy violation close code.
+    """
+    try:
+        queue, ticket = await subscribe_ticket(ticket_number)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+
+    async def send_updates():
+        async for update in follow_ticket(ticket_number, queue, ticket):
+            if update is not None:
+                await websocket.send_json(update)
+        await websocket.close()
+
+    async def wait_disconnect():
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    # Stop following the ticket as soon as the client leaves
+    tasks = {asyncio.create_task(send_updates()), asyncio.create_task(wait_disconnect())}
+    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    for task in pending:
+        task.cancel()
+    for task in done:
+        try:
+            task.result()
+        except WebSocketDisconnect:
+            logging.info(f"Subscriber of {ticket_number} disconnected")
+
+
 @app.get("/upload-dev")
 async def upload_dev(email: str) -> dict:
     """Development upload endpoint.
@@ -123,10 +578,10 @@ async def upload_dev(email: str) -> dict:
     file_path = "api/Turdus_merlula.wav"
     file_name = file_path.split("/")[-1]
     minio_path = f"{config.MINIO_BUCKET}/{file_name}"
-    ticket_number = str(uuid.uuid4())[:6]  # Generate a 6-character ticket number
+    ticket_number = new_ticket_number()
 
     try:
-        minio_client.stat_object(config.MINIO_BUCKET, file_name)
+        await run_io(registry.get("minio").stat_object, config.MINIO_BUCKET, file_name)
         logging.info(f"File {file_name} already exists in MinIO.")
     except Exception as e:
         logging.error(
@@ -134,11 +589,11 @@ async def upload_dev(email: str) -> dict:
         )
 
         # Read the file content
-        with open(file_name, "rb") as file:
-            file_content = file.read()
+        file_content = await run_io(read_file, file_name)
 
-        write_file_to_minio(
-            minio_client,
+        await run_io(
+            write_file_to_minio,
+            registry.get("minio"),
             config.MINIO_BUCKET,
             file_name,
             file_content,  # Pass the file content as the data argument
@@ -146,8 +601,7 @@ async def upload_dev(email: str) -> dict:
 
     message = {"minio_path": minio_path, "email": email, "ticket_number": ticket_number}
 
-    logging.info("Publishing message to RabbitMQ...")
-    publish_message(rabbitmq_channel, config.FORWARDING_QUEUE, message)
+    await publish_inference_message(message)
 
     return {
         "filename": "Turdus_merlula.wav",
@@ -161,9 +615,9 @@ async def upload_record(file: UploadFile = File(...), email: str = Form(...)):
     """Upload a record endpoint.
 
     Allows users to upload an audio file (.wav) along with their email address.
-    Checks if the file is a valid .wav file, reads the file content,
-    and generates a unique ticket number.
-    The file is then uploaded to MinIO, and a message is published
+    Checks if the file is a valid .wav file and generates a unique ticket number.
+    The file is streamed to MinIO, its header being validated and its content
+    hashed on the fly, and a message is published
     to the specified RabbitMQ queue for further processing.
 
     Args:
@@ -174,11 +628,11 @@ async def upload_record(file: UploadFile = File(...), email: str = Form(...)):
     Returns
     -------
         dict: A dictionary containing the filename,
-        success message, email, and ticket number.
+        success message, email, ticket number, sha256 and size of the file.
 
     Raises:
     ------
-        HTTPException: If the uploaded file is not a .wav file,
+        HTTPException: If the uploaded file is not a valid .wav file,
         an error message is returned.
 
     """
@@ -193,38 +647,144 @@ async def upload_record(file: UploadFile = File(...), email: str = Form(...)):
     annotation_path = upload_data.get_annotation_path(config.MINIO_BUCKET)
     spectrogram_path = upload_data.get_spectrogram_path(config.MINIO_BUCKET)
 
-    # Read file content
-    file_content = await file.read()
-
-    # Upload file to MinIO
+    # Stream the upload to MinIO: the spooled request body is read one part at a time,
+    # the WAV header is validated and the content hashed on the fly
+    # Object names are timestamped, no need to check for an existing object
+    audio_stream = WavStreamReader(file.file)
     try:
-        minio_client.stat_object(config.MINIO_BUCKET, audio_path)
-        logging.info(f"File {audio_path} already exists in MinIO.")
-    except Exception as e:
-        logging.error(
-            f"File {audio_path} does not exist in MinIO. Uploading... Error: {e!s}"
+        await run_io(
+            stream_file_to_minio,
+            registry.get("minio"),
+            config.MINIO_BUCKET,
+            audio_path,
+            audio_stream,
+            content_type="audio/wav",
         )
-        write_file_to_minio(minio_client, config.MINIO_BUCKET, audio_path, file_content)
-
-    ticket_number = str(uuid.uuid4())[:6]  # Generate a 6-character ticket number
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logging.info(
+        f"Uploaded {audio_path}: {audio_stream.n_bytes} bytes, "
+        f"{audio_stream.duration:.1f}s, sha256={audio_stream.sha256}"
+    )
 
     # Prepare message data
     message_data = {
         "soundfile_minio_path": audio_path,
         "email": upload_data.email,
-        "ticket_number": ticket_number,
         "annotations_minio_path": annotation_path,
-        "spectrogram_minio_path": spectrogram_path
+        "spectrogram_minio_path": spectrogram_path,
+        "audio_length": audio_stream.duration,
     }
-    message = InferenceMessage(**message_data)
+    # A ticket number already in use is drawn again
+    for _ in range(TICKET_NUMBER_ATTEMPTS):
+        message = InferenceMessage(**message_data, ticket_number=new_ticket_number())
+        if await record_service_call(message):
+            break
+    else:
+        raise HTTPException(status_code=503, detail="No ticket number available")
 
     # Publish message to RabbitMQ
-    logging.info("Publishing message to RabbitMQ...")
-    publish_message(rabbitmq_channel, config.FORWARDING_QUEUE, message.dict())
+    await publish_inference_message(message.dict())
 
     return {
         "filename": audio_path,
         "message": "Fichier enregistré avec succès",
         "email": upload_data.email,
         "ticket_number": message.ticket_number,
-    }
\ No newline at end of file
+        "sha256": audio_stream.sha256,
+        "size": audio_stream.n_bytes,
+    }
+
+
+@app.post("/uploads")
+async def create_upload(upload_request: UploadRequest) -> dict:
+    """Start a direct upload.
+
+    Returns a presigned POST policy with which the client uploads the .wav file, straight to
+    MinIO: a multipart form POST to `upload_url` with the `upload_fields`, then the `file` field.
+    The policy only accepts this object name, the audio/wav content type,
+    and files of at most `MAX_UPLOAD_BYTES`.
+    The inference job is stored as pending, and enqueued once the file is uploaded,
+    either by `POST /uploads/{ticket_number}/complete` or by the MinIO bucket notification.
+
+    Args:
+    ----
+        upload_request (UploadRequest): The email address and the name of the file.
+
+    Returns
+    -------
+        dict: A dictionary containing the ticket number, the upload URL and form fields,
+        their expiry in seconds and the path of the file in MinIO.
+
+    """
+    ticket_number = new_ticket_number()
+    audio_path = upload_request.get_audio_path(config.MINIO_BUCKET, ticket_number)
+
+    message = InferenceMessage(
+        soundfile_minio_path=audio_path,
+        email=upload_request.email,
+        ticket_number=ticket_number,
+        annotations_minio_path=upload_request.get_annotation_path(config.MINIO_BUCKET),
+        spectrogram_minio_path=upload_request.get_spectrogram_path(config.MINIO_BUCKET),
+    )
+    await run_io(
+        write_json_to_minio,
+        registry.get("minio"),
+        config.MINIO_BUCKET,
+        get_pending_upload_path(ticket_number),
+        message.dict(),
+    )
+    expiration = datetime.now(timezone.utc) + timedelta(seconds=config.UPLOAD_URL_EXPIRY)
+    policy = PostPolicy(config.MINIO_BUCKET, expiration)
+    policy.add_equals_condition("key", audio_path)
+    policy.add_equals_condition("Content-Type", "audio/wav")
+    policy.add_content_length_range_condition(1, config.MAX_UPLOAD_BYTES)
+    # Signing is done locally, no request to MinIO
+    form_data = registry.get("minio_presign").presigned_post_policy(policy)
+
+    return {
+        "ticket_number": ticket_number,
+        "upload_url": f"http://{config.MINIO_PUBLIC_ENDPOINT}/{config.MINIO_BUCKET}",
+        "upload_fields": {**form_data, "key": audio_path, "Content-Type": "audio/wav"},
+        "max_size": config.MAX_UPLOAD_BYTES,
+        "expires_in": config.UPLOAD_URL_EXPIRY,
+        "filename": audio_path,
+    }
+
+
+@app.post("/uploads/{ticket_number}/complete")
+async def complete_upload_endpoint(ticket_number: str) -> dict:
+    """Enqueue the inference job of a direct upload, once the client PUT is done."""
+    return await complete_upload(ticket_number)
+
+
+@app.post("/minio/events")
+async def minio_events(request: Request, authorization: str | None = Header(None)) -> dict:
+    """MinIO bucket notification webhook.
+
+    MinIO posts an event for every object created under `audio/`,
+    the upload of the matching ticket is completed without waiting for the client.
+    Requests must carry `MINIO_WEBHOOK_TOKEN` (MinIO `auth_token`), all of them are
+    rejected if it is not set.
+    """
+    if not config.MINIO_WEBHOOK_TOKEN:
+        raise HTTPException(status_code=403, detail="Webhook disabled: no token configured")
+    token = (authorization or "").removeprefix("Bearer ")
+    if not hmac.compare_digest(token.encode(), config.MINIO_WEBHOOK_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid webhook token")
+
+    event = await request.json()
+    completed = []
+    for record in event.get("Records", []):
+        key = unquote_plus(record["s3"]["object"]["key"])
+        parts = key.split("/")
+        # Only direct uploads, stored under audio/{ticket_number}/
+        if len(parts) != 3 or parts[0] != "audio":
+            continue
+        try:
+            await complete_upload(parts[1])
+            completed.append(parts[1])
+        except HTTPException as e:
+            logging.info(f"Notification for {key} ignored: {e.detail}")
+
+    return {"completed": completed}
\ No newline at end of file
@@ -1,4 +1,6 @@
-from sqlalchemy import Integer, String, Float, ForeignKey
+from datetime import datetime
+
+from sqlalchemy import DateTime, Float, ForeignKey, Index, Integer, String, func
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from api.database import Base
 
@@ -13,16 +15,22 @@ class ServiceCall(Base):
     __tablename__ = 'service_calls'
     
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
-    ticket_number: Mapped[str] = mapped_column(String, nullable=False)
+    # Tickets are looked up by the status endpoint and the feedback consumer
+    ticket_number: Mapped[str] = mapped_column(String, nullable=False, unique=True, index=True)
     email: Mapped[str] = mapped_column(String, nullable=False)
     audio_path: Mapped[str] = mapped_column(String, nullable=False)
     audio_length: Mapped[float] = mapped_column(Float, nullable=True)
+    # queued -> processing -> done
+    status: Mapped[str] = mapped_column(String, nullable=False, server_default='queued')
     inference_results: Mapped[list["InferenceResult"]] = relationship(
         "InferenceResult", back_populates="service_call"
     )
     user_inputs: Mapped[list["UserInput"]] = relationship(
         "UserInput", back_populates="service_call"
     )
+    detections: Mapped[list["Detection"]] = relationship(
+        "Detection", back_populates="service_call"
+    )
 
 class InferenceResult(Base):
     __tablename__ = 'inference_results'
@@ -50,4 +58,29 @@ class UserInput(Base):
     bird_id: Mapped[int] = mapped_column(Integer, nullable=True)
     service_call: Mapped["ServiceCall"] = relationship(
         "ServiceCall", back_populates="user_inputs"
-    )
\ No newline at end of file
+    )
+
+
+class Detection(Base):
+    __tablename__ = 'detections'
+    __table_args__ = (
+        # Analytics queries select a species over a time range
+        Index('ix_detections_bird_id_detected_at', 'bird_id', 'detected_at'),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    service_call_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey('service_calls.id', ondelete='CASCADE'), index=True
+    )
+    bird_id: Mapped[int] = mapped_column(Integer, ForeignKey('birds.id'), nullable=False)
+    t_start: Mapped[float] = mapped_column(Float, nullable=False)  # seconds
+    t_end: Mapped[float] = mapped_column(Float, nullable=False)
+    f_start: Mapped[float] = mapped_column(Float, nullable=False)  # Hz
+    f_end: Mapped[float] = mapped_column(Float, nullable=False)
+    score: Mapped[float] = mapped_column(Float, nullable=False)
+    detected_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
+    service_call: Mapped["ServiceCall"] = relationship(
+        "ServiceCall", back_populates="detections"
+    )
@@ -1,17 +1,60 @@
+from typing import Literal
+
 from pydantic import BaseModel
 
 
 
+TicketStatus = Literal["queued", "processing", "done"]
+
+
 class AMQPMessage(BaseModel):
     ticket_number: str
+    traceparent: str | None = None  # W3C trace context of the ticket, see app_utils.tracing
     
 
+class StatusMessage(AMQPMessage):
+    """Progress of a ticket, sent by the workers on the feedback queue."""
+    message_type: Literal["status"] = "status"
+    status: TicketStatus
+
+
 class InferenceMessage(AMQPMessage):
     email: str
     soundfile_minio_path: str
     annotations_minio_path: str
     spectrogram_minio_path: str
+    audio_length: float | None = None  # seconds, read from the WAV header at upload
+    submitted_at: float | None = None  # epoch seconds, when the job was enqueued by the API
     
 
+class DetectionRecord(BaseModel):
+    bird_id: int
+    t_start: float  # seconds
+    t_end: float
+    f_start: float  # Hz
+    f_end: float
+    score: float
+
+
 class FeedbackMessage(InferenceMessage):
-    classification_score: float | None = None
\ No newline at end of file
+    classification_score: float | None = None
+    detections: list[DetectionRecord] = []
+    annotations: str | None = None  # content of the annotations file, sent by email
+
+
+class SegmentMessage(InferenceMessage):
+    """Sub-job of a long recording split across workers (map step)."""
+    job_type: Literal["segment"] = "segment"
+    segment_index: int
+    n_segments: int
+    first_window: int  # index of the first spectrogram window of the segment in the recording
+    n_windows: int
+    segment_minio_path: str
+    spectrogram_length: int  # spectrogram columns of the whole recording
+
+
+class ReduceMessage(InferenceMessage):
+    """Stitching of the detections of all the segments of a recording (reduce step)."""
+    job_type: Literal["reduce"] = "reduce"
+    n_segments: int
+    spectrogram_length: int
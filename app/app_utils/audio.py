@@ -0,0 +1,160 @@
+"""Audio Utility Module.
+
+This module provides helpers to inspect WAV uploads while they are streamed,
+without ever holding the whole file in memory:
+- `parse_wav_header` reads the RIFF/WAVE header from the first bytes of a file
+- `WavStreamReader` wraps a binary stream, validates the header and hashes
+  the content as it is read by the consumer (e.g. a MinIO multipart upload)
+
+"""
+
+import hashlib
+import struct
+
+# The "data" chunk must start within this many bytes, metadata chunks
+# (LIST, bext, ...) written by field recorders before it are usually a few KB
+MAX_HEADER_BYTES = 64 * 1024
+
+WAV_FORMATS = {
+    0x0001: "pcm",
+    0x0003: "float",
+    0xFFFE: "extensible",
+}
+
+
+def iter_chunks(data: bytes, offset: int = 12):
+    """Yield the (id, size, body offset) of the RIFF chunks whose header is in `data`."""
+    while offset + 8 <= len(data):
+        chunk_id = data[offset : offset + 4]
+        chunk_size = struct.unpack("<I", data[offset + 4 : offset + 8])[0]
+        body = offset + 8
+        yield chunk_id, chunk_size, body
+        # Chunks are padded to an even size
+        offset = body + chunk_size + (chunk_size % 2)
+
+
+def parse_fmt_chunk(body: bytes) -> dict:
+    """Parse the first 16 bytes of a "fmt " chunk into the audio format."""
+    format_tag, channels, sample_rate, _, block_align, bits_per_sample = struct.unpack(
+        "<HHIIHH", body
+    )
+    if format_tag not in WAV_FORMATS:
+        raise ValueError(f"Unsupported WAV encoding: 0x{format_tag:04x}")
+    if channels == 0 or sample_rate == 0 or block_align == 0:
+        raise ValueError("Invalid WAV file: empty audio format")
+    return {
+        "format": WAV_FORMATS[format_tag],
+        "channels": channels,
+        "sample_rate": sample_rate,
+        "block_align": block_align,
+        "bits_per_sample": bits_per_sample,
+    }
+
+
+def parse_wav_header(data: bytes):
+    """Parse the header of a WAV file.
+
+    Args:
+    ----
+        data (bytes): First bytes of the file.
+
+    Returns
+    -------
+        dict | None: The audio format (`format`, `channels`, `sample_rate`,
+        `bits_per_sample`, `data_offset`, `data_size`, `duration`),
+        or None if more bytes are needed to reach the "data" chunk.
+
+    Raises:
+    ------
+        ValueError: If the bytes are not a valid WAV header.
+
+    """
+    if len(data) < 12:
+        return None
+    if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise ValueError("Not a WAV file: missing RIFF/WAVE header")
+
+    fmt = None
+    for chunk_id, chunk_size, body in iter_chunks(data):
+        if chunk_id == b"fmt ":
+            if chunk_size < 16:
+                raise ValueError("Invalid WAV file: truncated fmt chunk")
+            if body + 16 > len(data):
+                return None
+            fmt = parse_fmt_chunk(data[body : body + 16])
+
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise ValueError("Invalid WAV file: data chunk before fmt chunk")
+            return {
+                **fmt,
+                "data_offset": body,
+                "data_size": chunk_size,
+                "duration": chunk_size / (fmt["sample_rate"] * fmt["block_align"]),
+            }
+
+    return None
+
+
+class WavStreamReader:
+    """File-like wrapper validating and hashing a WAV stream as it is read.
+
+    The header is parsed from the first bytes read, a `ValueError` is raised by
+    `read` as soon as it is known to be invalid, so that the consumer aborts
+    before uploading the rest of the file.
+    Only the header bytes are buffered, the content is hashed chunk by chunk.
+    """
+
+    def __init__(self, stream, max_header_bytes=MAX_HEADER_BYTES):
+        """Args:
+        ----
+            stream: Binary file-like object to read from.
+            max_header_bytes (int): Maximum offset of the "data" chunk.
+
+        """
+        self.stream = stream
+        self.max_header_bytes = max_header_bytes
+        self.header = None
+        self.n_bytes = 0
+        self._hash = hashlib.sha256()
+        self._header_bytes = b""
+
+    @property
+    def sha256(self) -> str:
+        """Hex digest of the bytes read so far."""
+        return self._hash.hexdigest()
+
+    @property
+    def duration(self):
+        """Duration of the audio, in seconds, once the stream is read.
+
+        Bounded by the bytes actually read: recorders streaming to disk
+        may leave a placeholder data chunk size in the header.
+        """
+        if self.header is None:
+            return None
+        data_size = min(self.header["data_size"], self.n_bytes - self.header["data_offset"])
+        return max(data_size, 0) / (self.header["sample_rate"] * self.header["block_align"])
+
+    def _check_header(self, chunk: bytes) -> None:
+        self._header_bytes += chunk[: self.max_header_bytes - len(self._header_bytes)]
+        self.header = parse_wav_header(self._header_bytes)
+        if self.header is None and len(self._header_bytes) >= self.max_header_bytes:
+            raise ValueError(
+                f"Invalid WAV file: no data chunk in the first {self.max_header_bytes} bytes"
+            )
+        if self.header is not None:
+            self._header_bytes = b""
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self.stream.read(size)
+        if self.header is None:
+            if chunk:
+                self._check_header(chunk)
+            elif self.n_bytes == 0:
+                raise ValueError("Empty file")
+            else:
+                raise ValueError("Invalid WAV file: truncated header")
+        self._hash.update(chunk)
+        self.n_bytes += len(chunk)
+        return chunk
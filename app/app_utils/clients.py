@@ -0,0 +1,232 @@
+"""Service Clients Module.
+
+This module builds the clients of the external services used by the API and the
+workers. It is the single place choosing between the real services and their
+in-process stand-ins (see app_utils.standins), with `CLIENTS_BACKEND`:
+
+- `live` (default): MinIO, RabbitMQ (aio-pika for the API, pika for the workers)
+  and the SMTP server configured by the environment
+- `local`: in-memory object store and broker and a null SMTP sink, shared by the
+  API and the workers running in the same process, for load tests
+
+The database is selected separately, by `ASYNC_DATABASE_URL` (e.g. SQLite).
+
+Each service keeps its clients in a `ClientRegistry`, instead of module globals:
+clients are built on first use, from the factories registered at import, shared by
+all threads or built once per thread (connections that are not thread-safe), and
+closed in reverse order on shutdown. Tests and benchmarks `override` them.
+
+"""
+
+import asyncio
+import contextlib
+import inspect
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from typing import Callable
+
+import aio_pika
+import pika
+from minio import Minio
+
+from app_utils import standins
+from app_utils.smtplib import SMTPConnection
+
+logging.basicConfig(level=logging.INFO)
+
+CLIENTS_BACKEND = os.getenv("CLIENTS_BACKEND", "live")
+
+
+def is_local() -> bool:
+    return CLIENTS_BACKEND == "local"
+
+
+def make_minio_client(endpoint, access_key, secret_key, **kwargs):
+    """Return a MinIO client, or the shared in-memory object store.
+
+    Args:
+    ----
+        endpoint (str): The MinIO endpoint.
+        access_key (str): The access key.
+        secret_key (str): The secret key.
+        **kwargs: Forwarded to `Minio` (http_client, region, ...).
+
+    """
+    if is_local():
+        return standins.object_store
+    return Minio(endpoint, access_key=access_key, secret_key=secret_key, secure=False, **kwargs)
+
+
+async def amqp_connect(**kwargs):
+    """Open an asyncio connection to RabbitMQ, or to the in-memory broker.
+
+    Usable as the `connect` argument of `AsyncPublisher` and `consume_feedback_messages`.
+    """
+    if is_local():
+        return await standins.connect(**kwargs)
+    return await aio_pika.connect_robust(**kwargs)
+
+
+def blocking_amqp_connect(host, port):
+    """Open a blocking connection to RabbitMQ, or to the in-memory broker."""
+    if is_local():
+        return standins.StandInBlockingConnection(standins.broker)
+    return pika.BlockingConnection(pika.ConnectionParameters(host=host, port=port))
+
+
+def smtp_connection_factory():
+    """Return the `connection_factory` of `EmailDispatcher`."""
+    if is_local():
+        return standins.NullSMTPConnection
+    return SMTPConnection
+
+
+#################### REGISTRY ####################
+@dataclass
+class ClientSpec:
+    factory: Callable
+    close: Callable | None = None
+    is_alive: Callable | None = None
+    per_thread: bool = False
+
+
+class ClientRegistry:
+    """Lazily built clients of a service, with lifecycle hooks."""
+
+    def __init__(self):
+        self._specs = {}
+        self._shared = {}
+        self._local = threading.local()
+        self._overrides = {}
+        self._created = []  # (name, client), in creation order
+        self._lock = threading.Lock()
+        self._build_locks = {}
+        self._async_locks = {}
+
+    def register(self, name, factory, close=None, is_alive=None, per_thread=False) -> None:
+        """Register the factory of a client.
+
+        Args:
+        ----
+            name (str): Name of the client.
+            factory (callable): Builds the client, without arguments. Coroutine functions
+                build async clients, which are got with `aget`.
+            close (callable, optional): Called with the client on shutdown,
+                may be a coroutine function.
+            is_alive (callable, optional): Called with the cached client before returning it,
+                a new one is built if it returns False (e.g. closed connection).
+            per_thread (bool): Build one client per thread, for clients that are not
+                thread-safe, like pika connections and channels.
+
+        """
+        self._specs[name] = ClientSpec(factory, close, is_alive, per_thread)
+
+    def override(self, name, client) -> None:
+        """Use `client` instead of building one, until `reset`."""
+        self._overrides[name] = client
+
+    def reset(self, name) -> None:
+        """Drop the override of a client."""
+        self._overrides.pop(name, None)
+
+    @contextlib.contextmanager
+    def overridden(self, name, client):
+        """Override a client for the duration of a `with` block."""
+        self.override(name, client)
+        try:
+            yield client
+        finally:
+            self.reset(name)
+
+    def _cache(self, spec) -> dict:
+        if not spec.per_thread:
+            return self._shared
+        if not hasattr(self._local, "clients"):
+            self._local.clients = {}
+        return self._local.clients
+
+    def _cached(self, name, spec):
+        client = self._cache(spec).get(name)
+        if client is not None and (spec.is_alive is None or spec.is_alive(client)):
+            return client
+        return None
+
+    def _store(self, name, spec, client):
+        self._cache(spec)[name] = client
+        with self._lock:
+            self._created.append((name, client))
+        return client
+
+    def get(self, name):
+        """Return a client, built on first use (thread-safe)."""
+        if name in self._overrides:
+            return self._overrides[name]
+        spec = self._specs[name]
+        client = self._cached(name, spec)
+        if client is not None:
+            return client
+        if spec.per_thread:
+            return self._store(name, spec, spec.factory())
+
+        with self._lock:
+            build_lock = self._build_locks.setdefault(name, threading.Lock())
+        # Other clients can be built meanwhile, only this one waits
+        with build_lock:
+            client = self._cached(name, spec)
+            if client is None:
+                client = self._store(name, spec, spec.factory())
+            return client
+
+    async def aget(self, name):
+        """Return a client from the event loop, awaiting its factory if needed."""
+        if name in self._overrides:
+            return self._overrides[name]
+        spec = self._specs[name]
+        client = self._cached(name, spec)
+        if client is not None:
+            return client
+
+        async with self._async_locks.setdefault(name, asyncio.Lock()):
+            client = self._cached(name, spec)
+            if client is None:
+                client = spec.factory()
+                if inspect.isawaitable(client):
+                    client = await client
+                client = self._store(name, spec, client)
+            return client
+
+    def _pop_closers(self) -> list:
+        """Forget the clients built so far and return their close hooks, newest first."""
+        with self._lock:
+            created, self._created = self._created, []
+        self._shared = {}
+        self._local = threading.local()
+
+        closers = []
+        for name, client in reversed(created):
+            spec = self._specs[name]
+            # Clients replaced because they were dead are not closed again
+            if spec.close is None or (spec.is_alive is not None and not spec.is_alive(client)):
+                continue
+            closers.append((name, client, spec.close))
+        return closers
+
+    def close(self) -> None:
+        """Close the clients built so far, in reverse creation order (sync hooks only)."""
+        for name, client, close in self._pop_closers():
+            try:
+                close(client)
+            except Exception as e:
+                logging.warning(f"Failed to close {name}: {e!r}")
+
+    async def aclose(self) -> None:
+        """Close the clients built so far, in reverse creation order."""
+        for name, client, close in self._pop_closers():
+            try:
+                result = close(client)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logging.warning(f"Failed to close {name}: {e!r}")
@@ -0,0 +1,42 @@
+"""Executors Utility Module.
+
+This module provides the thread pool used to run blocking client calls
+(MinIO, SMTP) from async code without stalling the event loop.
+The pool is bounded and shared: `minio.Minio` is thread-safe.
+
+"""
+
+import asyncio
+import functools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+logging.basicConfig(level=logging.INFO)
+
+IO_MAX_WORKERS = int(os.getenv("API_IO_MAX_WORKERS", "32"))
+
+_io_executor = None
+
+
+def get_io_executor() -> ThreadPoolExecutor:
+    """Return the shared, bounded thread pool for blocking storage calls."""
+    global _io_executor
+    if _io_executor is None:
+        logging.info(f"Starting I/O thread pool ({IO_MAX_WORKERS} threads)")
+        _io_executor = ThreadPoolExecutor(max_workers=IO_MAX_WORKERS, thread_name_prefix="io")
+    return _io_executor
+
+
+async def run_io(func, *args, **kwargs):
+    """Run a blocking storage call in the I/O thread pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_io_executor(), functools.partial(func, *args, **kwargs))
+
+
+def shutdown_executors() -> None:
+    """Wait for pending calls and stop the thread pool."""
+    global _io_executor
+    if _io_executor is not None:
+        _io_executor.shutdown(wait=True)
+    _io_executor = None
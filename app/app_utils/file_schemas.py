@@ -1,3 +1,4 @@
+from abc import abstractmethod
 from pydantic import BaseModel, Field
 from datetime import datetime
 import os
@@ -6,33 +7,32 @@ import uuid
 from fastapi import UploadFile
 from pydantic import ValidationError
 
-class UploadRecord(BaseModel):
+class AudioRecord(BaseModel):
+    """Audio file of a user, subclasses tell where its name comes from."""
     email: EmailStr
-    file: UploadFile
     timestamp: datetime = Field(default_factory=datetime.utcnow)
 
-    @field_validator('file')
-    def validate_file(cls, v):
-        if v.content_type not in ["audio/wav"]:
-            raise ValueError("Le fichier doit être un fichier audio .wav ou .mp3")
-        return v
+    @property
+    @abstractmethod
+    def source_filename(self) -> str:
+        """Name of the audio file, as given by the user."""
 
     def generate_filename(self) -> str:
         """Generate a filename based on filetype and timestamp."""
         timestamp_str = self.timestamp.strftime("%Y%m%d%H%M%S%f")
-        return f"{timestamp_str}_{self.file.filename}"
+        return f"{timestamp_str}_{self.source_filename}"
 
     def generate_annotation_filename(self) -> str:
         """Generate an annotation filename based on filetype and timestamp."""
         timestamp_str = self.timestamp.strftime("%Y%m%d%H%M%S%f")
-        base_name = os.path.splitext(self.file.filename)[0]
+        base_name = os.path.splitext(self.source_filename)[0]
         return f"{timestamp_str}_{base_name}_annot.txt"
     
     def generate_spectrogram_filename(self) -> str:
         """Generate a spectrogram filename based on filetype and timestamp."""
         timestamp_str = self.timestamp.strftime("%Y%m%d%H%M%S%f")
-        base_name = os.path.splitext(self.file.filename)[0]
-        return f"{timestamp_str}_{base_name}_spectro.pt"
+        base_name = os.path.splitext(self.source_filename)[0]
+        return f"{timestamp_str}_{base_name}_spectro.bspc"
 
     def get_audio_path(self, root_folder: str) -> str:
         """Generate the path for the audio file."""
@@ -45,5 +45,38 @@ class UploadRecord(BaseModel):
     def get_spectrogram_path(self, root_folder: str) -> str:
         """Generate the path for the spectrogram file."""
         return f"spectrograms/{self.generate_spectrogram_filename()}"
-    
-       
+
+
+class UploadRecord(AudioRecord):
+    """Audio file uploaded through the API."""
+    file: UploadFile
+
+    @field_validator('file')
+    def validate_file(cls, v):
+        if v.content_type not in ["audio/wav"]:
+            raise ValueError("Le fichier doit être un fichier audio .wav ou .mp3")
+        return v
+
+    @property
+    def source_filename(self) -> str:
+        return self.file.filename
+
+
+class UploadRequest(AudioRecord):
+    """Audio file uploaded by the client straight to MinIO, with a presigned URL."""
+    filename: str
+
+    @field_validator('filename')
+    def validate_filename(cls, v):
+        if not v.lower().endswith(".wav") or "/" in v:
+            raise ValueError("Le fichier doit être un fichier audio .wav")
+        return v
+
+    @property
+    def source_filename(self) -> str:
+        return self.filename
+
+    def get_audio_path(self, root_folder: str, ticket_number: str) -> str:
+        """Generate the path for the audio file, prefixed by the ticket so that
+        storage notifications can be matched to the pending upload."""
+        return f"audio/{ticket_number}/{self.generate_filename()}"
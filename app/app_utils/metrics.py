@@ -0,0 +1,59 @@
+"""Metrics Module.
+
+This module defines the Prometheus metrics of the API and the inference workers.
+The API serves them on its `/metrics` route, each worker on its own HTTP port
+(`WORKER_METRICS_PORT`).
+
+- `nbm_stage_seconds`: duration of the pipeline stages, by stage
+  (download, stft, forward, postprocess, merge, classify, upload, inference)
+- `nbm_windows_total` and `nbm_windows_per_second`: spectrogram windows run through
+  the model, and the throughput of the last recording
+- `nbm_queue_depth`: messages waiting in the RabbitMQ queues, sampled by the API
+- `nbm_ticket_latency_seconds`: end-to-end latency, from upload to results
+
+"""
+
+import contextlib
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+
+STAGE_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+TICKET_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+
+STAGE_SECONDS = Histogram(
+    "nbm_stage_seconds",
+    "Duration of the inference pipeline stages, forward passes are timed per batch",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+WINDOWS = Counter("nbm_windows", "Spectrogram windows run through the model")
+WINDOWS_PER_SECOND = Gauge(
+    "nbm_windows_per_second", "Windows run through the model per second, for the last recording"
+)
+QUEUE_DEPTH = Gauge("nbm_queue_depth", "Messages waiting in a RabbitMQ queue", ["queue"])
+TICKET_LATENCY = Histogram(
+    "nbm_ticket_latency_seconds",
+    "Time from the upload of a recording to the storage of its results",
+    ["lane"],
+    buckets=TICKET_BUCKETS,
+)
+
+
+def observe_stage(stage, seconds, n_windows=None) -> None:
+    """Record the duration of a stage, usable as the `stage_hook` of `run_detection`."""
+    STAGE_SECONDS.labels(stage=stage).observe(seconds)
+    if stage == "forward" and n_windows:
+        WINDOWS.inc(n_windows)
+    if stage == "inference" and n_windows and seconds > 0:
+        WINDOWS_PER_SECOND.set(n_windows / seconds)
+
+
+@contextlib.contextmanager
+def time_stage(stage):
+    """Time the block as a stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
@@ -2,17 +2,50 @@
 
 This module provides utility functions for interacting with MinIO object storage.
 Includes functions for ensuring bucket existence,
-writing files to MinIO, and fetching files from MinIO.
+writing and streaming files to MinIO, fetching files from MinIO,
+and storing small JSON documents.
+
+Files larger than a part are uploaded as multipart uploads, their parts sent
+concurrently. Several files can be written at once with `write_files_to_minio`,
+the clients then share a connection pool sized for the concurrent requests
+(see `make_http_client`).
 
 """
 
 import io
+import json
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from tempfile import NamedTemporaryFile
 
+import urllib3
+from minio.error import S3Error
+
 logging.basicConfig(level=logging.INFO)
 
+# Size of the parts of streamed uploads, 5 MiB is the minimum allowed by S3:
+# at most one part is held in memory per upload
+UPLOAD_PART_SIZE = int(os.getenv("MINIO_UPLOAD_PART_SIZE", str(5 * 1024 * 1024)))
+# Parts of a multipart upload sent concurrently
+PARALLEL_UPLOADS = int(os.getenv("MINIO_PARALLEL_UPLOADS", "4"))
+# Connections kept open to MinIO, shared by all the requests of a client
+HTTP_POOL_SIZE = int(os.getenv("MINIO_HTTP_POOL_SIZE", "16"))
+
+
+def make_http_client(maxsize=HTTP_POOL_SIZE) -> urllib3.PoolManager:
+    """Return a connection pool for `Minio(http_client=...)`.
+
+    The default pool of the MinIO client keeps 10 connections,
+    fewer than the concurrent part and object uploads of the worker.
+    Timeouts and retries are the defaults of the MinIO client.
+    """
+    return urllib3.PoolManager(
+        timeout=urllib3.Timeout(connect=300, read=300),
+        maxsize=maxsize,
+        retries=urllib3.Retry(total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]),
+    )
+
 
 def ensure_bucket_exists(minio_client, bucket_name) -> None:
     """Ensure that the specified bucket exists in MinIO, creating it if necessary.
@@ -32,15 +65,27 @@ def ensure_bucket_exists(minio_client, bucket_name) -> None:
         logging.info(f"Bucket '{bucket_name}' already exists.")
 
 
-def write_file_to_minio(minio_client, bucket_name, file_name, data) -> None:
+def write_file_to_minio(
+    minio_client,
+    bucket_name,
+    file_name,
+    data,
+    part_size=UPLOAD_PART_SIZE,
+    num_parallel_uploads=PARALLEL_UPLOADS,
+) -> None:
     """Write a file to MinIO.
 
+    Files larger than `part_size` are sent as multipart uploads,
+    `num_parallel_uploads` parts at a time.
+
     Args:
     ----
         minio_client (Minio): MinIO client instance.
         bucket_name (str): Name of the bucket to write the file to.
         file_name (str): Name of the file to be written.
         data (Union[bytes, IOBase]): File data as bytes or a file-like object.
+        part_size (int): Size of the uploaded parts, in bytes.
+        num_parallel_uploads (int): Number of parts uploaded concurrently.
 
     """
     logging.info(f"Writing file '{file_name}' to MinIO bucket '{bucket_name}'...")
@@ -52,7 +97,14 @@ def write_file_to_minio(minio_client, bucket_name, file_name, data) -> None:
         data.seek(0)
 
     try:
-        minio_client.put_object(bucket_name, file_name, data, length=length)
+        minio_client.put_object(
+            bucket_name,
+            file_name,
+            data,
+            length=length,
+            part_size=part_size,
+            num_parallel_uploads=num_parallel_uploads,
+        )
         logging.info(
             f"File '{file_name}' written to MinIO bucket '{bucket_name}' successfully."
         )
@@ -63,6 +115,85 @@ def write_file_to_minio(minio_client, bucket_name, file_name, data) -> None:
         raise
 
 
+def write_files_to_minio(minio_client, bucket_name, files, **kwargs) -> None:
+    """Write several files to MinIO concurrently.
+
+    Args:
+    ----
+        minio_client (Minio): MinIO client instance.
+        bucket_name (str): Name of the bucket to write the files to.
+        files (dict): File data (bytes or file-like objects), by file name.
+        **kwargs: Upload options of `write_file_to_minio`.
+
+    Raises:
+    ------
+        Exception: The error of the first failed upload, once all uploads are done.
+
+    """
+    if len(files) <= 1:
+        for file_name, data in files.items():
+            write_file_to_minio(minio_client, bucket_name, file_name, data, **kwargs)
+        return
+
+    with ThreadPoolExecutor(max_workers=len(files), thread_name_prefix="minio") as executor:
+        futures = [
+            executor.submit(
+                write_file_to_minio, minio_client, bucket_name, file_name, data, **kwargs
+            )
+            for file_name, data in files.items()
+        ]
+    for future in futures:
+        future.result()
+
+
+def stream_file_to_minio(
+    minio_client,
+    bucket_name,
+    file_name,
+    stream,
+    part_size=UPLOAD_PART_SIZE,
+    content_type="application/octet-stream",
+):
+    """Stream a file of unknown length to MinIO, as a multipart upload.
+
+    The stream is read one part at a time, so the file is never fully held in memory.
+    If reading the stream raises, the multipart upload is aborted and the error re-raised.
+
+    Args:
+    ----
+        minio_client (Minio): MinIO client instance.
+        bucket_name (str): Name of the bucket to write the file to.
+        file_name (str): Name of the file to be written.
+        stream (IOBase): Binary file-like object, read until EOF.
+        part_size (int): Size of the uploaded parts, in bytes.
+        content_type (str): Content type of the object.
+
+    Returns
+    -------
+        ObjectWriteResult: The result of the upload.
+
+    """
+    logging.info(f"Streaming file '{file_name}' to MinIO bucket '{bucket_name}'...")
+    try:
+        result = minio_client.put_object(
+            bucket_name,
+            file_name,
+            stream,
+            length=-1,
+            part_size=part_size,
+            content_type=content_type,
+        )
+        logging.info(
+            f"File '{file_name}' streamed to MinIO bucket '{bucket_name}' successfully."
+        )
+        return result
+    except Exception as e:
+        logging.error(
+            f"Error streaming file '{file_name}' to MinIO bucket '{bucket_name}': {e!s}"
+        )
+        raise
+
+
 def fetch_file_from_minio(
     minio_client, bucket_name, file_name, local_file_path
 ) -> bool:
@@ -113,3 +244,47 @@ def fetch_file_contents_from_minio(minio_client, minio_bucket, file_minio_path):
         return None
 
     return local_file_path
+
+
+def write_json_to_minio(minio_client, bucket_name, file_name, document) -> None:
+    """Write a JSON-serializable document to MinIO."""
+    data = json.dumps(document).encode()
+    minio_client.put_object(
+        bucket_name,
+        file_name,
+        io.BytesIO(data),
+        length=len(data),
+        content_type="application/json",
+    )
+
+
+def read_json_from_minio(minio_client, bucket_name, file_name):
+    """Read a JSON document from MinIO.
+
+    Returns
+    -------
+        The document, or None if the object does not exist.
+
+    """
+    response = None
+    try:
+        response = minio_client.get_object(bucket_name, file_name)
+        return json.loads(response.read())
+    except S3Error as e:
+        if e.code == "NoSuchKey":
+            return None
+        raise
+    finally:
+        if response is not None:
+            response.close()
+            response.release_conn()
+
+
+def read_object_head(minio_client, bucket_name, file_name, length) -> bytes:
+    """Read the first `length` bytes of an object, e.g. to check a file header."""
+    response = minio_client.get_object(bucket_name, file_name, offset=0, length=length)
+    try:
+        return response.read()
+    finally:
+        response.close()
+        response.release_conn()
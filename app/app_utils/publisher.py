@@ -0,0 +1,153 @@
+"""RabbitMQ Publisher Module.
+
+This module provides the asyncio publisher used by the API to enqueue messages.
+
+- Messages are published on a small pool of channels, in publisher confirm mode:
+  a publish only returns once the broker has taken responsibility for the message.
+- Concurrent publishes on a channel are pipelined, the broker acknowledges them
+  in batches (`multiple` flag), so confirms add little to the publish rate.
+- The connection is robust: it reconnects, and reopens its channels, when lost.
+  Publishes failing meanwhile are retried with exponential backoff and jitter,
+  and an error is only raised once the retries are exhausted.
+
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+
+import aio_pika
+from aio_pika.exceptions import AMQPError
+
+logging.basicConfig(level=logging.INFO)
+
+PUBLISHER_POOL_SIZE = int(os.getenv("PUBLISHER_POOL_SIZE", "4"))
+PUBLISHER_MAX_RETRIES = int(os.getenv("PUBLISHER_MAX_RETRIES", "5"))
+PUBLISHER_CONFIRM_TIMEOUT = float(os.getenv("PUBLISHER_CONFIRM_TIMEOUT", "10"))
+
+PUBLISH_ERRORS = (AMQPError, ConnectionError, asyncio.TimeoutError)
+
+
+class AsyncPublisher:
+    """Publish persistent JSON messages to RabbitMQ queues, with publisher confirms."""
+
+    def __init__(
+        self,
+        host,
+        port,
+        pool_size=PUBLISHER_POOL_SIZE,
+        max_retries=PUBLISHER_MAX_RETRIES,
+        confirm_timeout=PUBLISHER_CONFIRM_TIMEOUT,
+        backoff=0.2,
+        max_backoff=5.0,
+        connect=aio_pika.connect_robust,
+    ):
+        """Args:
+        ----
+            host (str): The hostname or IP address of the RabbitMQ server.
+            port (int): The port number of the RabbitMQ server.
+            pool_size (int): Number of channels messages are spread over.
+            max_retries (int): Number of retries of a failed publish.
+            confirm_timeout (float): Maximum time, in seconds, to wait for a confirm.
+            backoff (float): Delay before the first retry, doubled on every retry.
+            max_backoff (float): Maximum delay between retries.
+            connect (callable): Coroutine function opening the connection.
+
+        """
+        self.host = host
+        self.port = port
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.confirm_timeout = confirm_timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._connect = connect
+        self._connection = None
+        self._channels = []
+        self._channel_ids = None
+
+    async def start(self) -> None:
+        """Connect to RabbitMQ and open the channel pool."""
+        logging.info(f"Connecting publisher to RabbitMQ ({self.pool_size} channels)...")
+        self._connection = await self._connect(host=self.host, port=self.port)
+        self._channels = [
+            await self._connection.channel(publisher_confirms=True) for _ in range(self.pool_size)
+        ]
+        self._channel_ids = itertools.cycle(range(self.pool_size))
+
+    async def close(self) -> None:
+        """Close the channels and the connection, once pending confirms are received."""
+        for channel in self._channels:
+            await channel.close()
+        if self._connection is not None:
+            await self._connection.close()
+        self._channels = []
+        self._connection = None
+
+    async def _get_channel(self):
+        """Return the next channel of the pool, reopening it if it was closed."""
+        channel_id = next(self._channel_ids)
+        channel = self._channels[channel_id]
+        if channel.is_closed:
+            logging.info(f"Reopening publisher channel {channel_id}")
+            channel = await self._connection.channel(publisher_confirms=True)
+            self._channels[channel_id] = channel
+        return channel
+
+    async def declare_queue(self, queue_name) -> None:
+        """Declare a durable queue."""
+        channel = await self._get_channel()
+        await channel.declare_queue(queue_name, durable=True)
+
+    async def queue_depth(self, queue_name) -> int:
+        """Return the number of messages ready in a queue."""
+        channel = await self._get_channel()
+        queue = await channel.declare_queue(queue_name, passive=True)
+        return queue.declaration_result.message_count
+
+    async def publish(self, queue_name, message) -> None:
+        """Publish a message and wait for the broker confirm.
+
+        Args:
+        ----
+            queue_name (str): The name of the queue where the message will be published.
+            message (dict): The message to be published.
+
+        Raises:
+        ------
+            AMQPError | ConnectionError | asyncio.TimeoutError: If the message could not be
+                published after `max_retries` retries.
+
+        """
+        body = aio_pika.Message(
+            json.dumps(message).encode(),
+            content_type="application/json",
+            delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+        )
+        for attempt in range(self.max_retries + 1):
+            try:
+                channel = await self._get_channel()
+                await channel.default_exchange.publish(
+                    body, routing_key=queue_name, timeout=self.confirm_timeout
+                )
+                return
+            except PUBLISH_ERRORS as e:
+                if attempt == self.max_retries:
+                    logging.error(
+                        f"Failed to publish message to {queue_name} "
+                        f"after {attempt + 1} attempts: {e!r}"
+                    )
+                    raise
+                delay = min(self.max_backoff, self.backoff * 2**attempt)
+                delay *= random.uniform(0.5, 1.0)
+                logging.warning(
+                    f"Publish to {queue_name} failed ({e!r}), retrying in {delay:.2f}s..."
+                )
+                await asyncio.sleep(delay)
+
+    async def publish_many(self, queue_name, messages) -> None:
+        """Publish messages concurrently, their confirms are received in batches."""
+        await asyncio.gather(*(self.publish(queue_name, message) for message in messages))
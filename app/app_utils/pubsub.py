@@ -0,0 +1,74 @@
+"""In-process Publish/Subscribe Module.
+
+This module provides the broker pushing ticket events from the feedback consumer
+to the clients subscribed through the API (server-sent events, WebSockets).
+
+- Every subscription has its own bounded asyncio queue: a slow client never
+  blocks the feedback consumer, its oldest events are dropped instead.
+- Events only reach the subscribers of the process whose feedback consumer received
+  them: with several API processes (workers, replicas), RabbitMQ hands each feedback
+  message to one of them. Subscribers of the other processes catch up by reading the
+  ticket again when no event arrives for a while (see `follow_ticket` in api.main).
+
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+
+logging.basicConfig(level=logging.INFO)
+
+SUBSCRIPTION_QUEUE_SIZE = int(os.getenv("SUBSCRIPTION_QUEUE_SIZE", "16"))
+
+
+class TicketBroker:
+    """Fan out ticket events to the subscribers of each ticket, within this process."""
+
+    def __init__(self, queue_size=SUBSCRIPTION_QUEUE_SIZE):
+        """Args:
+        ----
+            queue_size (int): Maximum number of pending events per subscription.
+
+        """
+        self.queue_size = queue_size
+        self._subscriptions = {}
+
+    def subscriber_count(self, ticket_number=None) -> int:
+        if ticket_number is not None:
+            return len(self._subscriptions.get(ticket_number, ()))
+        return sum(len(queues) for queues in self._subscriptions.values())
+
+    def subscribe(self, ticket_number) -> asyncio.Queue:
+        """Return a new queue receiving the events of a ticket."""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscriptions.setdefault(ticket_number, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, ticket_number, queue) -> None:
+        queues = self._subscriptions.get(ticket_number)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscriptions[ticket_number]
+
+    @contextlib.contextmanager
+    def subscription(self, ticket_number):
+        """Subscribe to a ticket for the duration of a `with` block."""
+        queue = self.subscribe(ticket_number)
+        try:
+            yield queue
+        finally:
+            self.unsubscribe(ticket_number, queue)
+
+    def publish(self, ticket_number, event) -> None:
+        """Push an event to the subscribers of a ticket, without waiting."""
+        for queue in self._subscriptions.get(ticket_number, ()):
+            if queue.full():
+                logging.warning(f"Subscriber of {ticket_number} lagging, dropping an event")
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+
+ticket_broker = TicketBroker()
@@ -4,26 +4,46 @@ This module provides utility functions for interacting with RabbitMQ message bro
 includes functions for connecting to RabbitMQ, publishing messages, consuming messages,
 and processing feedback messages.
 
+Feedback messages are consumed by the API with an asyncio-native client (aio-pika):
+deliveries are pushed by the broker, up to `FEEDBACK_PREFETCH` unacknowledged
+messages are handled concurrently, database writes and emails being bounded separately.
+Status changes are pushed to the clients subscribed to the ticket (see app_utils.pubsub).
+
 """
 
 import asyncio
+import collections
+import contextlib
+import functools
 import json
 import logging
+import os
 import time
 from pydantic import ValidationError
+import aio_pika
 import pika
 
-from app_utils.amqp_schemas import FeedbackMessage
+from app_utils.amqp_schemas import FeedbackMessage, StatusMessage
+from app_utils.clients import blocking_amqp_connect
+from app_utils.executors import run_io
+from app_utils.metrics import TICKET_LATENCY
 from app_utils.minio import fetch_file_contents_from_minio
+from app_utils.pubsub import ticket_broker
 from app_utils.smtplib import send_email
+from app_utils.tracing import tracer
 
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
-# Global variable to manage RabbitMQ connection
-rabbit_connection = None
+# Inference jobs are routed to lanes by audio duration: short clips go to the interactive lane
+INTERACTIVE_LANE_SUFFIX = ".interactive"
+PRIORITY_SHORT_AUDIO_SECONDS = float(os.getenv("PRIORITY_SHORT_AUDIO_SECONDS", "60"))
+
+FEEDBACK_PREFETCH = int(os.getenv("FEEDBACK_PREFETCH", "32"))
+FEEDBACK_DB_CONCURRENCY = int(os.getenv("FEEDBACK_DB_CONCURRENCY", "8"))
+FEEDBACK_EMAIL_CONCURRENCY = int(os.getenv("FEEDBACK_EMAIL_CONCURRENCY", "4"))
 
 
 def connect_to_rabbitmq(
@@ -31,6 +51,9 @@ def connect_to_rabbitmq(
 ) -> pika.BlockingConnection:
     """Connect to RabbitMQ with automatic retries.
 
+    The connection is not thread-safe: the workers keep one per thread,
+    in their client registry (see app_utils.clients).
+
     Args:
     ----
         host (str): The hostname or IP address of the RabbitMQ server.
@@ -47,7 +70,6 @@ def connect_to_rabbitmq(
         Exception: If the connection to RabbitMQ fails after the specified number of retries.
 
     """
-    global rabbit_connection
     retry_count = 0
 
     while retry_count < max_retries:
@@ -55,11 +77,9 @@ def connect_to_rabbitmq(
             f"Attempting to connect to RabbitMQ (Attempt {retry_count + 1}/{max_retries})"
         )
         try:
-            rabbit_connection = pika.BlockingConnection(
-                pika.ConnectionParameters(host=host, port=port)
-            )
+            connection = blocking_amqp_connect(host, port)
             logging.info("Successfully connected to RabbitMQ")
-            return rabbit_connection
+            return connection
         except pika.exceptions.AMQPConnectionError as e:
             logging.error(
                 f"Error connecting to RabbitMQ: {e!s}. Retrying in {retry_delay} seconds..."
@@ -73,30 +93,12 @@ def connect_to_rabbitmq(
                 raise Exception("Failed to connect to RabbitMQ after multiple retries.")
 
 
-def get_rabbit_connection(host, port) -> pika.BlockingConnection:
-    """Get the current RabbitMQ connection or establishes a new one if necessary.
-
-    Returns
-    -------
-        pika.BlockingConnection: The active RabbitMQ connection.
-
-    """
-    global rabbit_connection
-    logging.info("Checking RabbitMQ connection")
-    if rabbit_connection is None or rabbit_connection.is_closed:
-        logging.info(
-            "RabbitMQ connection is None or closed. Establishing a new connection."
-        )
-        connect_to_rabbitmq(host, port)
-        logging.info("RabbitMQ connection established.")
-    else:
-        logging.info("RabbitMQ connection is active.")
-    return rabbit_connection
-
-
 def publish_message(channel, queue_name, message) -> None:
     """Publish a message to a specified RabbitMQ queue.
 
+    If publisher confirms are enabled on the channel (`channel.confirm_delivery()`),
+    this blocks until the broker has taken responsibility for the message.
+
     Args:
     ----
         channel: The active channel of the RabbitMQ connection.
@@ -107,6 +109,11 @@ def publish_message(channel, queue_name, message) -> None:
     -------
         None
 
+    Raises:
+    ------
+        pika.exceptions.AMQPError: If the message could not be published
+            or was rejected by the broker.
+
     """
     logging.info(f"Preparing to publish message to queue: {queue_name}")
     try:
@@ -121,6 +128,7 @@ def publish_message(channel, queue_name, message) -> None:
         logging.info(f"Published message: {message}")
     except Exception as e:
         logging.error(f"Failed to publish message: {e!s}")
+        raise
 
 
 def consume_messages(channel, queue_name, callback) -> None:
@@ -161,17 +169,156 @@ def consume_messages(channel, queue_name, callback) -> None:
 
 
 
-async def process_feedback_message(body, minio_client, minio_bucket) -> None:
+def get_lane_queues(queue_name) -> dict:
+    """Return the queues of the inference lanes, in priority order."""
+    return {
+        "interactive": f"{queue_name}{INTERACTIVE_LANE_SUFFIX}",
+        "bulk": queue_name,
+    }
+
+
+def get_lane(audio_length, short_audio_seconds=PRIORITY_SHORT_AUDIO_SECONDS) -> str:
+    """Return the lane of an inference job of `audio_length` seconds.
+
+    Jobs of unknown duration go to the bulk lane.
+    """
+    if audio_length is not None and audio_length <= short_audio_seconds:
+        return "interactive"
+    return "bulk"
+
+
+def route_by_duration(
+    queue_name, audio_length, short_audio_seconds=PRIORITY_SHORT_AUDIO_SECONDS
+) -> str:
+    """Return the queue of the lane an inference job of `audio_length` seconds goes to."""
+    return get_lane_queues(queue_name)[get_lane(audio_length, short_audio_seconds)]
+
+
+def consume_lanes(
+    connection, channel, lanes, callback, starvation_limit=4, wait_timeout=1.0, stop_event=None
+) -> None:
+    """Consume messages from prioritized queues, one message at a time.
+
+    Each lane has its own consumer, the broker pushes at most one unacknowledged message
+    per lane (`prefetch_count=1`): the worker waits for deliveries without polling,
+    and picks the next message among the ones delivered to it.
+    The first lane is always served first, unless it has been served `starvation_limit`
+    times in a row while the next lanes had messages waiting: the next lanes are then
+    served once, so that bulk jobs keep progressing under a steady flow of short jobs.
+
+    Args:
+    ----
+        connection (pika.BlockingConnection): The RabbitMQ connection, kept alive while idle.
+        channel: The active channel of the RabbitMQ connection.
+        lanes (dict): Lane names and their queue names, in priority order.
+        callback (function): The callback function invoked for each received message,
+            with the message body and the lane name as arguments. A message whose callback
+            raises is requeued on its first delivery, and dropped on its redelivery.
+        starvation_limit (int): Maximum number of consecutive first-lane messages
+            while other lanes are waiting.
+        wait_timeout (float): Time, in seconds, between two checks of `stop_event`
+            while no message is delivered.
+        stop_event (threading.Event, optional): Stops consuming, between two messages, once set.
+            The messages delivered but not processed yet are requeued.
+
+    Returns:
+    -------
+        None
+
+    """
+    lanes = list(lanes.items())
+    delivered = {lane: collections.deque() for lane, _ in lanes}
+
+    def on_message(lane, ch, method, properties, body):
+        delivered[lane].append((method, body))
+
+    # Per consumer: one message of each lane at most is reserved by this worker
+    channel.basic_qos(prefetch_count=1)
+    consumer_tags = [
+        channel.basic_consume(
+            queue=queue_name, on_message_callback=functools.partial(on_message, lane)
+        )
+        for lane, queue_name in lanes
+    ]
+    consecutive = 0
+    try:
+        while stop_event is None or not stop_event.is_set():
+            if any(delivered.values()):
+                # Take in the deliveries already received, without waiting
+                connection.process_data_events(time_limit=0)
+            else:
+                # Keeps processing heartbeats while waiting
+                connection.process_data_events(time_limit=wait_timeout)
+                continue
+
+            # Skip the first lane once it has been served too many times in a row
+            order = lanes[1:] + lanes[:1] if consecutive >= starvation_limit else lanes
+            lane = next(lane for lane, _ in order if delivered[lane])
+            method, body = delivered[lane].popleft()
+
+            consecutive = consecutive + 1 if lane == lanes[0][0] else 0
+            try:
+                callback(body, lane)
+            except Exception:
+                # A failing job does not stop the consumer: requeued once, then dropped
+                logging.exception(
+                    f"Failed to process {lane} message (redelivered={method.redelivered})"
+                )
+                channel.basic_nack(
+                    delivery_tag=method.delivery_tag, requeue=not method.redelivered
+                )
+                continue
+            channel.basic_ack(delivery_tag=method.delivery_tag)
+    finally:
+        if channel.is_open:
+            for consumer_tag in consumer_tags:
+                channel.basic_cancel(consumer_tag)
+            for lane_delivered in delivered.values():
+                for method, _ in lane_delivered:
+                    channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+
+
+async def process_status_message(status_message: StatusMessage, db_semaphore=None) -> None:
+    """Record the progress of a ticket sent by a worker."""
+    from api import crud
+    from api.cache import ticket_cache
+    from api.database import get_async_session
+
+    async with db_semaphore or contextlib.nullcontext():
+        async for session in get_async_session():
+            await crud.update_service_call_status(
+                session,
+                status_message.ticket_number,
+                status_message.status,
+                from_statuses=["queued", "processing"],
+            )
+    ticket_cache.invalidate(status_message.ticket_number)
+    ticket_broker.publish(status_message.ticket_number, {"status": status_message.status})
+
+
+async def process_feedback_message(
+    body,
+    minio_client,
+    minio_bucket,
+    db_semaphore=None,
+    email_semaphore=None,
+    email_dispatcher=None,
+) -> None:
     """Process a feedback message received from RabbitMQ.
 
     This function extracts the email, annotations MinIO path, and ticket number from the message body.
     It then sends an email using the extracted information and the provided MinIO client and bucket.
+    Status messages sent by the workers only update the status of the ticket.
 
     Args:
     ----
         body (bytes): The body of the feedback message received from RabbitMQ.
         minio_client (Minio): The MinIO client instance used to interact with MinIO.
         minio_bucket (str): The name of the MinIO bucket where the annotations file is stored.
+        db_semaphore (asyncio.Semaphore, optional): Bounds the concurrent database writes.
+        email_semaphore (asyncio.Semaphore, optional): Bounds the concurrent emails.
+        email_dispatcher (EmailDispatcher, optional): Queues the email, sent over a pooled
+            SMTP connection. Without it, the email is sent on a new connection.
 
     Returns:
     -------
@@ -179,12 +326,20 @@ async def process_feedback_message(body, minio_client, minio_bucket) -> None:
 
     """
     from api import crud
+    from api.cache import ticket_cache
     from api.database import get_async_session
     try:
-        feedback_message = FeedbackMessage.parse_raw(body.decode())
-    except ValidationError as e:
+        data = json.loads(body.decode())
+        if data.get("message_type") == "status":
+            feedback_message = StatusMessage(**data)
+        else:
+            feedback_message = FeedbackMessage(**data)
+    except (ValueError, ValidationError) as e:
         logging.error(f"Message validation error: {e}")
         return
+    if isinstance(feedback_message, StatusMessage):
+        await process_status_message(feedback_message, db_semaphore)
+        return
 
     email = feedback_message.email
     annotations_minio_path = feedback_message.annotations_minio_path
@@ -193,53 +348,182 @@ async def process_feedback_message(body, minio_client, minio_bucket) -> None:
     spectrogram_minio_path = feedback_message.spectrogram_minio_path
     classification_score = feedback_message.classification_score
 
-    async for session in get_async_session():
-        service_call = await crud.create_service_call(
-            session, email, ticket_number, soundfile_minio_path
-        )
-        await crud.create_inference_result(
-            session, 
-            service_call.id, 
-            annotations_minio_path, 
-            spectrogram_minio_path, 
-            classification_score
+    # Spans of the ticket trace, children of the worker span
+    traceparent = feedback_message.traceparent
+    span_attributes = {
+        "ticket_number": ticket_number,
+        "audio_length": feedback_message.audio_length,
+    }
+    with tracer.span("store_results", traceparent=traceparent, **span_attributes):
+        async with db_semaphore or contextlib.nullcontext():
+            async for session in get_async_session():
+                # The service call is recorded at upload, with the audio duration
+                service_call = await crud.get_service_call_by_ticket(session, ticket_number)
+                if service_call is not None and service_call.status == "done":
+                    # Redelivered after its results were committed, only notify again
+                    logging.info(f"Results of {ticket_number} already stored")
+                    continue
+                # All the writes are committed together: if one fails, none is kept
+                # and the requeued message stores the results from scratch
+                try:
+                    if service_call is None:
+                        service_call = await crud.create_service_call(
+                            session,
+                            email,
+                            ticket_number,
+                            soundfile_minio_path,
+                            feedback_message.audio_length,
+                            commit=False,
+                        )
+                    # Claims the ticket: the row stays locked until the commit, a message of
+                    # the same ticket handled concurrently then finds it done and stores nothing
+                    claimed = await crud.update_service_call_status(
+                        session,
+                        ticket_number,
+                        "done",
+                        from_statuses=["queued", "processing"],
+                        commit=False,
+                    )
+                    if not claimed:
+                        logging.info(f"Results of {ticket_number} already stored")
+                        await session.rollback()
+                        continue
+                    await crud.create_inference_result(
+                        session,
+                        service_call.id,
+                        annotations_minio_path,
+                        spectrogram_minio_path,
+                        classification_score,
+                        commit=False,
+                    )
+                    await crud.create_detections(
+                        session,
+                        service_call.id,
+                        [detection.dict() for detection in feedback_message.detections],
+                        commit=False,
+                    )
+                    await session.commit()
+                except Exception:
+                    await session.rollback()
+                    raise
+    ticket_cache.invalidate(ticket_number)
+    if feedback_message.submitted_at is not None:
+        TICKET_LATENCY.labels(lane=get_lane(feedback_message.audio_length)).observe(
+            time.time() - feedback_message.submitted_at
         )
+    # Subscribed clients are notified before the email is sent
+    ticket_broker.publish(ticket_number, {"status": "done"})
+
+    with tracer.span("email", traceparent=traceparent, **span_attributes):
+        if email_dispatcher is not None:
+            # The annotations are sent inline by the worker, no need to fetch them again
+            annotations = feedback_message.annotations
+            await email_dispatcher.submit(
+                email,
+                ticket_number,
+                annotations_minio_path,
+                file_data=annotations.encode() if annotations is not None else None,
+            )
+            return
+
+        # Fetching the annotations and sending the email are blocking
+        async with email_semaphore or contextlib.nullcontext():
+            await run_io(
+                send_email,
+                email,
+                annotations_minio_path,
+                ticket_number,
+                minio_client,
+                minio_bucket,
+            )
+
 
-    send_email(email, annotations_minio_path, ticket_number, minio_client, minio_bucket)
-    
 async def consume_feedback_messages(
-    rabbitmq_channel, feedback_queue, minio_client, minio_bucket, stop_event=None
+    rabbitmq_host,
+    rabbitmq_port,
+    feedback_queue,
+    minio_client,
+    minio_bucket,
+    stop_event=None,
+    prefetch_count=FEEDBACK_PREFETCH,
+    db_concurrency=FEEDBACK_DB_CONCURRENCY,
+    email_concurrency=FEEDBACK_EMAIL_CONCURRENCY,
+    email_dispatcher=None,
+    connect=None,
 ) -> None:
     """Consume feedback messages from the specified RabbitMQ queue.
 
-    This function continuously consumes feedback messages
-    from the specified RabbitMQ queue.
-    For each received message, it processes the message
-    using the `process_feedback_message` function
-    and acknowledges the message.
-    If no message is available, it waits for 1 second before checking again.
-    If the `stop_event` is set, it stops consuming messages after processing the current message.
+    Messages are pushed by the broker on an aio-pika connection, which reconnects
+    automatically. Each delivery is processed in its own task with `process_feedback_message`
+    and acknowledged once processed. The broker stops delivering when `prefetch_count`
+    messages are unacknowledged. A message failing for the first time is requeued,
+    it is dropped if it fails again.
+    If the `stop_event` is set, consumption stops and in-flight messages are awaited.
 
     Args:
     ----
-        rabbitmq_channel (pika.adapters.blocking_connection.BlockingChannel):
-            The RabbitMQ channel used for consuming messages.
+        rabbitmq_host (str): The hostname or IP address of the RabbitMQ server.
+        rabbitmq_port (int): The port number of the RabbitMQ server.
         feedback_queue (str): The name of the RabbitMQ queue to consume feedback messages from.
         minio_client (Minio): The MinIO client instance used to interact with MinIO.
         minio_bucket (str): The name of the MinIO bucket where the JSON files are stored.
         stop_event (asyncio.Event, optional): An event object that can be used to stop consuming messages.
+        prefetch_count (int): Maximum number of messages processed concurrently.
+        db_concurrency (int): Maximum number of concurrent database writes.
+        email_concurrency (int): Maximum number of concurrent emails.
+        email_dispatcher (EmailDispatcher, optional): Queues the emails,
+            see `process_feedback_message`.
+        connect (callable, optional): Coroutine function opening the connection,
+            `aio_pika.connect_robust` by default (see app_utils.clients).
 
     Returns:
     -------
         None
 
     """
-    while True:
-        method_frame, _, body = rabbitmq_channel.basic_get(queue=feedback_queue)
-        if method_frame:
-            await process_feedback_message(body, minio_client, minio_bucket)  # Await the coroutine
-            rabbitmq_channel.basic_ack(delivery_tag=method_frame.delivery_tag)
-            if stop_event and stop_event.is_set():
-                break
+    db_semaphore = asyncio.Semaphore(db_concurrency)
+    email_semaphore = asyncio.Semaphore(email_concurrency)
+    tasks = set()
+
+    async def handle_message(message: aio_pika.abc.AbstractIncomingMessage) -> None:
+        try:
+            await process_feedback_message(
+                message.body,
+                minio_client,
+                minio_bucket,
+                db_semaphore,
+                email_semaphore,
+                email_dispatcher,
+            )
+        except Exception as e:
+            logging.error(
+                f"Failed to process feedback message (redelivered={message.redelivered}): {e!s}"
+            )
+            await message.nack(requeue=not message.redelivered)
+        else:
+            await message.ack()
+
+    async def on_message(message: aio_pika.abc.AbstractIncomingMessage) -> None:
+        task = asyncio.create_task(handle_message(message))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    connect = connect or aio_pika.connect_robust
+    connection = await connect(host=rabbitmq_host, port=rabbitmq_port)
+    async with connection:
+        channel = await connection.channel()
+        await channel.set_qos(prefetch_count=prefetch_count)
+        queue = await channel.declare_queue(feedback_queue, durable=True)
+        consumer_tag = await queue.consume(on_message)
+        logging.info(
+            f"Consuming feedback messages from {feedback_queue} (prefetch={prefetch_count})"
+        )
+
+        if stop_event is None:
+            await asyncio.Future()  # Consume until cancelled
         else:
-            await asyncio.sleep(1)  # Wait for 1 second before checking again
+            await stop_event.wait()
+
+        await queue.cancel(consumer_tag)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
@@ -1,13 +1,37 @@
+"""SMTP Utility Module.
+
+This module sends the classification results by email.
+
+- `send_email` sends one email, on its own SMTP connection.
+- `EmailDispatcher` is used by the API: emails are queued in a bounded queue
+  and sent by a few tasks, each keeping its SMTP connection open between emails.
+  Transient failures (connection lost, 4xx replies) are retried with backoff.
+  In digest mode, the results of a recipient received within `digest_seconds`
+  are sent together, in a single email.
+
+"""
+
+import asyncio
 import logging
 import os
+import random
 import smtplib
 from email.mime.application import MIMEApplication
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from minio import Minio
+
+from app_utils.executors import run_io
 
 logging.basicConfig(level=logging.INFO)
 
+EMAIL_POOL_SIZE = int(os.getenv("EMAIL_POOL_SIZE", "2"))
+EMAIL_QUEUE_SIZE = int(os.getenv("EMAIL_QUEUE_SIZE", "1000"))
+EMAIL_MAX_RETRIES = int(os.getenv("EMAIL_MAX_RETRIES", "3"))
+EMAIL_SMTP_TIMEOUT = float(os.getenv("EMAIL_SMTP_TIMEOUT", "30"))
+# Digests are disabled by default: one email per ticket
+EMAIL_DIGEST_SECONDS = float(os.getenv("EMAIL_DIGEST_SECONDS", "0"))
+EMAIL_DIGEST_MAX_TICKETS = int(os.getenv("EMAIL_DIGEST_MAX_TICKETS", "50"))
+
 def get_smtp_config():
     """Get SMTP configuration from environment variables."""
     smtp_server = os.getenv("SMTP_SERVER", "mailhog")
@@ -47,6 +71,32 @@ def create_email_message(sender_email, recipient_email, ticket_number, file_data
 
     return message
 
+def create_digest_message(sender_email, recipient_email, results):
+    """Create a single email message with the results of several tickets.
+
+    Args:
+    ----
+        results (list): (ticket number, file data, filename) tuples.
+
+    """
+    message = MIMEMultipart()
+    message["From"] = sender_email
+    message["To"] = recipient_email
+    message["Subject"] = f"Classification Results - {len(results)} tickets"
+
+    ticket_numbers = [f"Ticket Number: {ticket_number}" for ticket_number, _, _ in results]
+    body = "Please find the classification results attached.\n\n" + "\n".join(ticket_numbers)
+    message.attach(MIMEText(body, "plain"))
+
+    for _, file_data, filename in results:
+        file_attachment = MIMEApplication(file_data, _subtype="octet-stream")
+        file_attachment.add_header(
+            "Content-Disposition", "attachment", filename=filename
+        )
+        message.attach(file_attachment)
+
+    return message
+
 def send_email_message(smtp_server, smtp_port, message):
     """Send the email message using the SMTP server."""
     try:
@@ -78,4 +128,205 @@ def send_email(email, file_path, ticket_number, minio_client, minio_bucket) -> N
     
     filename = os.path.basename(file_path)
     message = create_email_message(sender_email, email, ticket_number, file_data, filename)
-    send_email_message(smtp_server, smtp_port, message)
\ No newline at end of file
+    send_email_message(smtp_server, smtp_port, message)
+
+
+#################### DISPATCHER ####################
+def is_transient_error(error) -> bool:
+    """Whether sending an email again may succeed."""
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused)):
+        return False
+    # Lost connections, timeouts, refused connections
+    return isinstance(error, OSError)
+
+
+class SMTPConnection:
+    """SMTP connection opened on first use and kept open between emails."""
+
+    def __init__(self, smtp_server, smtp_port, timeout=EMAIL_SMTP_TIMEOUT):
+        self.smtp_server = smtp_server
+        self.smtp_port = smtp_port
+        self.timeout = timeout
+        self._server = None
+
+    def send(self, message) -> None:
+        if self._server is None:
+            self._server = smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=self.timeout)
+            logging.debug("SMTP server connection established")
+        try:
+            self._server.send_message(message)
+        except Exception:
+            # The connection may be in any state, a new one is opened on the next email
+            self.close()
+            raise
+
+    def close(self) -> None:
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self._server = None
+
+
+class EmailDispatcher:
+    """Send result emails from a bounded queue, over persistent SMTP connections."""
+
+    def __init__(
+        self,
+        minio_client,
+        minio_bucket,
+        pool_size=EMAIL_POOL_SIZE,
+        queue_size=EMAIL_QUEUE_SIZE,
+        max_retries=EMAIL_MAX_RETRIES,
+        digest_seconds=EMAIL_DIGEST_SECONDS,
+        digest_max_tickets=EMAIL_DIGEST_MAX_TICKETS,
+        backoff=1.0,
+        max_backoff=30.0,
+        connection_factory=SMTPConnection,
+    ):
+        """Args:
+        ----
+            minio_client (Minio): Client fetching the annotations not sent inline.
+            minio_bucket (str): The name of the MinIO bucket of the annotations.
+            pool_size (int): Number of SMTP connections, i.e. of emails sent concurrently.
+            queue_size (int): Maximum number of emails waiting to be sent,
+                `submit` waits when the queue is full.
+            max_retries (int): Number of retries of an email failing transiently.
+            digest_seconds (float): Time during which the results of a recipient
+                are gathered in a single email, 0 sends one email per ticket.
+            digest_max_tickets (int): Maximum number of tickets of a digest.
+            backoff (float): Delay before the first retry, doubled on every retry.
+            max_backoff (float): Maximum delay between retries.
+            connection_factory (callable): Opens an SMTP connection, from the server and port.
+
+        """
+        self.smtp_server, self.smtp_port, self.sender_email = get_smtp_config()
+        self.minio_client = minio_client
+        self.minio_bucket = minio_bucket
+        self.pool_size = pool_size
+        self.queue_size = queue_size
+        self.max_retries = max_retries
+        self.digest_seconds = digest_seconds
+        self.digest_max_tickets = digest_max_tickets
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._connections = [
+            connection_factory(self.smtp_server, self.smtp_port) for _ in range(pool_size)
+        ]
+        self._queue = None
+        self._workers = []
+        self._digests = {}
+        self._digest_timers = {}
+
+    async def start(self) -> None:
+        logging.info(
+            f"Starting email dispatcher ({self.pool_size} connections, "
+            f"digest={self.digest_seconds}s)"
+        )
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._workers = [
+            asyncio.create_task(self._send_loop(connection)) for connection in self._connections
+        ]
+
+    async def stop(self) -> None:
+        """Send the pending digests and queued emails, then close the connections."""
+        for timer in self._digest_timers.values():
+            timer.cancel()
+        self._digest_timers = {}
+        for email in list(self._digests):
+            await self._flush(email)
+        await self._queue.join()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        for connection in self._connections:
+            await run_io(connection.close)
+
+    async def submit(self, email, ticket_number, file_path, file_data=None) -> None:
+        """Queue the results email of a ticket.
+
+        Args:
+        ----
+            email (str): The recipient.
+            ticket_number (str): The ticket number.
+            file_path (str): The MinIO path of the annotations file.
+            file_data (bytes, optional): The annotations, fetched from MinIO if not given.
+
+        """
+        result = (ticket_number, file_path, file_data)
+        if self.digest_seconds <= 0:
+            await self._queue.put((email, [result]))
+            return
+
+        results = self._digests.setdefault(email, [])
+        results.append(result)
+        if len(results) >= self.digest_max_tickets:
+            timer = self._digest_timers.pop(email, None)
+            if timer is not None:
+                timer.cancel()
+            await self._flush(email)
+        elif len(results) == 1:
+            self._digest_timers[email] = asyncio.create_task(self._flush_later(email))
+
+    async def _flush_later(self, email) -> None:
+        await asyncio.sleep(self.digest_seconds)
+        self._digest_timers.pop(email, None)
+        await self._flush(email)
+
+    async def _flush(self, email) -> None:
+        results = self._digests.pop(email, None)
+        if results:
+            await self._queue.put((email, results))
+
+    async def _send_loop(self, connection) -> None:
+        while True:
+            email, results = await self._queue.get()
+            try:
+                await self._deliver(connection, email, results)
+            except Exception as e:
+                logging.error(f"Failed to prepare email to {email}: {e!s}")
+            finally:
+                self._queue.task_done()
+
+    def _create_message(self, email, results):
+        """Create the email of the results, fetching the annotations not sent inline."""
+        attachments = []
+        for ticket_number, file_path, file_data in results:
+            if file_data is None:
+                file_data = fetch_file_from_minio(self.minio_client, self.minio_bucket, file_path)
+            if file_data is None:
+                logging.error(f"Failed to fetch file from MinIO for ticket #{ticket_number}")
+                continue
+            attachments.append((ticket_number, file_data, os.path.basename(file_path)))
+
+        if not attachments:
+            return None
+        if len(attachments) == 1:
+            return create_email_message(self.sender_email, email, *attachments[0])
+        return create_digest_message(self.sender_email, email, attachments)
+
+    async def _deliver(self, connection, email, results) -> None:
+        message = await run_io(self._create_message, email, results)
+        if message is None:
+            logging.error(f"No results to send to {email}. Email not sent.")
+            return
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                await run_io(connection.send, message)
+                logging.info(f"Email sent successfully to {email}: {message['Subject']}")
+                return
+            except Exception as e:
+                if not is_transient_error(e) or attempt == self.max_retries:
+                    logging.error(
+                        f"Failed to send email to {email}: {message['Subject']}. Error: {e!s}"
+                    )
+                    return
+                delay = min(self.max_backoff, self.backoff * 2**attempt)
+                delay *= random.uniform(0.5, 1.0)
+                logging.warning(f"Email to {email} failed ({e!r}), retrying in {delay:.2f}s...")
+                await asyncio.sleep(delay)
@@ -0,0 +1,172 @@
+"""Spectrogram Artifact Module.
+
+This module provides the compact binary format (`.bspc`) of the spectrogram windows
+published with the classification results, in place of pickled float32 tensors.
+
+Layout (little-endian):
+- magic `BSPC`, format version (uint8), dtype code (uint8), compression code (uint8),
+  a reserved byte and the length of the JSON header (uint32)
+- the JSON header: window `indices`, `shape` (height, width), per-window `offsets`
+  and `scales` of uint8 windows, and the STFT `params`
+- the windows, contiguous, optionally compressed as a single zstd frame
+
+uint8 windows are quantized linearly between the minimum and maximum of each window,
+like the PNG images of the training set: the values are normalized dB in [0, 1],
+so 256 levels keep the error below 0.002. float16 windows are stored as is.
+
+`read_spectrogram` maps the windows onto the buffer without copying them
+(uncompressed artifacts), they are only converted to float32 when accessed.
+
+"""
+
+import json
+import logging
+import os
+import struct
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:  # Compression is optional
+    zstandard = None
+
+logging.basicConfig(level=logging.INFO)
+
+SPECTROGRAM_EXTENSION = ".bspc"
+SPECTROGRAM_DTYPE = os.getenv("SPECTROGRAM_DTYPE", "uint8")
+SPECTROGRAM_COMPRESSION = os.getenv("SPECTROGRAM_COMPRESSION", "zstd")
+SPECTROGRAM_ZSTD_LEVEL = int(os.getenv("SPECTROGRAM_ZSTD_LEVEL", "3"))
+
+MAGIC = b"BSPC"
+VERSION = 1
+PREAMBLE = struct.Struct("<4sBBBxI")
+
+DTYPES = {1: "uint8", 2: "float16"}
+DTYPE_CODES = {name: code for code, name in DTYPES.items()}
+COMPRESSIONS = {0: None, 1: "zstd"}
+COMPRESSION_CODES = {name: code for code, name in COMPRESSIONS.items()}
+
+
+def to_numpy(window) -> np.ndarray:
+    """Return a window as a float32 array, from a numpy array or a (GPU) tensor."""
+    if hasattr(window, "detach"):
+        window = window.detach().cpu().numpy()
+    return np.asarray(window, dtype=np.float32)
+
+
+def write_spectrogram(
+    spectrogram, params=None, dtype=SPECTROGRAM_DTYPE, compression=SPECTROGRAM_COMPRESSION
+) -> bytes:
+    """Serialize spectrogram windows.
+
+    Args:
+    ----
+        spectrogram (list): (window index, window) pairs, windows of the same shape.
+        params (dict, optional): STFT parameters stored in the header.
+        dtype (str): "uint8" or "float16".
+        compression (str | None): "zstd" or None. Falls back to None, with a warning,
+            if zstandard is not installed.
+
+    Returns
+    -------
+        bytes: The artifact.
+
+    """
+    if dtype not in DTYPE_CODES:
+        raise ValueError(f"Unsupported spectrogram dtype: {dtype}")
+    if compression not in COMPRESSION_CODES:
+        raise ValueError(f"Unsupported spectrogram compression: {compression}")
+    if compression == "zstd" and zstandard is None:
+        logging.warning("zstandard is not installed, spectrogram stored uncompressed")
+        compression = None
+
+    windows = [to_numpy(window) for _, window in spectrogram]
+    shape = windows[0].shape if windows else (0, 0)
+    header = {
+        "indices": [int(idx) for idx, _ in spectrogram],
+        "shape": list(shape),
+        "params": params or {},
+    }
+
+    data = np.empty((len(windows), *shape), dtype=dtype)
+    if dtype == "uint8":
+        offsets, scales = [], []
+        for i, window in enumerate(windows):
+            low, high = float(window.min()), float(window.max())
+            scale = (high - low) / 255 or 1.0
+            data[i] = np.round((window - low) / scale)
+            offsets.append(low)
+            scales.append(scale)
+        header["offsets"] = offsets
+        header["scales"] = scales
+    else:
+        for i, window in enumerate(windows):
+            data[i] = window
+
+    payload = data.tobytes()
+    if compression == "zstd":
+        payload = zstandard.ZstdCompressor(level=SPECTROGRAM_ZSTD_LEVEL).compress(payload)
+
+    header_bytes = json.dumps(header).encode()
+    preamble = PREAMBLE.pack(
+        MAGIC, VERSION, DTYPE_CODES[dtype], COMPRESSION_CODES[compression], len(header_bytes)
+    )
+    return preamble + header_bytes + payload
+
+
+class SpectrogramArtifact:
+    """Spectrogram windows read from an artifact, dequantized on access."""
+
+    def __init__(self, header, data):
+        self.indices = header["indices"]
+        self.params = header["params"]
+        self.data = data  # (n_windows, height, width), stored dtype
+        self._offsets = header.get("offsets")
+        self._scales = header.get("scales")
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def window(self, i) -> np.ndarray:
+        """Return the i-th window (in storage order) as float32."""
+        if self._scales is None:
+            return self.data[i].astype(np.float32)
+        return self.data[i] * np.float32(self._scales[i]) + np.float32(self._offsets[i])
+
+    def __iter__(self):
+        """Iterate over (window index, window) pairs, like the spectrogram of `run_detection`."""
+        for i, idx in enumerate(self.indices):
+            yield idx, self.window(i)
+
+
+def read_spectrogram(buffer) -> SpectrogramArtifact:
+    """Read an artifact from bytes or any object exposing the buffer protocol (e.g. mmap).
+
+    Uncompressed windows are a view of `buffer`, which must stay alive while they are used.
+
+    Raises
+    ------
+        ValueError: If the buffer is not a spectrogram artifact.
+
+    """
+    view = memoryview(buffer)
+    if len(view) < PREAMBLE.size:
+        raise ValueError("Not a spectrogram artifact: truncated preamble")
+    magic, version, dtype_code, compression_code, header_size = PREAMBLE.unpack_from(view)
+    if magic != MAGIC:
+        raise ValueError("Not a spectrogram artifact: bad magic")
+    if version != VERSION or dtype_code not in DTYPES or compression_code not in COMPRESSIONS:
+        raise ValueError(f"Unsupported spectrogram artifact (version {version})")
+
+    header_end = PREAMBLE.size + header_size
+    header = json.loads(bytes(view[PREAMBLE.size : header_end]))
+    payload = view[header_end:]
+    if COMPRESSIONS[compression_code] == "zstd":
+        if zstandard is None:
+            raise ValueError("zstandard is required to read compressed spectrogram artifacts")
+        payload = zstandard.ZstdDecompressor().decompress(payload)
+
+    data = np.frombuffer(payload, dtype=DTYPES[dtype_code])
+    data = data.reshape(len(header["indices"]), *header["shape"])
+    return SpectrogramArtifact(header, data)
@@ -0,0 +1,444 @@
+"""Local Stand-ins Module.
+
+This module provides in-process stand-ins for the external services, used by the
+load-testing mode (`CLIENTS_BACKEND=local`, see app_utils.clients) to run the API
+and the workers in a single process, without MinIO, RabbitMQ or an SMTP server:
+
+- `StandInObjectStore`: in-memory object store with the subset of the `Minio` client
+  used by the services. Presigned URLs are only formatted, nothing serves them.
+- `StandInBroker`: in-memory durable queues, shared by an aio-pika shaped interface
+  (`connect`, for the API) and a pika shaped one (`StandInBlockingConnection`, for
+  the workers). Asyncio consumers get at most `prefetch_count` unacknowledged
+  messages, nacked messages are requeued at the front, like RabbitMQ does.
+- `NullSMTPConnection`: counts the emails and drops them.
+
+The stand-ins are thread-safe: the workers run in threads, the API on its event loop.
+They keep everything in memory and only live as long as the process.
+
+"""
+
+import asyncio
+import io
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from minio.error import S3Error
+
+logging.basicConfig(level=logging.INFO)
+
+
+#################### OBJECT STORE ####################
+class StandInResponse:
+    """Body of a `get_object` call, like the urllib3 response of the MinIO client."""
+
+    def __init__(self, data):
+        self._data = io.BytesIO(data)
+
+    def read(self, amt=None) -> bytes:
+        return self._data.read(amt)
+
+    def close(self) -> None:
+        pass
+
+    def release_conn(self) -> None:
+        pass
+
+
+class StandInObjectStore:
+    """In-memory object store, replacing the `Minio` client."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def _error(self, code, bucket_name, object_name=None) -> S3Error:
+        resource = f"/{bucket_name}/{object_name or ''}"
+        return S3Error(code, code, resource, None, None, None, bucket_name, object_name)
+
+    def _bucket(self, bucket_name) -> dict:
+        bucket = self._buckets.get(bucket_name)
+        if bucket is None:
+            raise self._error("NoSuchBucket", bucket_name)
+        return bucket
+
+    def _object(self, bucket_name, object_name):
+        obj = self._bucket(bucket_name).get(object_name)
+        if obj is None:
+            raise self._error("NoSuchKey", bucket_name, object_name)
+        return obj
+
+    def bucket_exists(self, bucket_name) -> bool:
+        return bucket_name in self._buckets
+
+    def make_bucket(self, bucket_name, location=None) -> None:
+        with self._lock:
+            self._buckets.setdefault(bucket_name, {})
+
+    def put_object(
+        self,
+        bucket_name,
+        object_name,
+        data,
+        length,
+        content_type="application/octet-stream",
+        **kwargs,
+    ):
+        content = data.read() if length < 0 else data.read(length)
+        obj = SimpleNamespace(
+            data=content,
+            size=len(content),
+            content_type=content_type,
+            last_modified=datetime.now(timezone.utc),
+        )
+        with self._lock:
+            self._bucket(bucket_name)[object_name] = obj
+        return SimpleNamespace(bucket_name=bucket_name, object_name=object_name)
+
+    def fput_object(self, bucket_name, object_name, file_path, **kwargs):
+        with open(file_path, "rb") as file:
+            return self.put_object(bucket_name, object_name, file, os.path.getsize(file_path))
+
+    def get_object(self, bucket_name, object_name, offset=0, length=0, **kwargs):
+        data = self._object(bucket_name, object_name).data
+        end = offset + length if length else None
+        return StandInResponse(data[offset:end])
+
+    def fget_object(self, bucket_name, object_name, file_path, **kwargs):
+        data = self._object(bucket_name, object_name).data
+        with open(file_path, "wb") as file:
+            file.write(data)
+
+    def stat_object(self, bucket_name, object_name, **kwargs):
+        obj = self._object(bucket_name, object_name)
+        return SimpleNamespace(
+            bucket_name=bucket_name,
+            object_name=object_name,
+            size=obj.size,
+            content_type=obj.content_type,
+            last_modified=obj.last_modified,
+        )
+
+    def remove_object(self, bucket_name, object_name, **kwargs) -> None:
+        with self._lock:
+            self._bucket(bucket_name).pop(object_name, None)
+
+    def list_objects(self, bucket_name, prefix=None, recursive=False, **kwargs):
+        with self._lock:
+            names = sorted(self._bucket(bucket_name))
+        return [
+            SimpleNamespace(bucket_name=bucket_name, object_name=name)
+            for name in names
+            if prefix is None or name.startswith(prefix)
+        ]
+
+    def presigned_get_object(self, bucket_name, object_name, expires=None, **kwargs) -> str:
+        return f"local://{bucket_name}/{object_name}"
+
+    def presigned_put_object(self, bucket_name, object_name, expires=None, **kwargs) -> str:
+        return f"local://{bucket_name}/{object_name}?upload"
+
+    def presigned_post_policy(self, policy) -> dict:
+        return {"policy": "local", "x-amz-signature": "local"}
+
+
+#################### BROKER ####################
+class StandInBroker:
+    """In-memory queues, delivering to asyncio consumers and to polling workers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queues = {}
+        self._consumers = {}  # queue name -> StandInConsumer
+
+    def declare(self, queue_name) -> None:
+        with self._lock:
+            self._queues.setdefault(queue_name, deque())
+
+    def depth(self, queue_name) -> int:
+        """Number of messages ready in a queue, unacknowledged ones excluded."""
+        with self._lock:
+            return len(self._queues.get(queue_name, ()))
+
+    def put(self, queue_name, body, redelivered=False, front=False) -> None:
+        with self._lock:
+            queue = self._queues.setdefault(queue_name, deque())
+            if front:
+                queue.appendleft((body, redelivered))
+            else:
+                queue.append((body, redelivered))
+            consumer = self._consumers.get(queue_name)
+        if consumer is not None:
+            consumer.wake()
+
+    def get(self, queue_name):
+        """Pop the next message of a queue, as a (body, redelivered) pair, or None."""
+        with self._lock:
+            queue = self._queues.get(queue_name)
+            return queue.popleft() if queue else None
+
+    def add_consumer(self, queue_name, consumer) -> None:
+        with self._lock:
+            self._consumers[queue_name] = consumer
+        consumer.wake()
+
+    def remove_consumer(self, queue_name) -> None:
+        with self._lock:
+            self._consumers.pop(queue_name, None)
+
+
+class StandInIncomingMessage:
+    """Delivered message, acknowledged like an aio-pika incoming message."""
+
+    def __init__(self, consumer, body, redelivered):
+        self.consumer = consumer
+        self.body = body
+        self.redelivered = redelivered
+
+    async def ack(self) -> None:
+        self.consumer.settle()
+
+    async def nack(self, requeue=True) -> None:
+        if requeue:
+            self.consumer.broker.put(self.consumer.queue_name, self.body, True, front=True)
+        self.consumer.settle()
+
+
+class StandInConsumer:
+    """Deliver the messages of a queue to an asyncio callback, `prefetch_count` at a time."""
+
+    def __init__(self, broker, queue_name, callback, prefetch_count, loop):
+        self.broker = broker
+        self.queue_name = queue_name
+        self.callback = callback
+        self.prefetch_count = prefetch_count
+        self.loop = loop
+        self.unacked = 0
+
+    def wake(self) -> None:
+        # Messages may be published from the worker threads
+        self.loop.call_soon_threadsafe(self._deliver)
+
+    def settle(self) -> None:
+        self.unacked -= 1
+        self._deliver()
+
+    def _deliver(self) -> None:
+        while not self.prefetch_count or self.unacked < self.prefetch_count:
+            item = self.broker.get(self.queue_name)
+            if item is None:
+                return
+            self.unacked += 1
+            message = StandInIncomingMessage(self, *item)
+            self.loop.create_task(self.callback(message))
+
+
+class StandInQueue:
+    def __init__(self, channel, queue_name):
+        self.channel = channel
+        self.name = queue_name
+        self._tags = itertools.count()
+
+    @property
+    def declaration_result(self):
+        return SimpleNamespace(message_count=self.channel.broker.depth(self.name))
+
+    async def consume(self, callback) -> str:
+        consumer = StandInConsumer(
+            self.channel.broker,
+            self.name,
+            callback,
+            self.channel.prefetch_count,
+            asyncio.get_running_loop(),
+        )
+        self.channel.broker.add_consumer(self.name, consumer)
+        return f"standin-{next(self._tags)}"
+
+    async def cancel(self, consumer_tag) -> None:
+        self.channel.broker.remove_consumer(self.name)
+
+
+class StandInExchange:
+    def __init__(self, broker):
+        self.broker = broker
+
+    async def publish(self, message, routing_key, timeout=None) -> None:
+        # Queued synchronously: confirmed as soon as published
+        self.broker.put(routing_key, message.body)
+
+
+class StandInChannel:
+    """aio-pika shaped channel of the stand-in broker."""
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.prefetch_count = 0
+        self.is_closed = False
+        self.default_exchange = StandInExchange(broker)
+
+    async def set_qos(self, prefetch_count=0) -> None:
+        self.prefetch_count = prefetch_count
+
+    async def declare_queue(self, queue_name, durable=True, passive=False) -> StandInQueue:
+        self.broker.declare(queue_name)
+        return StandInQueue(self, queue_name)
+
+    async def close(self) -> None:
+        self.is_closed = True
+
+
+class StandInConnection:
+    """aio-pika shaped connection of the stand-in broker."""
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    async def channel(self, publisher_confirms=True) -> StandInChannel:
+        return StandInChannel(self.broker)
+
+    async def close(self) -> None:
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+
+class StandInBlockingChannel:
+    """pika shaped channel of the stand-in broker, for the workers.
+
+    Messages are removed from their queue when fetched, nacked messages are put back.
+    Consumers get at most `prefetch_count` unacknowledged messages each, delivered by
+    `StandInBlockingConnection.process_data_events`.
+    """
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.is_open = True
+        self.prefetch_count = 0
+        self._delivery_tags = itertools.count(1)
+        self._consumer_tags = itertools.count(1)
+        self._consumers = {}  # consumer tag -> (queue name, callback)
+        self._unacked = {}  # delivery tag -> (queue name, body, consumer tag)
+
+    def queue_declare(self, queue, durable=True, **kwargs) -> None:
+        self.broker.declare(queue)
+
+    def confirm_delivery(self) -> None:
+        pass
+
+    def basic_publish(self, exchange, routing_key, body, properties=None) -> None:
+        if isinstance(body, str):
+            body = body.encode()
+        self.broker.put(routing_key, body)
+
+    def basic_get(self, queue, auto_ack=False):
+        item = self.broker.get(queue)
+        if item is None:
+            return None, None, None
+        return self._method_frame(queue, item), None, item[0]
+
+    def _method_frame(self, queue, item, consumer_tag=None) -> SimpleNamespace:
+        body, redelivered = item
+        method_frame = SimpleNamespace(
+            delivery_tag=next(self._delivery_tags), redelivered=redelivered
+        )
+        self._unacked[method_frame.delivery_tag] = (queue, body, consumer_tag)
+        return method_frame
+
+    def basic_qos(self, prefetch_count=0, **kwargs) -> None:
+        self.prefetch_count = prefetch_count
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False, **kwargs) -> str:
+        consumer_tag = f"ctag{next(self._consumer_tags)}"
+        self._consumers[consumer_tag] = (queue, on_message_callback)
+        return consumer_tag
+
+    def basic_cancel(self, consumer_tag) -> None:
+        self._consumers.pop(consumer_tag, None)
+
+    def deliver(self) -> int:
+        """Deliver the messages waiting in the consumed queues, return their number."""
+        n_delivered = 0
+        for consumer_tag, (queue, callback) in list(self._consumers.items()):
+            unacked = sum(1 for *_, tag in self._unacked.values() if tag == consumer_tag)
+            if self.prefetch_count and unacked >= self.prefetch_count:
+                continue
+            item = self.broker.get(queue)
+            if item is None:
+                continue
+            callback(self, self._method_frame(queue, item, consumer_tag), None, item[0])
+            n_delivered += 1
+        return n_delivered
+
+    def basic_ack(self, delivery_tag=0, multiple=False) -> None:
+        self._unacked.pop(delivery_tag, None)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True) -> None:
+        queue, body, _ = self._unacked.pop(delivery_tag)
+        if requeue:
+            self.broker.put(queue, body, redelivered=True, front=True)
+
+
+class StandInBlockingConnection:
+    """pika shaped connection of the stand-in broker."""
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.is_closed = False
+        self._channels = []
+
+    def channel(self) -> StandInBlockingChannel:
+        channel = StandInBlockingChannel(self.broker)
+        self._channels.append(channel)
+        return channel
+
+    def process_data_events(self, time_limit=0) -> None:
+        """Deliver the waiting messages to the consumers, waiting up to `time_limit` seconds
+        (forever if None) for at least one. The queues are polled, in process."""
+        deadline = None if time_limit is None else time.monotonic() + time_limit
+        while not sum(channel.deliver() for channel in self._channels):
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            time.sleep(0.005)
+
+    def sleep(self, duration) -> None:
+        time.sleep(duration)
+
+    def close(self) -> None:
+        self.is_closed = True
+
+
+#################### SMTP ####################
+class NullSMTPConnection:
+    """SMTP connection dropping the emails, see `EmailDispatcher(connection_factory=...)`."""
+
+    sent = 0
+    _lock = threading.Lock()
+
+    def __init__(self, smtp_server=None, smtp_port=None, **kwargs):
+        pass
+
+    def send(self, message) -> None:
+        with NullSMTPConnection._lock:
+            NullSMTPConnection.sent += 1
+
+    def close(self) -> None:
+        pass
+
+
+# Shared by the API and the workers of the process
+object_store = StandInObjectStore()
+broker = StandInBroker()
+
+
+async def connect(**kwargs) -> StandInConnection:
+    """Open a connection to the stand-in broker, in place of `aio_pika.connect_robust`."""
+    return StandInConnection(broker)
@@ -0,0 +1,266 @@
+"""Tracing Module.
+
+This module provides lightweight tracing of the inference pipeline: a ticket is
+one trace, made of spans for the API enqueue, the worker pipeline and its stages,
+and the handling of the results by the API.
+
+- Spans are tagged with the ticket number, the audio duration and the host.
+- The trace context is carried from service to service by the `traceparent` field
+  of the AMQP messages, in the W3C Trace Context format.
+- Finished spans go to a pluggable sink, chosen with `TRACING_SINK`:
+  `none` (default), `jsonl` (one JSON object per line, `TRACING_JSONL_PATH`)
+  or `otlp` (OTLP/HTTP JSON export to a local collector, `TRACING_OTLP_ENDPOINT`).
+
+Stages timed by the model (see the `stage_hook` of `run_detection`) are recorded
+as spans after the fact, with `record_stage`.
+
+"""
+
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import queue
+import secrets
+import socket
+import threading
+import time
+import urllib.request
+
+logging.basicConfig(level=logging.INFO)
+
+TRACING_SINK = os.getenv("TRACING_SINK", "none")
+TRACING_JSONL_PATH = os.getenv("TRACING_JSONL_PATH", "traces.jsonl")
+TRACING_OTLP_ENDPOINT = os.getenv("TRACING_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "nbm")
+
+HOST = socket.gethostname()
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """A timed operation of a trace."""
+
+    def __init__(self, name, trace_id, parent_id=None, attributes=None, start_ns=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = {"host.name": HOST, **(attributes or {})}
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = None
+        self.error = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def child(self, name, attributes=None, start_ns=None):
+        # Children inherit the ticket attributes of their parent
+        attributes = {**self.attributes, **(attributes or {})}
+        return Span(name, self.trace_id, self.span_id, attributes, start_ns)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_s": (self.end_ns - self.start_ns) / 1e9,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+def parse_traceparent(traceparent):
+    """Return the trace id and parent span id of a `traceparent`, or None if it is invalid."""
+    try:
+        version, trace_id, span_id, _ = traceparent.split("-")
+        int(trace_id, 16), int(span_id, 16)
+    except (AttributeError, ValueError):
+        return None
+    if version != "00" or len(trace_id) != 32 or len(span_id) != 16:
+        return None
+    return trace_id, span_id
+
+
+#################### SINKS ####################
+class JsonLinesSink:
+    """Append finished spans to a file, one JSON object per line."""
+
+    def __init__(self, path=TRACING_JSONL_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span) -> None:
+        line = json.dumps(span.to_dict()) + "\n"
+        with self._lock, open(self.path, "a") as file:
+            file.write(line)
+
+
+def to_otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OTLPSink:
+    """Export finished spans to an OTLP/HTTP collector, in batches, from a background thread.
+
+    Spans are dropped, with a warning, if the collector is unreachable.
+    """
+
+    def __init__(
+        self,
+        endpoint=TRACING_OTLP_ENDPOINT,
+        service_name=TRACING_SERVICE_NAME,
+        batch_size=256,
+        flush_interval=1.0,
+        timeout=5.0,
+    ):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self._queue = queue.Queue(maxsize=10 * batch_size)
+        threading.Thread(target=self._export_loop, name="otlp-export", daemon=True).start()
+
+    def export(self, span) -> None:
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            logging.warning("OTLP export queue full, dropping a span")
+
+    @staticmethod
+    def span_to_otlp(span) -> dict:
+        return {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "parentSpanId": span.parent_id or "",
+            "name": span.name,
+            "kind": 1,  # internal
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns),
+            "attributes": [
+                {"key": key, "value": to_otlp_value(value)}
+                for key, value in span.attributes.items()
+                if value is not None
+            ],
+            "status": {"code": 2, "message": span.error} if span.error else {},
+        }
+
+    def to_otlp(self, spans) -> dict:
+        resource = {
+            "attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]
+        }
+        scope_spans = {
+            "scope": {"name": "app_utils.tracing"},
+            "spans": [self.span_to_otlp(span) for span in spans],
+        }
+        return {"resourceSpans": [{"resource": resource, "scopeSpans": [scope_spans]}]}
+
+    def _export_loop(self) -> None:
+        while True:
+            spans = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(spans) < self.batch_size and time.monotonic() < deadline:
+                try:
+                    spans.append(self._queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            request = urllib.request.Request(
+                self.endpoint,
+                data=json.dumps(self.to_otlp(spans)).encode(),
+                headers={"Content-Type": "application/json"},
+            )
+            try:
+                urllib.request.urlopen(request, timeout=self.timeout).close()
+            except OSError as e:
+                logging.warning(f"Failed to export {len(spans)} spans to {self.endpoint}: {e!s}")
+
+
+def make_sink(name=TRACING_SINK):
+    if name == "jsonl":
+        return JsonLinesSink()
+    if name == "otlp":
+        return OTLPSink()
+    if name not in ("none", ""):
+        logging.warning(f"Unknown tracing sink {name!r}, spans are not exported")
+    return None
+
+
+#################### TRACER ####################
+class Tracer:
+    """Create spans, keep track of the current one, and export them once finished."""
+
+    def __init__(self, sink=None):
+        self.sink = sink
+
+    def _finish(self, span) -> None:
+        span.end_ns = span.end_ns or time.time_ns()
+        if self.sink is not None:
+            try:
+                self.sink.export(span)
+            except Exception as e:
+                logging.warning(f"Failed to export span {span.name}: {e!s}")
+
+    @contextlib.contextmanager
+    def span(self, name, traceparent=None, **attributes):
+        """Run the block in a span, child of the current span.
+
+        Args:
+        ----
+            name (str): Name of the span.
+            traceparent (str, optional): Remote parent, used when there is no current span,
+                e.g. the `traceparent` of the message being handled. A new trace is
+                started if it is missing or invalid.
+            **attributes: Tags of the span (ticket_number, audio_length, ...).
+
+        """
+        parent = _current_span.get()
+        if parent is not None:
+            span = parent.child(name, attributes)
+        else:
+            context = parse_traceparent(traceparent)
+            trace_id, parent_id = context or (secrets.token_hex(16), None)
+            span = Span(name, trace_id, parent_id, attributes)
+
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = repr(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            self._finish(span)
+
+    def record_stage(self, stage, seconds, n_windows=None) -> None:
+        """Record a finished stage of `seconds` as a child of the current span,
+        usable as the `stage_hook` of `run_detection`."""
+        parent = _current_span.get()
+        if parent is None:
+            return
+        end_ns = time.time_ns()
+        attributes = {"n_windows": n_windows} if n_windows is not None else None
+        span = parent.child(stage, attributes, start_ns=end_ns - int(seconds * 1e9))
+        span.end_ns = end_ns
+        self._finish(span)
+
+
+def current_traceparent():
+    """Return the `traceparent` of the current span, to propagate it in a message."""
+    span = _current_span.get()
+    return span.traceparent if span is not None else None
+
+
+tracer = Tracer(make_sink())
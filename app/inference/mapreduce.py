@@ -0,0 +1,228 @@
+"""Map-Reduce Inference Module.
+
+This module splits long recordings into segments processed by several workers
+in parallel, and stitches their detections back together.
+
+- Map: the recording is cut into segments of consecutive spectrogram windows.
+  Segment boundaries are aligned on the window grid of the whole recording
+  (`HOP_SPECTRO` columns of `HOP_LENGTH` samples), so that the windows of a segment
+  are exactly the windows of the whole recording it covers. Consecutive segments
+  overlap by `W_PIX - HOP_SPECTRO` columns, like consecutive windows.
+- Reduce: the per-window outputs of all segments are concatenated in window order
+  and merged with `merge_images`, which drops the boxes cut by window borders
+  and runs a global non-maximum suppression, as for a recording processed at once.
+
+Each segment is normalized on its own, like the chunks of `File_Processor.process_long_file`.
+
+Partials are stored as spectrogram artifacts (`.bspc`, see app_utils.spectrogram), never as
+pickles: their windows are float16, their boxes and scores are JSON in the header.
+
+"""
+
+import io
+import math
+import os
+from types import SimpleNamespace
+
+import soundfile
+import torch
+from app_utils.spectrogram import SPECTROGRAM_EXTENSION, read_spectrogram, write_spectrogram
+
+from src.features.file_processor import File_Processor
+
+# Window geometry of File_Processor.process_file, with its default parameters
+W_PIX = 1024
+HOP_SPECTRO = int((1 - 0.2) * W_PIX)
+HOP_LENGTH = int(File_Processor.FREQ * 0.003)
+SAMPLE_RATE = File_Processor.FREQ
+
+# STFT parameters stored with the spectrogram artifacts
+STFT_PARAMS = {
+    "sample_rate": SAMPLE_RATE,
+    "win_length": int(SAMPLE_RATE / 33.3),
+    "hop_length": HOP_LENGTH,
+    "low_freq": File_Processor.LOW_FREQ,
+    "h_pix": File_Processor.H_PIX,
+    "w_pix": W_PIX,
+    "hop_spectro": HOP_SPECTRO,
+}
+
+
+def count_windows(n_columns, w_pix=W_PIX, hop=HOP_SPECTRO) -> int:
+    """Return the number of windows File_Processor.split_power_spec cuts a spectrogram into."""
+    return max(1, int(1 + math.ceil((n_columns - w_pix) / hop)))
+
+
+def spectrogram_columns(n_samples, hop_length=HOP_LENGTH) -> int:
+    """Return the number of columns of the (centered) STFT of `n_samples` samples."""
+    return 1 + n_samples // hop_length
+
+
+def plan_segments(n_samples, segment_windows) -> list:
+    """Cut a recording into segments of `segment_windows` consecutive windows.
+
+    Returns
+    -------
+        list: One dict per segment, with its `first_window`, number of windows `n_windows`,
+        and the `start_sample` and `end_sample` of its audio.
+
+    """
+    n_windows = count_windows(spectrogram_columns(n_samples))
+    segments = []
+    for first_window in range(0, n_windows, segment_windows):
+        n_seg_windows = min(segment_windows, n_windows - first_window)
+        start_sample = first_window * HOP_SPECTRO * HOP_LENGTH
+        if first_window + n_seg_windows == n_windows:
+            end_sample = n_samples
+        else:
+            # Exactly the columns of the segment windows
+            n_columns = (n_seg_windows - 1) * HOP_SPECTRO + W_PIX
+            end_sample = start_sample + (n_columns - 1) * HOP_LENGTH + 1
+        segments.append(
+            {
+                "first_window": first_window,
+                "n_windows": n_seg_windows,
+                "start_sample": start_sample,
+                "end_sample": end_sample,
+            }
+        )
+    return segments
+
+
+def write_segment(data, segment) -> io.BytesIO:
+    """Return the audio of a segment as an in-memory WAV file."""
+    buffer = io.BytesIO()
+    soundfile.write(
+        buffer,
+        data[segment["start_sample"] : segment["end_sample"]],
+        SAMPLE_RATE,
+        format="WAV",
+    )
+    buffer.seek(0)
+    return buffer
+
+
+def get_segment_path(ticket_number, index) -> str:
+    return f"segments/{ticket_number}/{index:05d}.wav"
+
+
+def get_partials_prefix(ticket_number) -> str:
+    return f"partials/{ticket_number}/"
+
+
+def get_partial_path(ticket_number, index) -> str:
+    return f"{get_partials_prefix(ticket_number)}{index:05d}{SPECTROGRAM_EXTENSION}"
+
+
+def get_reduce_marker_path(ticket_number) -> str:
+    return f"reduced/{ticket_number}"
+
+
+# Tensor dtypes of the detections stored in partials
+PARTIAL_DTYPES = {"float32": torch.float32, "int64": torch.int64}
+
+
+def encode_tensor(tensor) -> dict:
+    return {
+        "dtype": str(tensor.dtype).removeprefix("torch."),
+        "shape": list(tensor.shape),
+        "values": tensor.flatten().tolist(),
+    }
+
+
+def decode_tensor(data) -> torch.Tensor:
+    if data["dtype"] not in PARTIAL_DTYPES:
+        raise ValueError(f"Unsupported partial tensor dtype: {data['dtype']}")
+    return torch.tensor(data["values"], dtype=PARTIAL_DTYPES[data["dtype"]]).reshape(data["shape"])
+
+
+def make_partial(outputs, spectrogram, first_window, n_windows, last) -> io.BytesIO:
+    """Serialize the detections of a segment, in the window indices of the whole recording.
+
+    Args:
+    ----
+        outputs (list): Batched per-window outputs of `run_detection` on the segment.
+        spectrogram (list): (window index, window) pairs of the windows with detections.
+        first_window (int): Index of the first window of the segment in the recording.
+        n_windows (int): Number of windows of the segment, trailing windows beyond it
+            belong to the next segment. The last segment keeps all its windows.
+        last (bool): Whether this is the last segment of the recording.
+
+    """
+    window_outputs = [window for batch in outputs for window in batch]
+    if not last:
+        window_outputs = window_outputs[:n_windows]
+    spectrogram = [
+        (first_window + idx, window) for idx, window in spectrogram if last or idx < n_windows
+    ]
+    detections = {
+        "first_window": first_window,
+        "outputs": [
+            {
+                class_idx: {key: encode_tensor(value) for key, value in boxes.items()}
+                for class_idx, boxes in window.items()
+            }
+            for window in window_outputs
+        ],
+    }
+    # float16 windows: the spectrogram published after the reduce is quantized to uint8
+    return io.BytesIO(write_spectrogram(spectrogram, params=detections, dtype="float16"))
+
+
+def read_partial(data) -> dict:
+    """Deserialize a partial written by `make_partial`.
+
+    Raises
+    ------
+        ValueError: If `data` is not a partial.
+
+    """
+    artifact = read_spectrogram(data)
+    return {
+        "first_window": artifact.params["first_window"],
+        "outputs": [
+            {
+                class_idx: {key: decode_tensor(value) for key, value in boxes.items()}
+                for class_idx, boxes in window.items()
+            }
+            for window in artifact.params["outputs"]
+        ],
+        "spectrogram": list(artifact),
+    }
+
+
+def reduce_partials(partials, spectrogram_length):
+    """Stitch the partial detections of all segments.
+
+    Args:
+    ----
+        partials (list): Deserialized partials, in any order.
+        spectrogram_length (int): Number of spectrogram columns of the whole recording.
+
+    Returns
+    -------
+        tuple: A File_Processor-like object with the window geometry of the recording,
+        the outputs in the format of `run_detection` (a single batch) and the spectrogram.
+
+    """
+    partials = sorted(partials, key=lambda partial: partial["first_window"])
+    outputs, spectrogram = [], []
+    for partial in partials:
+        outputs.extend(partial["outputs"])
+        spectrogram.extend(partial["spectrogram"])
+
+    fp = SimpleNamespace(
+        W_PIX=W_PIX,
+        HOP_SPECTRO=HOP_SPECTRO,
+        spectrogram_length=spectrogram_length,
+        filename=None,
+    )
+    return fp, [outputs], spectrogram
+
+
+def load_recording(local_file_path):
+    """Load a recording, resampled to the model sampling rate."""
+    data = File_Processor(local_file_path).load()
+    if data is None:
+        raise ValueError(f"Failed to load {os.path.basename(local_file_path)}")
+    return data
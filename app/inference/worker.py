@@ -30,16 +30,55 @@ import json
 import logging
 import os
 import io
-import torch
+import tempfile
+import soundfile
 
 
-from app_utils.minio import write_file_to_minio
-from app_utils.rabbitmq import consume_messages, get_rabbit_connection, publish_message
-from minio import Minio
+from app_utils.metrics import observe_stage, time_stage
+from app_utils.tracing import current_traceparent, tracer
+from app_utils.clients import ClientRegistry, make_minio_client
+from app_utils.minio import (
+    make_http_client,
+    write_file_to_minio,
+    write_files_to_minio,
+)
+from app_utils.spectrogram import write_spectrogram
+from app_utils.rabbitmq import (
+    connect_to_rabbitmq,
+    consume_lanes,
+    get_lane_queues,
+    publish_message,
+)
+from inference.mapreduce import (
+    HOP_LENGTH,
+    HOP_SPECTRO,
+    SAMPLE_RATE,
+    STFT_PARAMS,
+    get_partial_path,
+    get_partials_prefix,
+    get_reduce_marker_path,
+    get_segment_path,
+    load_recording,
+    make_partial,
+    plan_segments,
+    read_partial,
+    reduce_partials,
+    spectrogram_columns,
+    write_segment,
+)
+from prometheus_client import start_http_server
+from minio.error import S3Error
 from model_serve.model_serve import ModelServer
 from pydantic import ValidationError
+from src.features.energy_gate import Energy_Gate
 from src.models.bird_dict import BIRD_DICT
-from app_utils.amqp_schemas import InferenceMessage, FeedbackMessage
+from app_utils.amqp_schemas import (
+    FeedbackMessage,
+    InferenceMessage,
+    ReduceMessage,
+    SegmentMessage,
+    StatusMessage,
+)
 
 logging.basicConfig(
     level=logging.INFO,
@@ -57,78 +96,202 @@ RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")
 RABBITMQ_PORT = int(os.getenv("RABBITMQ_PORT", "5672"))
 FORWARDING_QUEUE = os.getenv("RABBITMQ_QUEUE_API2INF")
 FEEDBACK_QUEUE = os.getenv("RABBITMQ_QUEUE_INF2API")
-logger.info(f":[INFERENCE_PROCESS_BATCH_SIZE]: {os.getenv('INFERENCE_PROCESS_BATCH_SIZE')}")
-INFERENCE_PROCESS_BATCH_SIZE = int(os.getenv("INFERENCE_PROCESS_BATCH_SIZE", "10"))
 
+# Short clips (interactive lane) are served first, but bulk jobs are served at least
+# once every INFERENCE_STARVATION_LIMIT interactive jobs
+INFERENCE_LANES = get_lane_queues(FORWARDING_QUEUE)
+INFERENCE_STARVATION_LIMIT = int(os.getenv("INFERENCE_STARVATION_LIMIT", "4"))
+
+# Energy gate: skip spectrogram windows that are confidently empty before running the model
+ENERGY_GATE = os.getenv("ENERGY_GATE", "false").lower() == "true"
+ENERGY_GATE_ENERGY_THRESHOLD = float(os.getenv("ENERGY_GATE_ENERGY_THRESHOLD", "0.12"))
+ENERGY_GATE_FLUX_THRESHOLD = float(os.getenv("ENERGY_GATE_FLUX_THRESHOLD", "0.01"))
+
+# Long-strip mode: share backbone computations between overlapping windows
+INFERENCE_STRIP_MODE = os.getenv("INFERENCE_STRIP_MODE", "false").lower() == "true"
+
+# Model batch size (windows per forward pass), or host-specific settings picked by the autotuner
+INFERENCE_BATCH_SIZE = int(os.getenv("INFERENCE_BATCH_SIZE", "10"))
+INFERENCE_AUTOTUNE = os.getenv("INFERENCE_AUTOTUNE", "false").lower() == "true"
+AUTOTUNE_PROFILE_PATH = os.getenv("AUTOTUNE_PROFILE_PATH", "models/autotune_profile.json")
+
+# Map-reduce: recordings longer than MAPREDUCE_MIN_SECONDS are split into segments
+# of about MAPREDUCE_SEGMENT_SECONDS, processed in parallel by all the workers
+MAPREDUCE = os.getenv("MAPREDUCE", "false").lower() == "true"
+MAPREDUCE_MIN_SECONDS = float(os.getenv("MAPREDUCE_MIN_SECONDS", "900"))
+MAPREDUCE_SEGMENT_SECONDS = float(os.getenv("MAPREDUCE_SEGMENT_SECONDS", "300"))
+MAPREDUCE_SEGMENT_WINDOWS = max(
+    1, round(MAPREDUCE_SEGMENT_SECONDS * SAMPLE_RATE / (HOP_SPECTRO * HOP_LENGTH))
+)
+
+# Prometheus metrics of the worker, scraped at http://<worker>:<port>/metrics
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "8001"))
 
 MINIO_ENDPOINT = os.getenv("MINIO_ENDPOINT")
 MINIO_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY_ID")
 MINIO_SECRET_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 MINIO_BUCKET = os.getenv("MINIO_BUCKET")
 
-#################### STORAGE ####################
-minio_client = Minio(
-    MINIO_ENDPOINT,
-    access_key=MINIO_ACCESS_KEY,
-    secret_key=MINIO_SECRET_KEY,
-    secure=False,
+#################### CLIENTS ####################
+# Built on first use. The MinIO client and the model are shared by the worker threads,
+# each thread has its own RabbitMQ connection and channel (pika is not thread-safe)
+registry = ClientRegistry()
+
+
+def open_channel():
+    """Open a channel on the connection of the thread and declare the queues."""
+    channel = registry.get("rabbitmq").channel()
+    # Feedback publishes block until confirmed by the broker. If one fails, the worker stops
+    # before acknowledging the inference message, which is then redelivered
+    channel.confirm_delivery()
+    for queue_name in (*INFERENCE_LANES.values(), FEEDBACK_QUEUE):
+        logging.info(f"Declaring queue: {queue_name}")
+        channel.queue_declare(queue=queue_name, durable=True)
+    return channel
+
+
+def build_model_server() -> ModelServer:
+    """Build and load the model server, tuning its batch settings if enabled."""
+    gate = None
+    if ENERGY_GATE:
+        gate = Energy_Gate(
+            energy_thresh=ENERGY_GATE_ENERGY_THRESHOLD,
+            flux_thresh=ENERGY_GATE_FLUX_THRESHOLD,
+        )
+    model_server = ModelServer(
+        WEIGHTS_PATH,
+        BIRD_DICT,
+        gate=gate,
+        strip=INFERENCE_STRIP_MODE,
+        batch_size=INFERENCE_BATCH_SIZE,
+        stage_hook=stage_hook,
+    )
+    model_server.load()
+    if INFERENCE_AUTOTUNE:
+        model_server.autotune(AUTOTUNE_PROFILE_PATH)
+    return model_server
+
+
+registry.register(
+    "minio",
+    lambda: make_minio_client(
+        MINIO_ENDPOINT, MINIO_ACCESS_KEY, MINIO_SECRET_KEY, http_client=make_http_client()
+    ),
+)
+registry.register(
+    "rabbitmq",
+    lambda: connect_to_rabbitmq(RABBITMQ_HOST, RABBITMQ_PORT),
+    close=lambda connection: connection.close(),
+    is_alive=lambda connection: not connection.is_closed,
+    per_thread=True,
 )
+registry.register(
+    "rabbitmq_channel",
+    open_channel,
+    is_alive=lambda channel: channel.is_open,
+    per_thread=True,
+)
+registry.register("model_server", build_model_server)
 
 
-#################### QUEUE ####################
-accumulated_messages = []
+def get_model_server() -> ModelServer:
+    return registry.get("model_server")
 
-def callback(body) -> None:
-    """Trigger an inference pipeline run as RabbitMQ message callback."""
-    global accumulated_messages
 
+def stage_hook(stage, seconds, n_windows=None) -> None:
+    """Record a model stage in the metrics and in the trace of the current ticket."""
+    observe_stage(stage, seconds, n_windows)
+    tracer.record_stage(stage, seconds, n_windows)
+
+
+#################### QUEUE ####################
+def callback(body, lane) -> None:
+    """Trigger an inference pipeline run as RabbitMQ message callback."""
     try:
-        # Deserialize and validate the message using InferenceMessage
-        message = InferenceMessage.parse_raw(body.decode())
-    except ValidationError as e:
+        # Deserialize and validate the message, according to its job type
+        data = json.loads(body.decode())
+        job_type = data.get("job_type")
+        if job_type == "segment":
+            message = SegmentMessage(**data)
+        elif job_type == "reduce":
+            message = ReduceMessage(**data)
+        else:
+            message = InferenceMessage(**data)
+    except (ValueError, ValidationError) as e:
         logger.error(f"Message validation error: {e}")
         return
 
     logger.info(
-        f"Received message from RabbitMQ: MinIO path={message.soundfile_minio_path}, "
-        f"Email={message.email}, Ticket number={message.ticket_number}"
+        f"Received {job_type or 'inference'} message from RabbitMQ ({lane} lane): "
+        f"MinIO path={message.soundfile_minio_path}, Email={message.email}, "
+        f"Ticket number={message.ticket_number}, Audio length={message.audio_length}"
     )
-    # Accumulate messages
-    accumulated_messages.append(message)
-
-    # Process batch if the batch size is reached
-    if len(accumulated_messages) >= INFERENCE_PROCESS_BATCH_SIZE:
-        process_batch(accumulated_messages)
-        accumulated_messages = []  # Reset the list after processing
-
-def process_batch(messages):
-    """Process a batch of messages."""
-    for message in messages:
-        run_inference_pipeline(
-            message.soundfile_minio_path,
-            message.email,
-            message.ticket_number,
-            message.annotations_minio_path,
-            message.spectrogram_minio_path
-        )
+    # One span per job, in the trace started by the API
+    with tracer.span(
+        job_type or "inference",
+        traceparent=message.traceparent,
+        ticket_number=message.ticket_number,
+        audio_length=message.audio_length,
+        lane=lane,
+    ):
+        if job_type == "segment":
+            run_segment_pipeline(message)
+        elif job_type == "reduce":
+            run_reduce_pipeline(message)
+        else:
+            run_inference_pipeline(message, interactive=lane == "interactive")
+
 
 #################### ML I/O  ####################
-def run_inference_pipeline(minio_path, email, ticket_number, annotation_path, spectrogram_path) -> None:
-    """Run inference pipeline, output classification and publish feedback message."""
-    file_name = os.path.basename(minio_path)
-    local_file_path = f"/tmp/{file_name}"  # Temporary local file path
+def download_file(minio_path):
+    """Fetch a file from MinIO, return its local path or None on failure.
 
-    # Fetch the WAV file from MinIO and save it locally
+    The file gets a unique temporary name, segments of different tickets share
+    their base names: the caller removes it once done.
+    """
+    file_name = os.path.basename(minio_path)
+    with tempfile.NamedTemporaryFile(suffix=os.path.splitext(file_name)[1], delete=False) as file:
+        local_file_path = file.name
     try:
-        minio_client.fget_object(MINIO_BUCKET, minio_path, local_file_path)
-        logger.info(f"WAV file downloaded from MinIO: {file_name}")
+        with tracer.span("download"), time_stage("download"):
+            registry.get("minio").fget_object(MINIO_BUCKET, minio_path, local_file_path)
+        logger.info(f"File downloaded from MinIO: {minio_path}")
     except Exception as e:
-        logger.error(f"Error downloading WAV file from MinIO: {e!s}")
+        logger.error(f"Error downloading file from MinIO: {e!s}")
+        os.remove(local_file_path)
+        return None
+    return local_file_path
+
+
+def run_inference_pipeline(message: InferenceMessage, interactive=False) -> None:
+    """Run inference pipeline, output classification and publish feedback message."""
+    status_message = StatusMessage(
+        ticket_number=message.ticket_number, status="processing", traceparent=current_traceparent()
+    )
+    publish_message(registry.get("rabbitmq_channel"), FEEDBACK_QUEUE, status_message.dict())
+
+    local_file_path = download_file(message.soundfile_minio_path)
+    if local_file_path is None:
         return
 
-    inference = ModelServer(WEIGHTS_PATH, BIRD_DICT)
-    inference.load()
-    lines, spectrogram = inference.get_classification(local_file_path, return_spectrogram=True)
+    try:
+        if MAPREDUCE:
+            duration = message.audio_length or soundfile.info(local_file_path).duration
+            if duration > MAPREDUCE_MIN_SECONDS:
+                split_job(message, local_file_path)
+                return
+
+        inference = get_model_server()
+        lines, spectrogram, detections = inference.get_classification(
+            local_file_path, return_spectrogram=True, interactive=interactive
+        )
+    finally:
+        os.remove(local_file_path)
+    publish_results(message, lines, spectrogram, detections)
+
+
+def publish_results(message: InferenceMessage, lines, spectrogram, detections) -> None:
+    """Write the annotations and spectrogram to MinIO and publish the feedback message."""
     logger.info(f"Classification output: {lines}")
 
     # Check if lines are empty
@@ -143,38 +306,193 @@ def run_inference_pipeline(minio_path, email, ticket_number, annotation_path, sp
     content = output.getvalue()
     logger.info(f"Annotation content: {content}")
 
-    content_bytes = content.encode('utf-8')
-    content_stream = io.BytesIO(content_bytes)
-    write_file_to_minio(minio_client, MINIO_BUCKET, annotation_path, content_stream)
-    
+    files = {message.annotations_minio_path: content.encode('utf-8')}
     if spectrogram:
-        spectrogram_buffer = io.BytesIO()
-        torch.save(spectrogram, spectrogram_buffer)
-        spectrogram_buffer.seek(0)
-        write_file_to_minio(minio_client, MINIO_BUCKET, spectrogram_path, spectrogram_buffer)
+        # Quantized windows, instead of pickled float32 tensors
+        files[message.spectrogram_minio_path] = write_spectrogram(spectrogram, params=STFT_PARAMS)
+    # The annotations and the spectrogram are uploaded concurrently
+    with tracer.span("upload"), time_stage("upload"):
+        write_files_to_minio(registry.get("minio"), MINIO_BUCKET, files)
 
     # Create a FeedbackMessage instance
     feedback_message = FeedbackMessage(
-        soundfile_minio_path=minio_path,
-        email=email,
-        ticket_number=ticket_number,
-        annotations_minio_path=annotation_path,
-        spectrogram_minio_path=spectrogram_path,
-        classification_score=None  # Set this to the actual classification score if available
+        soundfile_minio_path=message.soundfile_minio_path,
+        email=message.email,
+        ticket_number=message.ticket_number,
+        annotations_minio_path=message.annotations_minio_path,
+        spectrogram_minio_path=message.spectrogram_minio_path,
+        audio_length=message.audio_length,
+        submitted_at=message.submitted_at,
+        traceparent=current_traceparent(),
+        classification_score=None,  # Set this to the actual classification score if available
+        detections=detections,
+        annotations=content,
     )
 
     # Publish the feedback message to RabbitMQ
-    publish_message(rabbitmq_channel, FEEDBACK_QUEUE, feedback_message.dict())
+    publish_message(registry.get("rabbitmq_channel"), FEEDBACK_QUEUE, feedback_message.dict())
+
+
+#################### MAP-REDUCE ####################
+def split_job(message: InferenceMessage, local_file_path) -> None:
+    """Map step: cut a long recording into segments and fan them out as sub-jobs."""
+    data = load_recording(local_file_path)
+    segments = plan_segments(len(data), MAPREDUCE_SEGMENT_WINDOWS)
+    n_columns = spectrogram_columns(len(data))
+    logger.info(f"[MAPREDUCE]: splitting {message.ticket_number} into {len(segments)} segments")
+
+    # Segments are written one at a time, before any sub-job is published
+    minio_client = registry.get("minio")
+    for index, segment in enumerate(segments):
+        write_file_to_minio(
+            minio_client,
+            MINIO_BUCKET,
+            get_segment_path(message.ticket_number, index),
+            write_segment(data, segment),
+        )
+    del data
+
+    channel = registry.get("rabbitmq_channel")
+    for index, segment in enumerate(segments):
+        segment_message = SegmentMessage(
+            **message.dict(),
+            segment_index=index,
+            n_segments=len(segments),
+            first_window=segment["first_window"],
+            n_windows=segment["n_windows"],
+            segment_minio_path=get_segment_path(message.ticket_number, index),
+            spectrogram_length=n_columns,
+        )
+        # Segments are children of the split job
+        segment_message.traceparent = current_traceparent()
+        publish_message(channel, INFERENCE_LANES["bulk"], segment_message.dict())
+
+
+def run_segment_pipeline(message: SegmentMessage) -> None:
+    """Map step: detect on a segment and store its partial detections.
+
+    The worker storing the last partial publishes the reduce job, on the interactive
+    lane: stitching is cheap, and the whole recording is waiting for it.
+    """
+    local_file_path = download_file(message.segment_minio_path)
+    if local_file_path is None:
+        return
+
+    try:
+        _, outputs, spectrogram = get_model_server().run_detection(
+            local_file_path, return_spectrogram=True
+        )
+    finally:
+        os.remove(local_file_path)
+    partial = make_partial(
+        outputs,
+        spectrogram,
+        message.first_window,
+        message.n_windows,
+        last=message.segment_index == message.n_segments - 1,
+    )
+    write_file_to_minio(
+        registry.get("minio"),
+        MINIO_BUCKET,
+        get_partial_path(message.ticket_number, message.segment_index),
+        partial,
+    )
+
+    partials = registry.get("minio").list_objects(
+        MINIO_BUCKET, prefix=get_partials_prefix(message.ticket_number)
+    )
+    n_done = sum(1 for _ in partials)
+    logger.info(
+        f"[MAPREDUCE]: {message.ticket_number} {n_done}/{message.n_segments} segments done"
+    )
+    if n_done == message.n_segments and claim_reduce(message.ticket_number):
+        reduce_message = ReduceMessage(
+            **InferenceMessage(**message.dict()).dict(),
+            n_segments=message.n_segments,
+            spectrogram_length=message.spectrogram_length,
+        )
+        reduce_message.traceparent = current_traceparent()
+        channel = registry.get("rabbitmq_channel")
+        publish_message(channel, INFERENCE_LANES["interactive"], reduce_message.dict())
+
+
+def claim_reduce(ticket_number) -> bool:
+    """Create the reduce marker of a ticket, return False if it already exists.
+
+    Segments finishing together may all see every partial, the marker keeps the
+    later ones from publishing the reduce job again. Two segments may still both
+    create it in the same instant: the reduce is idempotent, a duplicate job finds
+    no partials or publishes the same results, stored once by the API.
+    """
+    minio_client = registry.get("minio")
+    marker_path = get_reduce_marker_path(ticket_number)
+    try:
+        minio_client.stat_object(MINIO_BUCKET, marker_path)
+        logger.info(f"[MAPREDUCE]: reduce of {ticket_number} already published")
+        return False
+    except S3Error as e:
+        if e.code != "NoSuchKey":
+            raise
+    write_file_to_minio(minio_client, MINIO_BUCKET, marker_path, b"")
+    return True
+
+
+def run_reduce_pipeline(message: ReduceMessage) -> None:
+    """Reduce step: stitch the partial detections and publish the results."""
+    minio_client = registry.get("minio")
+    partials = []
+    for index in range(message.n_segments):
+        try:
+            response = minio_client.get_object(
+                MINIO_BUCKET, get_partial_path(message.ticket_number, index)
+            )
+        except S3Error as e:
+            # Redelivered after the partials were cleaned up
+            if e.code != "NoSuchKey":
+                raise
+            logger.info(f"[MAPREDUCE]: {message.ticket_number} already reduced, skipping")
+            return
+        try:
+            partials.append(read_partial(response.read()))
+        finally:
+            response.close()
+            response.release_conn()
+
+    fp, outputs, spectrogram = reduce_partials(partials, message.spectrogram_length)
+    lines, detections = get_model_server().classify(fp, outputs, spectrogram)
+    publish_results(InferenceMessage(**message.dict()), lines, spectrogram, detections)
+
+    for index in range(message.n_segments):
+        minio_client.remove_object(MINIO_BUCKET, get_partial_path(message.ticket_number, index))
+        minio_client.remove_object(MINIO_BUCKET, get_segment_path(message.ticket_number, index))
+    minio_client.remove_object(MINIO_BUCKET, get_reduce_marker_path(message.ticket_number))
 
 
 #################### MAIN LOOP ####################
-if __name__ == "__main__":
-    rabbitmq_connection = get_rabbit_connection(RABBITMQ_HOST, RABBITMQ_PORT)
-    rabbitmq_channel = rabbitmq_connection.channel()
-    rabbitmq_channel.queue_declare(queue=FORWARDING_QUEUE, durable=True)
+def serve(stop_event=None) -> None:
+    """Process inference jobs until `stop_event` is set.
+
+    Several threads can serve concurrently, each on its own RabbitMQ connection.
+    """
+
+    rabbitmq_connection = registry.get("rabbitmq")
+    rabbitmq_channel = registry.get("rabbitmq_channel")
+
+    logger.info(f"Waiting for messages from queues: {list(INFERENCE_LANES.values())}")
+    consume_lanes(
+        rabbitmq_connection,
+        rabbitmq_channel,
+        INFERENCE_LANES,
+        callback,
+        starvation_limit=INFERENCE_STARVATION_LIMIT,
+        stop_event=stop_event,
+    )
 
-    logging.info(f"Declaring queue: {FEEDBACK_QUEUE}")
-    rabbitmq_channel.queue_declare(queue=FEEDBACK_QUEUE, durable=True)
 
-    logger.info(f"Waiting for messages from queue: {FORWARDING_QUEUE}")
-    consume_messages(rabbitmq_channel, FORWARDING_QUEUE, callback)
+if __name__ == "__main__":
+    start_http_server(WORKER_METRICS_PORT)
+    get_model_server()
+    try:
+        serve()
+    finally:
+        registry.close()
@@ -0,0 +1,184 @@
+"""Batch Size Autotuning Module.
+
+This module benchmarks the detection model on synthetic spectrogram windows
+to pick the batch size and the number of torch threads to use on the current host.
+Two settings are selected:
+- throughput: highest number of windows per second, for bulk processing
+- latency: shortest time to process a short clip, for interactive requests
+
+Benchmarking takes a few seconds to a few minutes depending on the host,
+results are cached in a JSON profile keyed by host and model architecture.
+
+"""
+
+import contextlib
+import json
+import logging
+import math
+import os
+import socket
+import time
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+IMG_SIZE = (375, 1024)
+DEFAULT_BATCH_SIZES = (1, 2, 4, 8, 10, 16)
+# Windows in a ~10s clip, used to rank settings for interactive requests
+LATENCY_WINDOWS = 4
+
+
+def available_cpus() -> int:
+    """Return the number of CPUs usable by the current process."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def default_thread_counts() -> list:
+    """Return candidate torch thread counts: 1, half and all of the available CPUs."""
+    n_cpus = available_cpus()
+    return sorted({1, max(1, n_cpus // 2), n_cpus})
+
+
+@contextlib.contextmanager
+def torch_threads(num_threads):
+    """Use `num_threads` torch intra-op threads in a `with` block, then restore the previous count.
+
+    The thread count is process-wide, it is only changed when it differs.
+    """
+    previous = torch.get_num_threads()
+    if num_threads == previous:
+        yield
+        return
+    torch.set_num_threads(num_threads)
+    try:
+        yield
+    finally:
+        torch.set_num_threads(previous)
+
+
+def profile_key(config) -> str:
+    """Build the cache key of a profile from the host and the model architecture."""
+    arch = [
+        getattr(config, attr, None)
+        for attr in (
+            "backbone",
+            "dilation",
+            "hidden_dim",
+            "enc_layers",
+            "dec_layers",
+            "num_queries",
+        )
+    ]
+    arch = "-".join(str(value) for value in arch)
+    return f"{socket.gethostname()}|{available_cpus()}cpu|torch{torch.__version__}|{arch}"
+
+
+def benchmark_setting(model, batch_size, num_threads, n_iter=2) -> float:
+    """Return the mean time, in seconds, of a forward pass on a batch of windows.
+
+    Args:
+    ----
+        model (torch.nn.Module): The detection model, in eval mode.
+        batch_size (int): Number of windows per forward pass.
+        num_threads (int): Number of torch intra-op threads.
+        n_iter (int): Number of timed iterations, after one warmup iteration.
+
+    """
+    batch = torch.rand(batch_size, 1, *IMG_SIZE)
+    # Restored even if the forward pass fails, e.g. out of memory on a large batch
+    with torch_threads(num_threads), torch.no_grad():
+        model(batch)  # warmup
+        start = time.perf_counter()
+        for _ in range(n_iter):
+            model(batch)
+        return (time.perf_counter() - start) / n_iter
+
+
+def autotune(model, batch_sizes=DEFAULT_BATCH_SIZES, thread_counts=None, n_iter=2) -> dict:
+    """Benchmark every (batch size, thread count) pair and select the best settings.
+
+    Returns
+    -------
+        dict: The profile, with `throughput` and `latency` settings
+        and the raw benchmark `results`.
+
+    """
+    thread_counts = thread_counts or default_thread_counts()
+
+    results = []
+    for num_threads in thread_counts:
+        for batch_size in batch_sizes:
+            batch_time = benchmark_setting(model, batch_size, num_threads, n_iter=n_iter)
+            results.append(
+                {
+                    "batch_size": batch_size,
+                    "num_threads": num_threads,
+                    "batch_time_s": batch_time,
+                    "windows_per_s": batch_size / batch_time,
+                    "clip_latency_s": math.ceil(LATENCY_WINDOWS / batch_size) * batch_time,
+                }
+            )
+            logger.info(f"[AUTOTUNE]: {results[-1]}")
+
+    best_throughput = max(results, key=lambda result: result["windows_per_s"])
+    best_latency = min(results, key=lambda result: result["clip_latency_s"])
+    return {
+        "throughput": {
+            "batch_size": best_throughput["batch_size"],
+            "num_threads": best_throughput["num_threads"],
+        },
+        "latency": {
+            "batch_size": best_latency["batch_size"],
+            "num_threads": best_latency["num_threads"],
+        },
+        "results": results,
+    }
+
+
+def load_profile(profile_path, key):
+    """Return the cached profile for `key`, or None if there is none."""
+    if not profile_path or not os.path.isfile(profile_path):
+        return None
+    try:
+        with open(profile_path) as f:
+            return json.load(f).get(key)
+    except (OSError, ValueError) as e:
+        logger.error(f"Failed to read autotune profile '{profile_path}': {e!s}")
+        return None
+
+
+def save_profile(profile_path, key, profile) -> None:
+    """Store `profile` under `key` in the JSON profile cache, keeping other hosts' entries."""
+    profiles = {}
+    if os.path.isfile(profile_path):
+        try:
+            with open(profile_path) as f:
+                profiles = json.load(f)
+        except (OSError, ValueError):
+            profiles = {}
+    profiles[key] = profile
+
+    os.makedirs(os.path.dirname(os.path.abspath(profile_path)), exist_ok=True)
+    tmp_path = f"{profile_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(profiles, f, indent=2)
+    os.replace(tmp_path, profile_path)
+
+
+def get_profile(model, config, profile_path=None, **autotune_kwargs) -> dict:
+    """Return the host profile, from the cache if available, benchmarking otherwise."""
+    key = profile_key(config)
+    profile = load_profile(profile_path, key)
+    if profile is not None:
+        logger.info(f"Autotune profile loaded from cache for {key}")
+        return profile
+
+    logger.info(f"No autotune profile for {key}, benchmarking...")
+    profile = autotune(model, **autotune_kwargs)
+    if profile_path:
+        save_profile(profile_path, key, profile)
+    return profile
@@ -7,12 +7,15 @@ files, and getting the classification results.
 """
 
 import logging
+import time
 
+import torch
+from model_serve.autotune import get_profile, torch_threads
 from src.models.run_detection_cpu import load_model, run_detection
 from src.visualization.visu import (
+    get_detection_records,
     get_detections_times_and_freqs,
     merge_images,
-    visualise_model_out,
 )
 
 logging.basicConfig(
@@ -29,13 +32,23 @@ TEST_FILE_PATH = "inference/Turdus_merlula.wav"
 class ModelServer:
     """A class representing a model server for bird sound classification."""
 
-    def __init__(self, weights_path, bird_dict) -> None:
+    def __init__(
+        self, weights_path, bird_dict, gate=None, strip=False, batch_size=10, stage_hook=None
+    ) -> None:
         """Initialize the ModelServer instance.
 
         Args:
         ----
             weights_path (str): The path to the weights for the model.
             bird_dict (dict): A dictionary containing bird names and their corresponding IDs.
+            gate (Energy_Gate, optional): Pre-filter skipping empty spectrogram windows.
+            strip (bool): Run the backbone once over contiguous spectrogram strips
+                instead of once per overlapping window.
+            batch_size (int): Number of windows per forward pass,
+                overridden by `autotune`.
+            stage_hook (callable, optional): Called as `stage_hook(stage, seconds, n_windows)`
+                with the duration of every stage (stft, forward, postprocess, inference,
+                merge, classify), e.g. `app_utils.metrics.observe_stage`.
 
         """
         self.weights_path = weights_path
@@ -48,6 +61,16 @@ class ModelServer:
         }
         logger.info(f"Reversed birds dict: {len(self.reverse_bird_dict)}")
 
+        self.gate = gate
+        self.strip = strip
+        self.stage_hook = stage_hook or (lambda stage, seconds, n_windows=None: None)
+
+        # Settings for bulk (throughput) and interactive (latency) requests
+        self.settings = {
+            "throughput": {"batch_size": batch_size, "num_threads": torch.get_num_threads()},
+            "latency": {"batch_size": batch_size, "num_threads": torch.get_num_threads()},
+        }
+
         self.model = None
         self.config = None
         self.model_loaded = False
@@ -59,13 +82,32 @@ class ModelServer:
         logger.info("Model loaded successfully")
         self.model_loaded = True
 
-    def run_detection(self, file_path, return_spectrogram=False):
+    def autotune(self, profile_path=None, **autotune_kwargs) -> None:
+        """Select batch size and thread count settings for this host.
+
+        Args:
+        ----
+            profile_path (str, optional): JSON cache of host profiles,
+                the benchmark only runs if the host has no entry yet.
+            **autotune_kwargs: Forwarded to `model_serve.autotune.autotune`.
+
+        """
+        if not self.model_loaded:
+            self.load()
+
+        profile = get_profile(self.model, self.config, profile_path, **autotune_kwargs)
+        self.settings = {key: profile[key] for key in ("throughput", "latency")}
+        logger.info(f"[AUTOTUNE]: selected settings {self.settings}")
+
+    def run_detection(self, file_path, return_spectrogram=False, interactive=False):
         """Run detection on an audio file.
 
         Args:
         ----
             file_path (str): The path to the audio file.
             return_spectrogram (bool): Whether to return the spectrogram.
+            interactive (bool): Use the latency-optimal settings instead of
+                the throughput-optimal ones.
 
         Returns:
         -------
@@ -77,32 +119,80 @@ class ModelServer:
         if not self.model_loaded:
             self.load()
 
+        setting = self.settings["latency" if interactive else "throughput"]
+
         logger.info(f"Starting run_detection on {file_path.split('/')[-1]}...")
-        fp, outputs, spectrogram = run_detection(
-            self.model, self.config, file_path, return_spectrogram=return_spectrogram
-        )
+        start = time.perf_counter()
+        with torch_threads(setting["num_threads"]):
+            fp, outputs, spectrogram = run_detection(
+                self.model,
+                self.config,
+                file_path,
+                bs=setting["batch_size"],
+                return_spectrogram=return_spectrogram,
+                gate=self.gate,
+                strip=self.strip,
+                stage_hook=self.stage_hook,
+            )
+        n_windows = sum(len(batch) for batch in outputs)
+        self.stage_hook("inference", time.perf_counter() - start, n_windows)
+        if self.gate is not None:
+            logger.info(
+                f"[GATE]: skipped {fp.gate_stats['n_skipped']}/{fp.gate_stats['n_windows']} "
+                f"windows (skip rate {fp.gate_stats['skip_rate']:.2%})"
+            )
         logger.info(f"[fp]: \n{fp}\n\n")
         self.detection_ready = True
 
         return fp, outputs, spectrogram
     
 
-    def get_classification(self, file_path, return_spectrogram=False):
+    def get_classification(self, file_path, return_spectrogram=False, interactive=False):
         """Get classification results for an audio file.
 
         Args:
         ----
             file_path (str): The path to the audio file.
             return_spectrogram (bool): Whether to return the spectrogram.
+            interactive (bool): Use the latency-optimal settings.
 
         Returns:
         -------
-            dict: A dictionary containing classification results.
+            tuple: The annotation lines, the spectrogram and the detection records.
 
         """
-        fp, outputs, spectrogram = self.run_detection(file_path, return_spectrogram)
+        fp, outputs, spectrogram = self.run_detection(
+            file_path, return_spectrogram, interactive=interactive
+        )
+        lines, detections = self.classify(fp, outputs, spectrogram)
+
+        logger.info(f"[SPECTROGRAM]: {len(spectrogram or [])} windows with detections")
+        return lines, spectrogram, detections
 
+    def classify(self, fp, outputs, spectrogram):
+        """Merge the per-window detections of a recording into annotation lines.
+
+        Args:
+        ----
+            fp (File_Processor): The processed file, or any object with its window
+                geometry (`W_PIX`, `HOP_SPECTRO`, `spectrogram_length`).
+            outputs (list): Batched per-window outputs, as returned by `run_detection`.
+            spectrogram (list): (window index, window) pairs of the windows with detections.
+
+        Returns:
+        -------
+            tuple: The annotation lines and the detection records
+                (bird id, time and frequency limits, score), one per line.
+
+        """
+        if not self.model_loaded:
+            self.load()
+
+        start = time.perf_counter()
         class_bbox = merge_images(fp, outputs, self.config.num_classes)
+        self.stage_hook("merge", time.perf_counter() - start)
+
+        start = time.perf_counter()
         output = {
             self.reverse_bird_dict[idx]: {
                 key: value.cpu().numpy().tolist()
@@ -112,14 +202,10 @@ class ModelServer:
             if len(class_bbox[str(idx)]["bbox_coord"]) > 0
         }
 
-        lines = get_detections_times_and_freqs(output, fp, spectrogram, self.reverse_bird_dict)
+        detections = get_detection_records(output, fp, spectrogram, self.reverse_bird_dict)
+        lines = get_detections_times_and_freqs(
+            output, fp, spectrogram, self.reverse_bird_dict, records=detections
+        )
+        self.stage_hook("classify", time.perf_counter() - start)
         logger.info(f"[lines]: \n{lines}")
-        
-        logger.info(f"[SPECTROGRAM]: {spectrogram}")
-        if False:
-            visualise_model_out(output, fp, spectrogram, self.reverse_bird_dict)
-        
-        
-        return lines, spectrogram
-
-
+        return lines, detections
@@ -19,5 +19,8 @@ mc admin user add myminio ${AWS_ACCESS_KEY_ID} ${AWS_SECRET_ACCESS_KEY}
 mc admin policy add myminio readwrite /etc/minio/policies/readwrite.json
 mc admin policy attach myminio readwrite --user ${AWS_ACCESS_KEY_ID}
 
+# Notify the API of direct uploads (webhook target "api", see MINIO_NOTIFY_WEBHOOK_*_API)
+mc event add myminio/${MINIO_BUCKET} arn:minio:sqs::API:webhook --event put --prefix audio/ --ignore-existing
+
 # Keeping the container running
 tail -f /dev/null
@@ -0,0 +1,63 @@
+import numpy as np
+
+
+class Energy_Gate:
+    '''
+    Cheap pre-filter deciding whether a spectrogram window is worth running through DETR.
+
+    Works on the normalized windows produced by File_Processor.split_power_spec (values in [0, 1]).
+    Two activity measures are computed per window:
+    - band energy: high quantile of the energy above the per-frequency noise floor (median over time),
+      a bird call shows up as a localized bump above the background of its frequency band
+    - spectral flux: largest frame-to-frame increase of the band-averaged above-floor energy,
+      catches the onset of short calls that do not weigh much in the band energy
+
+    A window is considered empty, and skipped, only if both measures are below their threshold.
+    '''
+
+    def __init__(self, energy_thresh=0.12, flux_thresh=0.01, quantile=0.995):
+        '''
+        Params:
+        ------
+        energy_thresh (float): band energy under which a window may be skipped
+        flux_thresh (float): spectral flux under which a window may be skipped
+        quantile (float): quantile of the above-floor energy used as band energy, robust to isolated pixels
+        '''
+        self.energy_thresh = energy_thresh
+        self.flux_thresh = flux_thresh
+        self.quantile = quantile
+
+    def excess_energy(self, img):
+        floor = np.median(img, axis=1, keepdims=True)
+        return np.clip(img - floor, 0, None)
+
+    def band_energy(self, img, excess=None):
+        excess = self.excess_energy(img) if excess is None else excess
+        return float(np.quantile(excess, self.quantile))
+
+    def spectral_flux(self, img, excess=None):
+        excess = self.excess_energy(img) if excess is None else excess
+        frame_energy = excess.mean(axis=0)
+        return float(np.clip(np.diff(frame_energy), 0, None).max(initial=0.))
+
+    def is_empty(self, img):
+        excess = self.excess_energy(img)
+        if self.band_energy(img, excess) >= self.energy_thresh:
+            return False
+        return self.spectral_flux(img, excess) < self.flux_thresh
+
+    def __call__(self, img_db):
+        '''
+        Returns a boolean array, True for the windows that must go through the model
+        '''
+        return np.array([not self.is_empty(img) for img in img_db], dtype=bool)
+
+
+def gate_stats(keep):
+    n_windows = len(keep)
+    n_skipped = int(n_windows - np.sum(keep))
+    return dict(
+        n_windows=n_windows,
+        n_skipped=n_skipped,
+        skip_rate=n_skipped / n_windows if n_windows > 0 else 0.
+    )
@@ -2,6 +2,7 @@
 """
 DETR model and criterion classes.
 """
+import json
 import numpy as np
 import os
 import torch
@@ -9,14 +10,12 @@ import torch.nn.functional as F
 from torch import nn
 
 from .util import box_ops
+from .util.weights_io import load_flat, save_flat, state_dict_digest
 from .util.misc import (NestedTensor, nested_tensor_from_tensor_list,
                        accuracy, get_world_size, interpolate,
                        is_dist_avail_and_initialized)
 
 from .backbone import build_backbone
-from .matcher import build_matcher
-from .segmentation import (DETRsegm, PostProcessPanoptic, PostProcessSegm,
-                           dice_loss, sigmoid_focal_loss)
 from .transformer import build_transformer
 
 
@@ -61,16 +60,27 @@ class DETR(nn.Module):
                                 dictionnaries containing the two above keys for each decoder layer.
         """
 
-        samples = self.init_conv(samples)
         # if isinstance(samples, (list, torch.Tensor)):
         #     samples = nested_tensor_from_tensor_list(samples)
-        features, pos = self.backbone(samples)
+        src = self.forward_backbone(samples)
+        return self.forward_head(src)
+
+    def forward_backbone(self, samples):
+        """ Runs the input convolution and the backbone, returns the last feature map [batch_size x C x h x w].
+            Split from forward so that the backbone can run once over a long spectrogram strip
+            and the resulting feature map be sliced into per-window tiles (see run_detection_cpu).
+        """
+        samples = self.init_conv(samples)
+        features = self.backbone[0](samples)
+        return list(features.values())[-1]
 
+    def forward_head(self, src):
+        """ Runs the transformer and the prediction heads on a backbone feature map, see forward for the output """
         # src, mask = features[-1].decompose()
-        src = features[-1]
         # assert mask is not None
         # hs = self.transformer(self.input_proj(src), mask, self.query_embed.weight, pos[-1])[0]
-        hs = self.transformer(self.input_proj(src), None, self.query_embed.weight, pos[-1])[0]
+        pos = self.backbone[1](src).to(src.dtype)
+        hs = self.transformer(self.input_proj(src), None, self.query_embed.weight, pos)[0]
 
         outputs_class = self.class_embed(hs)
         outputs_coord = self.bbox_embed(hs).sigmoid()
@@ -178,6 +188,8 @@ class SetCriterion(nn.Module):
            targets dicts must contain the key "masks" containing a tensor of dim [nb_target_boxes, h, w]
         """
         assert "pred_masks" in outputs
+        # Segmentation heads are only trained on demand, not imported with the detector
+        from .segmentation import dice_loss, sigmoid_focal_loss
 
         src_idx = self._get_src_permutation_idx(indices)
         tgt_idx = self._get_tgt_permutation_idx(indices)
@@ -365,7 +377,28 @@ def load_weights(args, model, path=None, train=True):
     return model
 
 
-def load_weights_cpu(args, model, path=None, train=True):
+def load_checkpoint_cpu(path, mmap=True):
+    """ Loads a checkpoint on the CPU. With mmap, the file is memory-mapped and tensor storages are only
+        paged in when accessed, instead of being read in full into memory.
+        Falls back to a regular load for checkpoints saved with the legacy (non-zipfile) serialization.
+        Flat weights files (.safetensors, see util.weights_io) are always memory-mapped.
+    """
+    if path.endswith('.safetensors'):
+        state_dict, metadata = load_flat(path)
+        checkpoint = {'checkpoints': state_dict}
+        if 'args' in metadata:
+            checkpoint['args'] = json.loads(metadata['args'])
+        checkpoint.update({k: v for k, v in metadata.items() if k != 'args'})
+        return checkpoint
+    if mmap:
+        try:
+            return torch.load(path, map_location=torch.device('cpu'), mmap=True)
+        except RuntimeError as e:
+            print(f'Memory-mapped loading failed ({e}), falling back to a regular load')
+    return torch.load(path, map_location=torch.device('cpu'))
+
+
+def load_weights_cpu(args, model, path=None, train=True, mmap=True):
     # assert args.dilation, 'dilation disabled...'
     suff = ''
     if not args.dilation:
@@ -387,15 +420,20 @@ def load_weights_cpu(args, model, path=None, train=True):
         weight_key = 'checkpoints'
 
     # Load the state dictionary and map it to the CPU device
-    state_dict = torch.load(path, map_location=torch.device('cpu'))
+    state_dict = load_checkpoint_cpu(path, mmap=mmap)[weight_key]
 
     # Filter out excluded keys and keys not present in the model's state dictionary
-    state_dict = {k: v for k, v in state_dict[weight_key].items() if k in model_dict \
+    # (the filtered dict only holds references to the loaded tensors, not copies)
+    state_dict = {k: v for k, v in state_dict.items() if k in model_dict \
                   and not np.array([e in k for e in exclude]).any()}
 
-    # Update the model's state dictionary with the loaded weights
-    model_dict.update(state_dict)
-    model.load_state_dict(model_dict)
+    # Half precision inference checkpoints are cast back to the model dtype
+    state_dict = {k: v if v.dtype == model_dict[k].dtype else v.to(model_dict[k].dtype) for k, v in state_dict.items()}
+
+    # Assign the loaded tensors to the model in place of its freshly initialized ones, instead of copying them:
+    # only one copy of the weights is ever held, backed by the memory-mapped file when mmap is enabled.
+    # Keys missing from the checkpoint keep their initialized value, as with model_dict.update
+    model.load_state_dict(state_dict, strict=False, assign=True)
 
     if train:
         model.train()
@@ -405,6 +443,41 @@ def load_weights_cpu(args, model, path=None, train=True):
     return model
 
 
+def slim_checkpoint(path, out_path, half=False, args=None):
+    """ Converts a training checkpoint (model, optimizer and scheduler states, dataset split indices)
+        into an inference-only one, holding the model weights only, see export_weights.py.
+        Parameters:
+            half: store floating point weights in float16, they are cast back to float32 at load time
+            args: training configuration, embedded in the file so that it is self-contained
+        The output is a torch pickle, or a flat memory-mappable file if out_path ends with .safetensors.
+        A sha256 digest of the weights is embedded as well, returns it.
+    """
+    state_dict = load_checkpoint_cpu(path)['checkpoints']
+    if half:
+        state_dict = {k: v.half() if v.is_floating_point() else v for k, v in state_dict.items()}
+    digest = state_dict_digest(state_dict)
+    dtype = 'float16' if half else 'float32'
+
+    if out_path.endswith('.safetensors'):
+        metadata = {'sha256': digest, 'dtype': dtype}
+        if args is not None:
+            metadata['args'] = json.dumps(args)
+        save_flat(state_dict, out_path, metadata=metadata)
+    else:
+        checkpoint = {'checkpoints': state_dict, 'sha256': digest, 'dtype': dtype}
+        if args is not None:
+            checkpoint['args'] = args
+        torch.save(checkpoint, out_path)
+    return digest
+
+
+def verify_checkpoint(path):
+    """ Checks the weights of an inference checkpoint against its embedded sha256 digest """
+    checkpoint = load_checkpoint_cpu(path)
+    if 'sha256' not in checkpoint:
+        raise ValueError(f'{path} has no embedded sha256 digest')
+    return state_dict_digest(checkpoint['checkpoints']) == checkpoint['sha256']
+
 
 def build(args):
     # the `num_classes` naming here is somewhat misleading.
@@ -437,6 +510,8 @@ def build(args):
 
     model = load_weights(args, model)
 
+    # Training only, the matcher pulls scipy
+    from .matcher import build_matcher
     matcher = build_matcher(args)
     weight_dict = {'loss_ce': 1, 'loss_neg_ce': 1, 'loss_bbox': args.bbox_loss_coef}
     weight_dict['loss_giou'] = args.giou_loss_coef
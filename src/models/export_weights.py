@@ -0,0 +1,51 @@
+import argparse
+import json
+import os
+
+from src.models.detr import slim_checkpoint, verify_checkpoint
+
+
+def get_args_parser():
+
+    parser = argparse.ArgumentParser('Export an inference-only checkpoint', add_help=False)
+    parser.add_argument('--model_dir', default='models/detr_noneg_100q_bs20_r50dc5', type=str,
+                        help="Directory holding the training checkpoint and its args file")
+    parser.add_argument('--checkpoint', default='model_chkpt_last.pt', type=str,
+                        help="Name of the training checkpoint in model_dir")
+    parser.add_argument('--format', default='torch', type=str, choices=('torch', 'flat'),
+                        help="torch pickle (model_inference.pt) or flat memory-mappable layout (model_inference.safetensors)")
+    parser.add_argument('--half', action='store_true',
+                        help="Store floating point weights in float16, halves the file size")
+    parser.add_argument('--out', default=None, type=str,
+                        help="Output path, defaults to model_dir/model_inference.<pt|safetensors>")
+    parser.add_argument('--verify', default=None, type=str,
+                        help="Only check the given inference checkpoint against its embedded sha256 digest")
+    return parser
+
+
+def main(args):
+
+    if args.verify is not None:
+        valid = verify_checkpoint(args.verify)
+        print(f'{args.verify}: {"OK" if valid else "CHECKSUM MISMATCH"}')
+        return valid
+
+    with open(os.path.join(args.model_dir, 'args'), 'r') as f:
+        train_args = json.load(f)
+
+    out = args.out
+    if out is None:
+        out = os.path.join(args.model_dir, 'model_inference' + ('.safetensors' if args.format == 'flat' else '.pt'))
+
+    src = os.path.join(args.model_dir, args.checkpoint)
+    digest = slim_checkpoint(src, out, half=args.half, args=train_args)
+    print(f'{src} ({os.path.getsize(src) / 1e6:.1f} MB) -> {out} ({os.path.getsize(out) / 1e6:.1f} MB)')
+    print(f'sha256: {digest}')
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Inference checkpoint export script', parents=[get_args_parser()])
+    args = parser.parse_args()
+    if not main(args):
+        raise SystemExit(1)
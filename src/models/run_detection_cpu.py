@@ -2,19 +2,24 @@ import numpy as np
 import os
 import torch
 import json
+import time
+import torch.nn.functional as F
 from tqdm import tqdm
-# from detr.nbm_datasets.image_dataset import *
-from src.features.prepare_dataset import *
-from src.models.detr import *
-from src.models import build_model
-from src.models.util.box_ops import *
-from src.models.util.nets_utils import *
+# Explicit imports: the dataset-building code (prepare_dataset) and its plotting and
+# dataframe dependencies are not needed to serve the model
+from src.features.file_processor import File_Processor
+from src.features.energy_gate import Energy_Gate, gate_stats
+from src.models.backbone import build_backbone
+from src.models.detr import DETR, load_checkpoint_cpu, load_weights_cpu
+from src.models.transformer import build_transformer
+from src.models.util.nets_utils import Config, rel_to_coord
+from src.models.util.weights_io import state_dict_digest
 
 
 device = 'cpu'
 
 
-def run_detection(model, config, wav_path, min_score=0.5, bs=10, return_spectrogram=True):
+def run_detection(model, config, wav_path, min_score=0.5, bs=10, return_spectrogram=True, gate=None, strip=False, stage_hook=None):
     '''
     Params:
     ------
@@ -24,44 +29,156 @@ def run_detection(model, config, wav_path, min_score=0.5, bs=10, return_spectrog
     min_score
     bs (int): batch size, how many samples processed at one
     return_spectrogram (bool)
+    gate (Energy_Gate): optional pre-filter, windows it considers empty skip the model and get an empty output
+    strip (bool): long-strip mode, the backbone runs once over the contiguous spectrogram span of consecutive
+        windows instead of once per window, see strip_forward
+    stage_hook (callable): optional, called as stage_hook(stage, seconds, n_windows) after the "stft" step and
+        after the "forward" pass and "postprocess" of every batch, e.g. to record metrics
     '''
     device = 'cpu'
+    if stage_hook is None:
+        stage_hook = lambda stage, seconds, n_windows: None
+
+    t_start = time.perf_counter()
     fp = File_Processor(wav_path)
     img_db, _ = fp.process_file()
-    
-    batch = []
-    outputs = []
-    spectrogram = []
+    stage_hook('stft', time.perf_counter() - t_start, len(img_db))
 
     n_img = len(img_db)
-    b_idx = 0
-    for i in tqdm(range(n_img)):
-        img = img_db[i]
-        batch.append(img)
-        if (len(batch) == bs) or (i == n_img - 1):
-            batch = torch.Tensor(np.stack(batch)) # .to(device)
-            with torch.no_grad():
+    keep = gate(img_db) if gate is not None else np.ones(n_img, dtype=bool)
+    fp.gate_stats = gate_stats(keep)
+
+    img_out = {}
+    spectrogram = []
+
+    kept_idx = np.nonzero(keep)[0]
+    for b_start in tqdm(range(0, len(kept_idx), bs)):
+        batch_idx = kept_idx[b_start:b_start + bs]
+        batch = torch.Tensor(np.stack([img_db[i] for i in batch_idx])) # .to(device)
+        t_start = time.perf_counter()
+        with torch.no_grad():
+            if strip:
+                o = strip_forward(model, config, img_db, batch_idx, fp.HOP_SPECTRO)
+            else:
                 o = model(batch[:, None])
-            batch_out = postpro_detr(o, config, min_score=min_score)
-            outputs.append(batch_out)
-            
+        stage_hook('forward', time.perf_counter() - t_start, len(batch_idx))
+        t_start = time.perf_counter()
+        batch_out = postpro_detr(o, config, min_score=min_score)
+        stage_hook('postprocess', time.perf_counter() - t_start, len(batch_idx))
+
+        for sample_id, (idx, sample) in enumerate(zip(batch_idx, batch_out)):
+            img_out[idx] = sample
             if return_spectrogram:
-                for sample_id, sample in enumerate(batch_out):
-                    boxes = [sample[str(b_id)]['bbox_coord'] for b_id in np.arange(1, len(sample)) if len(sample[str(b_id)]['bbox_coord'] > 0)]
-                    if len(boxes) > 0:
-                        idx = b_idx * bs + sample_id
-                        spectrogram.append((idx, batch[sample_id]))  
-            batch = []
-            b_idx += 1
+                boxes = [sample[str(b_id)]['bbox_coord'] for b_id in np.arange(1, len(sample)) if len(sample[str(b_id)]['bbox_coord'] > 0)]
+                if len(boxes) > 0:
+                    spectrogram.append((int(idx), batch[sample_id]))
+
+    # Skipped windows still need an (empty) output, merge_images relies on the window position
+    empty = empty_detr_output(config)
+    ordered = [img_out.get(i, empty) for i in range(n_img)]
+    outputs = [ordered[k:k + bs] for k in range(0, n_img, bs)]
 
     return fp, outputs, spectrogram
 
 
+def split_runs(idx):
+    '''
+    Splits a sorted array of window indices into runs of consecutive indices
+    '''
+    return np.split(idx, np.nonzero(np.diff(idx) != 1)[0] + 1)
+
+
+def build_strip(img_db, run, hop):
+    '''
+    Rebuilds the contiguous spectrogram span covered by consecutive windows: the first window is kept whole,
+    the following ones only contribute the `hop` columns that do not overlap with their predecessor
+    '''
+    w_pix = img_db[run[0]].shape[-1]
+    return np.concatenate([img_db[run[0]]] + [img_db[i][:, w_pix - hop:] for i in run[1:]], axis=1)
+
+
+def strip_forward(model, config, img_db, batch_idx, hop):
+    '''
+    Long-strip inference: windows overlap by w_pix - hop columns, so running the backbone on each of them
+    convolves the overlapping columns twice. Instead the backbone runs once per run of consecutive windows, over
+    the strip they span, and its feature map is sliced into per-window tiles that go through the transformer.
+
+    Window offsets (j * hop) are generally not multiples of the backbone stride, each tile starts at the closest
+    feature column and the predicted box centers are shifted back by the residual offset. Inside a strip, tile
+    borders see the actual neighbouring columns instead of the zero padding of a standalone window, hence outputs
+    slightly differ from the per-window mode near the window edges.
+
+    Returns the model output dict for the windows in batch_idx, in that order
+    '''
+    stride = 16 if config.dilation else 32
+    out = {'pred_logits': [], 'pred_boxes': []}
+    for run in split_runs(np.asarray(batch_idx)):
+        strip = torch.Tensor(build_strip(img_db, run, hop))
+        w_pix = img_db[run[0]].shape[-1]
+        src = model.forward_backbone(strip[None, None])
+        tile_w = int(np.ceil(w_pix / stride))
+
+        tiles, shifts = [], []
+        for j in range(len(run)):
+            s = min(int(round(j * hop / stride)), src.shape[-1] - tile_w)
+            tiles.append(src[..., s:s + tile_w])
+            shifts.append(s * stride - j * hop)
+        o = model.forward_head(torch.cat(tiles))
+
+        # Tile coordinates to window coordinates, boxes are (center_x, center_y, w, h) relative to the image width
+        pred_boxes = o['pred_boxes'].clone()
+        pred_boxes[..., 0] += torch.Tensor(shifts)[:, None] / w_pix
+        out['pred_logits'].append(o['pred_logits'])
+        out['pred_boxes'].append(pred_boxes)
+
+    return {key: torch.cat(value) for key, value in out.items()}
+
+
+INFERENCE_WEIGHTS = ['model_inference.safetensors', 'model_inference.pt']
+TRAINING_WEIGHTS = 'model_chkpt_last.pt'
+
+
+def find_weights(mod_p):
+    '''
+    Returns the path of the weights to load, slim inference-only checkpoints (see export_weights.py) are preferred,
+    unless the training checkpoint is more recent: the export is then stale and the training checkpoint is used
+    '''
+    chkpt_path = os.path.join(mod_p, TRAINING_WEIGHTS)
+    for weights_name in INFERENCE_WEIGHTS:
+        weights_path = os.path.join(mod_p, weights_name)
+        if not os.path.isfile(weights_path):
+            continue
+        if os.path.isfile(chkpt_path) and os.path.getmtime(chkpt_path) > os.path.getmtime(weights_path):
+            print(f'{weights_path} is older than {chkpt_path}, loading the training checkpoint, '
+                  'run export_weights.py to refresh the export')
+            return chkpt_path
+        return weights_path
+    if os.path.isfile(chkpt_path):
+        return chkpt_path
+    raise FileNotFoundError(f'No weights found in {mod_p}, expected one of {INFERENCE_WEIGHTS + [TRAINING_WEIGHTS]}')
+
+
 def load_model(mod_p):
 
+    weights_path = find_weights(mod_p)
+    # Memory-mapped, the weights are read again by load_weights_cpu without a copy
+    checkpoint = load_checkpoint_cpu(weights_path)
+
+    # Exports embed the digest of their weights, a mismatch means a corrupted or partial file
+    if 'sha256' in checkpoint and state_dict_digest(checkpoint['checkpoints']) != checkpoint['sha256']:
+        raise ValueError(f'{weights_path} does not match its sha256 digest, re-run export_weights.py')
+
     args_path = os.path.join(mod_p, 'args')
-    with open(args_path, 'rb') as f:
-        args = json.load(f)
+    if os.path.isfile(args_path):
+        with open(args_path, 'rb') as f:
+            args = json.load(f)
+    elif 'args' in checkpoint:
+        # Inference checkpoints embed the training configuration
+        args = checkpoint['args']
+    else:
+        raise ValueError(f'No training configuration for {weights_path}: expected an args file in {mod_p} '
+                         'or a checkpoint exported with export_weights.py')
+    del checkpoint
 
     config = Config()
     for attr, attr_value in args.items():
@@ -78,7 +195,7 @@ def load_model(mod_p):
         aux_loss=False,
     )
 
-    model = load_weights_cpu(config, model, path=os.path.join(mod_p, 'model_chkpt_last.pt'), train=False) # .to(config.device)
+    model = load_weights_cpu(config, model, path=weights_path, train=False) # .to(config.device)
 
     return model, config
 
@@ -119,3 +236,10 @@ def postpro_detr(outputs, config, min_score=0.4):
         output.append(b_output)
     
     return output
+
+
+def empty_detr_output(config):
+    return {
+        str(class_idx): dict(bbox_coord=torch.Tensor(), scores=torch.Tensor())
+        for class_idx in range(1, config.num_classes + 1)
+    }
@@ -0,0 +1,101 @@
+"""
+Inference weights serialization.
+
+Besides torch pickles, weights can be stored in a flat, safetensors-compatible layout:
+    - 8 bytes: little-endian uint64, size N of the JSON header
+    - N bytes: JSON header, {tensor_name: {dtype, shape, data_offsets}, "__metadata__": {str: str}}
+    - raw tensor bytes, contiguous, at the given offsets of the data section
+The data section can be memory-mapped and tensors built on top of it without any copy.
+"""
+import hashlib
+import json
+import mmap
+import struct
+
+import numpy as np
+import torch
+
+
+DTYPES = {
+    torch.float32: 'F32',
+    torch.float16: 'F16',
+    torch.bfloat16: 'BF16',
+    torch.int64: 'I64',
+    torch.int32: 'I32',
+    torch.uint8: 'U8',
+    torch.bool: 'BOOL',
+}
+TORCH_DTYPES = {v: k for k, v in DTYPES.items()}
+
+
+def tensor_bytes(tensor):
+    return tensor.detach().contiguous().cpu().view(-1).view(torch.uint8).numpy()
+
+
+def state_dict_digest(state_dict):
+    """
+    sha256 of the tensors of a state dict: names, dtypes, shapes and raw bytes, in sorted name order.
+    Independent of the serialization format, so the same digest is valid for pickles and flat files.
+    """
+    digest = hashlib.sha256()
+    for key in sorted(state_dict.keys()):
+        tensor = state_dict[key]
+        digest.update(key.encode())
+        digest.update(DTYPES[tensor.dtype].encode())
+        digest.update(str(list(tensor.shape)).encode())
+        digest.update(tensor_bytes(tensor))
+    return digest.hexdigest()
+
+
+def save_flat(state_dict, path, metadata=None):
+    # Largest element sizes first: with an 8-byte aligned data section, every tensor is then aligned on its
+    # element size without leaving holes between tensors
+    keys = sorted(state_dict.keys(), key=lambda k: -state_dict[k].element_size())
+    header = {}
+    offset = 0
+    for key in keys:
+        tensor = state_dict[key]
+        n_bytes = tensor.numel() * tensor.element_size()
+        header[key] = dict(dtype=DTYPES[tensor.dtype], shape=list(tensor.shape), data_offsets=[offset, offset + n_bytes])
+        offset += n_bytes
+    if metadata:
+        header['__metadata__'] = {k: v if isinstance(v, str) else json.dumps(v) for k, v in metadata.items()}
+
+    header = json.dumps(header).encode()
+    # Align the data section on 8 bytes
+    header += b' ' * (-len(header) % 8)
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for key in keys:
+            f.write(tensor_bytes(state_dict[key]).tobytes())
+
+
+def read_flat_header(path):
+    with open(path, 'rb') as f:
+        header_size = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_size))
+    metadata = header.pop('__metadata__', {})
+    return header, metadata, 8 + header_size
+
+
+def load_flat(path):
+    """
+    Returns the state dict and metadata of a flat weights file. Tensors are views on a
+    copy-on-write memory map of the file: pages are read lazily and shared until written to,
+    a written page becomes a private copy and the file itself is never modified.
+    """
+    header, metadata, data_start = read_flat_header(path)
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    state_dict = {}
+    for key, info in header.items():
+        start, end = info['data_offsets']
+        dtype = TORCH_DTYPES[info['dtype']]
+        if end == start:
+            state_dict[key] = torch.empty(info['shape'], dtype=dtype)
+            continue
+        data = np.frombuffer(buffer, dtype=np.uint8, count=end - start, offset=data_start + start)
+        state_dict[key] = torch.from_numpy(data).view(dtype).view(info['shape'])
+    return state_dict, metadata
@@ -1,8 +1,5 @@
 import numpy as np
 import torch
-import matplotlib.pyplot as plt
-import matplotlib.ticker as mticker
-import matplotlib.patches as patches
 
 from src.models.util.nets_utils import nms
 
@@ -97,6 +94,10 @@ def merge_images(fp, outputs, num_classes, nms_thresh=0.3):
 
 
 def visualise_model_out(output, fp, spectrogram, reverse_dict):
+    # Plotting only: matplotlib is not loaded by the inference server
+    import matplotlib.pyplot as plt
+    import matplotlib.ticker as mticker
+    import matplotlib.patches as patches
 
     time_limits = [(i * fp.HOP_SPECTRO, i * fp.HOP_SPECTRO + 1024) for i, _ in spectrogram]
     min_score = 0.01
@@ -162,13 +163,16 @@ def visualise_model_out(output, fp, spectrogram, reverse_dict):
         plt.show()
 
 
-def get_detections_times_and_freqs(output, fp, spectrogram, reverse_dict):
-    
+def get_detection_records(output, fp, spectrogram, reverse_dict, min_score=0.01):
+    '''
+    Returns the detections of the windows in spectrogram, as dicts with the bird id, the species name
+    ('Unsure' under min_score), the time (s) and frequency (Hz) limits and the score of each box
+    '''
     time_limits = [(i * fp.HOP_SPECTRO, i * fp.HOP_SPECTRO + 1024) for i, _ in spectrogram]
-    min_score = 0.01
+    pix_precision_y = 33.3
+    pix_precision_x = 0.002993197278911565 # 0.003
 
-    # List to store all the lines to print in a file
-    lines = []
+    records = []
 
     for idx, (i, spectro) in enumerate(spectrogram):
         start, end = time_limits[idx]
@@ -191,22 +195,33 @@ def get_detections_times_and_freqs(output, fp, spectrogram, reverse_dict):
 
             for j, row in enumerate(bbox):
 
-                x_1, y_1, x_2, y_2 = row
-                x_1 = int(x_1)
-                x_2 = int(x_2)
-                y_1 = int(y_1)
-                y_2 = int(y_2)
-                pix_precision_y = 33.3
-                pix_precision_x = 0.002993197278911565 # 0.003
+                x_1, y_1, x_2, y_2 = [int(v) for v in row]
 
                 score = np.round(scores[j].item(), 4)
-                if score < min_score:
-                    species = 'Unsure'
-                else:
-                    species = reverse_dict[b_id]
+                records.append(dict(
+                    bird_id=int(b_id),
+                    species='Unsure' if score < min_score else b_species,
+                    t_start=x_1 * pix_precision_x,
+                    t_end=x_2 * pix_precision_x,
+                    f_start=y_1 * pix_precision_y,
+                    f_end=y_2 * pix_precision_y,
+                    score=float(score),
+                ))
+
+    return records
+
+
+def get_detections_times_and_freqs(output, fp, spectrogram, reverse_dict, records=None):
+    '''
+    Returns the detections as lines of an annotation file, records can be passed if already computed
+    '''
+    if records is None:
+        records = get_detection_records(output, fp, spectrogram, reverse_dict)
 
-                line = f"{x_1*pix_precision_x}\t{x_2*pix_precision_x}\t{species}\n\\\t{y_1*pix_precision_y}\t{y_2*pix_precision_y}\n"
-                lines.append(line)
+    # List to store all the lines to print in a file
+    lines = []
+    for r in records:
+        line = f"{r['t_start']}\t{r['t_end']}\t{r['species']}\n\\\t{r['f_start']}\t{r['f_end']}\n"
+        lines.append(line)
 
     return lines
-
@@ -7,6 +7,8 @@ from fastapi.testclient import TestClient
 THIS_DIR = Path(__file__).parent
 APP_DIR_PARENT = (THIS_DIR / ".." / "app").resolve()
 sys.path.insert(0, str(APP_DIR_PARENT))
+# The API runs from app/api, where its `config` module lives
+sys.path.insert(0, str(APP_DIR_PARENT / "api"))
 
 
 @pytest.fixture(scope="function")
@@ -0,0 +1,126 @@
+"""Local Stack Load Test.
+
+Runs the API and inference workers in a single process, on the in-process stand-ins
+of MinIO, RabbitMQ and SMTP (`CLIENTS_BACKEND=local`, see app_utils.clients) and on
+SQLite, and replays traffic against them with the traffic generator (traffic.py).
+No docker-compose stack is needed: results are reproducible on a laptop.
+
+- The API is served in-process (ASGI transport): its startup runs as in production,
+  the feedback consumer and the email dispatcher included.
+- Each worker is a thread running `worker.serve`. The model is simulated by default,
+  sleeping `--model-speed` seconds per second of audio, to load the plumbing only;
+  `--model tiny` runs the real pipeline with a random tiny DETR (see pipeline_benchmark.py).
+- Set `ASYNC_DATABASE_URL` to use a local Postgres instead of SQLite.
+
+Usage:
+    python tests/load/local_stack.py --rate 5 --duration 30 --workers 2
+    python tests/load/local_stack.py --model tiny --mix 10:0.8,30:0.2 --rate 0.2
+
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import httpx
+import soundfile
+from traffic import get_args_parser, replay, replay_kwargs
+
+ROOT = Path(__file__).resolve().parents[2]
+
+
+class SimulatedModelServer:
+    """Stands in for the model server, taking `speed` seconds per second of audio."""
+
+    def __init__(self, speed):
+        self.speed = speed
+
+    def get_classification(self, file_path, return_spectrogram=False, interactive=False):
+        duration = soundfile.info(file_path).duration
+        time.sleep(duration * self.speed)
+        return ["0.0\t1.0\tsimulated\n"], [], []
+
+
+def load_services(db_dir):
+    """Configure the local backends and import the API and the worker."""
+    os.environ["CLIENTS_BACKEND"] = "local"
+    for name, value in {
+        "ASYNC_DATABASE_URL": f"sqlite+aiosqlite:///{db_dir}/loadtest.db",
+        "MINIO_BUCKET": "loadtest",
+        "RABBITMQ_QUEUE_API2INF": "inference",
+        "RABBITMQ_QUEUE_INF2API": "feedback",
+        "QUEUE_DEPTH_INTERVAL_SECONDS": "1",
+    }.items():
+        os.environ.setdefault(name, value)
+
+    # Like the containers: the API runs from app/api, the worker from app
+    sys.path.insert(0, str(ROOT))
+    sys.path.insert(0, str(ROOT / "app"))
+    sys.path.insert(0, str(ROOT / "app" / "api"))
+    import main
+    from inference import worker
+
+    return main, worker
+
+
+async def run(args) -> dict:
+    with tempfile.TemporaryDirectory() as db_dir:
+        main, worker = load_services(db_dir)
+        if args.model == "tiny":
+            from pipeline_benchmark import build_model_server
+
+            model_server = build_model_server("tiny", stage_hook=worker.stage_hook)
+        else:
+            model_server = SimulatedModelServer(args.model_speed)
+        worker.registry.override("model_server", model_server)
+
+        await main.startup_event()
+        stop_event = threading.Event()
+        workers = [
+            threading.Thread(target=worker.serve, kwargs={"stop_event": stop_event}, daemon=True)
+            for _ in range(args.workers)
+        ]
+        for thread in workers:
+            thread.start()
+
+        transport = httpx.ASGITransport(app=main.app)
+        try:
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://api", timeout=120
+            ) as client:
+                report = await replay(client, **replay_kwargs(args))
+        finally:
+            stop_event.set()
+            for thread in workers:
+                await asyncio.to_thread(thread.join)
+            # Connections of the worker threads
+            worker.registry.close()
+            await main.shutdown_event()
+
+    from app_utils.standins import NullSMTPConnection
+
+    report["workers"]["count"] = args.workers
+    report["workers"]["model"] = args.model
+    report["emails_sent"] = NullSMTPConnection.sent
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Local stack load test", parents=[get_args_parser()])
+    parser.add_argument("--workers", default=1, type=int, help="Worker threads")
+    parser.add_argument("--model", default="simulated", choices=("simulated", "tiny"))
+    parser.add_argument(
+        "--model-speed",
+        default=0.01,
+        type=float,
+        help="Simulated model: seconds of compute per second of audio",
+    )
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(run(args)), indent=2))
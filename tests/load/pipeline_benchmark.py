@@ -0,0 +1,275 @@
+"""Inference Pipeline Benchmark.
+
+Times every stage of the inference pipeline, from the spectrogram computed by
+`File_Processor` to the annotation text and the spectrogram artifact, on synthetic
+recordings of configurable duration and sample rate.
+
+No trained model is needed: by default the DETR is randomly initialized, with a tiny
+configuration (`--arch tiny`, a few seconds per minute of audio on a laptop) or the
+production one (`--arch full`). Pass `--weights` to benchmark a trained model instead.
+Recordings at another sample rate than 44100 Hz are resampled with ffmpeg, like uploads.
+Recordings shorter than one spectrogram window (about 3 s) get no annotations with
+random weights: their boxes extend beyond the end of the file and are dropped.
+
+Stages (seconds, summed over the recording):
+- stft, forward, postprocess: `run_detection`, forwards and postprocessing are per batch
+- inference: the whole `run_detection`
+- merge, classify: merge of the window detections and annotation lines
+- artifact: serialization of the spectrogram windows
+- total: from the audio file to the annotation text and the artifact
+
+Results are printed and written as JSON. Pass a previous result file with `--baseline`
+to compare: the script exits with an error if a stage is slower than `--tolerance`.
+
+Usage:
+    python tests/load/pipeline_benchmark.py --durations 10 60 --output bench.json
+    python tests/load/pipeline_benchmark.py --durations 10 60 --baseline bench.json
+
+"""
+
+import argparse
+import json
+import platform
+import socket
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+import soundfile
+import torch
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT / "app"))
+sys.path.insert(0, str(ROOT))
+
+from app_utils.spectrogram import write_spectrogram
+from model_serve.model_serve import ModelServer
+
+from src.models.backbone import build_backbone
+from src.models.detr import DETR
+from src.models.transformer import build_transformer
+from src.models.util.nets_utils import Config
+
+ARCHITECTURES = {
+    "tiny": {
+        "backbone": "resnet18",
+        "dilation": False,
+        "hidden_dim": 64,
+        "enc_layers": 1,
+        "dec_layers": 1,
+        "dim_feedforward": 128,
+        "nheads": 4,
+        "num_queries": 10,
+    },
+    # detr_noneg_100q_bs20_r50dc5
+    "full": {
+        "backbone": "resnet50",
+        "dilation": True,
+        "hidden_dim": 256,
+        "enc_layers": 6,
+        "dec_layers": 6,
+        "dim_feedforward": 2048,
+        "nheads": 8,
+        "num_queries": 100,
+    },
+}
+NUM_CLASSES = 20
+
+
+#################### INPUTS ####################
+def make_wav(path, seconds, sample_rate=44100, n_calls=None, seed=0) -> None:
+    """Write a mono WAV of background noise with a frequency sweep (bird call) every ~5s."""
+    rng = np.random.default_rng(seed)
+    n_samples = int(seconds * sample_rate)
+    audio = 0.001 * rng.standard_normal(n_samples).astype(np.float32)
+
+    t = np.arange(int(0.5 * sample_rate)) / sample_rate
+    n_calls = n_calls if n_calls is not None else max(1, int(seconds // 5))
+    for start in rng.uniform(0, max(seconds - 0.5, 0), n_calls):
+        low = rng.uniform(1500, 6000)
+        call = 0.3 * np.sin(2 * np.pi * (low + 4000 * t) * t).astype(np.float32)
+        offset = int(start * sample_rate)
+        audio[offset : offset + len(call)] += call[: n_samples - offset]
+    soundfile.write(path, audio, sample_rate)
+
+
+def build_model_server(arch, weights=None, batch_size=10, stage_hook=None) -> ModelServer:
+    """Build a model server with random (or trained, if `weights` is given) DETR weights."""
+    if weights is not None:
+        from src.models.bird_dict import BIRD_DICT
+
+        model_server = ModelServer(
+            weights, BIRD_DICT, batch_size=batch_size, stage_hook=stage_hook
+        )
+        model_server.load()
+        return model_server
+
+    config = Config()
+    settings = {
+        **ARCHITECTURES[arch],
+        "position_embedding": "sine",
+        "dropout": 0.0,
+        "pre_norm": False,
+        "lr_backbone": 0.0,
+        "num_classes": NUM_CLASSES,
+    }
+    for attr, value in settings.items():
+        setattr(config, attr, value)
+
+    torch.manual_seed(0)
+    model = DETR(
+        build_backbone(config),
+        build_transformer(config),
+        num_classes=config.num_classes,
+        num_queries=config.num_queries,
+        aux_loss=False,
+    ).eval()
+    # Random weights are never confident: favour one species so that every window
+    # has detections to postprocess, merge and classify, like real birdsong.
+    # Its scores are then close to 1: a bias shared by several species splits the
+    # probability between them, around the 0.5 detection threshold
+    with torch.no_grad():
+        model.class_embed.bias[1] += 10.0
+
+    bird_dict = {f"species_{idx}": idx for idx in range(1, NUM_CLASSES + 1)}
+    model_server = ModelServer(None, bird_dict, batch_size=batch_size, stage_hook=stage_hook)
+    model_server.model, model_server.config = model, config
+    model_server.model_loaded = True
+    return model_server
+
+
+#################### BENCHMARK ####################
+class StageTimer:
+    """Stage hook summing the duration of every stage of a run."""
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.n_windows = {}
+
+    def __call__(self, stage, seconds, n_windows=None) -> None:
+        self.seconds[stage] += seconds
+        if stage == "stft":
+            self.n_windows["total"] = n_windows
+        if stage == "forward" and n_windows:
+            self.n_windows["forward"] = self.n_windows.get("forward", 0) + n_windows
+
+
+def run_pipeline(model_server, timer, wav_path) -> tuple:
+    """Run the worker pipeline on a file: annotation lines and spectrogram artifact."""
+    start = time.perf_counter()
+    lines, spectrogram, _ = model_server.get_classification(wav_path, return_spectrogram=True)
+    annotations = "\n".join(lines)
+
+    artifact_start = time.perf_counter()
+    artifact = write_spectrogram(spectrogram)
+    timer("artifact", time.perf_counter() - artifact_start)
+    timer("total", time.perf_counter() - start)
+    return annotations, artifact
+
+
+def bench_duration(model_server, timer, wav_path, repeat) -> dict:
+    # Warmup: allocator, thread pools, librosa caches
+    run_pipeline(model_server, StageTimer(), wav_path)
+
+    runs = []
+    for _ in range(repeat):
+        timer.seconds.clear()
+        timer.n_windows.clear()
+        annotations, artifact = run_pipeline(model_server, timer, wav_path)
+        runs.append(dict(timer.seconds))
+
+    # Median over the runs, per stage
+    stages = {stage: float(np.median([run[stage] for run in runs])) for stage in runs[0]}
+    n_windows = timer.n_windows.get("total", 0)
+    return {
+        "stages": {stage: round(seconds, 4) for stage, seconds in stages.items()},
+        "n_windows": n_windows,
+        "windows_per_s": round(n_windows / stages["inference"], 2) if n_windows else None,
+        "n_annotations": len(annotations.splitlines()),
+        "artifact_bytes": len(artifact),
+    }
+
+
+def run(args) -> dict:
+    torch.set_num_threads(args.threads)
+    timer = StageTimer()
+    model_server = build_model_server(
+        args.arch, args.weights, batch_size=args.batch_size, stage_hook=timer
+    )
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for seconds in args.durations:
+            wav_path = str(Path(tmp_dir) / f"bench_{seconds:g}s.wav")
+            make_wav(wav_path, seconds, args.sample_rate)
+            results[f"{seconds:g}s"] = bench_duration(model_server, timer, wav_path, args.repeat)
+            print(f"{seconds:g}s: {json.dumps(results[f'{seconds:g}s'])}", file=sys.stderr)
+
+    return {
+        "meta": {
+            "host": socket.gethostname(),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "threads": args.threads,
+            "arch": "weights" if args.weights else args.arch,
+            "batch_size": args.batch_size,
+            "sample_rate": args.sample_rate,
+            "repeat": args.repeat,
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def compare(report, baseline, tolerance) -> list:
+    """Return the (duration, stage, ratio) of the stages slower than the baseline by
+    more than `tolerance` (0.1 = 10%)."""
+    regressions = []
+    for duration, result in report["results"].items():
+        previous = baseline["results"].get(duration)
+        if previous is None:
+            continue
+        for stage, seconds in result["stages"].items():
+            before = previous["stages"].get(stage)
+            if not before:
+                continue
+            ratio = seconds / before
+            print(f"{duration} {stage:<12} {before:9.4f}s -> {seconds:9.4f}s  x{ratio:.2f}")
+            if ratio > 1 + tolerance:
+                regressions.append((duration, stage, round(ratio, 2)))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Inference pipeline benchmark")
+    parser.add_argument(
+        "--durations",
+        default=[10, 60],
+        type=float,
+        nargs="+",
+        help="Durations of the synthetic recordings, in seconds",
+    )
+    parser.add_argument("--sample-rate", default=44100, type=int)
+    parser.add_argument("--arch", default="tiny", choices=sorted(ARCHITECTURES))
+    parser.add_argument("--weights", default=None, help="Trained model directory")
+    parser.add_argument("--batch-size", default=10, type=int)
+    parser.add_argument("--threads", default=torch.get_num_threads(), type=int)
+    parser.add_argument("--repeat", default=3, type=int, help="Timed runs, after one warmup")
+    parser.add_argument("--output", default=None, help="Write the results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="Previous results to compare with")
+    parser.add_argument("--tolerance", default=0.1, type=float)
+    args = parser.parse_args()
+
+    report = run(args)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+    if args.baseline:
+        regressions = compare(report, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        if regressions:
+            raise SystemExit(f"Slower than the baseline: {regressions}")
@@ -0,0 +1,142 @@
+"""Publisher Throughput Benchmark.
+
+Measures the publish rate of `AsyncPublisher`, with publisher confirms,
+one message at a time and with concurrent publishes, for several channel pool sizes.
+
+By default the broker is a local stand-in: each channel confirms, in one batch,
+every message received during the last round trip, like RabbitMQ does with the
+`multiple` flag. Publishes can be made to fail randomly to exercise retries.
+Pass `--host` to benchmark against a real broker instead.
+
+Usage:
+    python tests/load/publish_benchmark.py --messages 2000 --concurrency 200 --rtt-ms 2
+    python tests/load/publish_benchmark.py --host localhost --port 5672
+
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "app"))
+
+from app_utils.publisher import AsyncPublisher
+
+
+#################### BROKER STAND-IN ####################
+class StandInExchange:
+    def __init__(self, channel):
+        self.channel = channel
+
+    async def publish(self, message, routing_key, timeout=None):
+        if random.random() < self.channel.fail_rate:
+            raise ConnectionError("stand-in broker: connection reset")
+        confirm = asyncio.get_running_loop().create_future()
+        self.channel.pending.append(confirm)
+        self.channel.published[routing_key] = self.channel.published.get(routing_key, 0) + 1
+        await asyncio.wait_for(confirm, timeout)
+
+
+class StandInChannel:
+    """Channel confirming the messages received during each round trip in one batch."""
+
+    def __init__(self, rtt, fail_rate, published):
+        self.rtt = rtt
+        self.fail_rate = fail_rate
+        self.published = published
+        self.pending = []
+        self.is_closed = False
+        self.default_exchange = StandInExchange(self)
+        self._confirmer = asyncio.create_task(self._confirm_batches())
+
+    async def _confirm_batches(self):
+        while True:
+            await asyncio.sleep(self.rtt)
+            batch, self.pending = self.pending, []
+            for confirm in batch:
+                if not confirm.done():
+                    confirm.set_result(None)
+
+    async def declare_queue(self, queue_name, durable=True):
+        pass
+
+    async def close(self):
+        self.is_closed = True
+        self._confirmer.cancel()
+
+
+class StandInConnection:
+    def __init__(self, rtt, fail_rate):
+        self.rtt = rtt
+        self.fail_rate = fail_rate
+        self.published = {}
+
+    async def channel(self, publisher_confirms=True):
+        return StandInChannel(self.rtt, self.fail_rate, self.published)
+
+    async def close(self):
+        pass
+
+
+#################### BENCHMARK ####################
+async def bench(publisher, n_messages, concurrency) -> float:
+    message = {"ticket_number": "abcdef", "email": "bench@example.com"}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded_publish():
+        async with semaphore:
+            await publisher.publish("bench_queue", message)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(bounded_publish() for _ in range(n_messages)))
+    return n_messages / (time.perf_counter() - start)
+
+
+async def run(args) -> list:
+    results = []
+    for pool_size in args.pool_sizes:
+        for concurrency in (1, args.concurrency):
+            if args.host:
+                publisher = AsyncPublisher(args.host, args.port, pool_size=pool_size)
+            else:
+                connection = StandInConnection(args.rtt_ms / 1000, args.fail_rate)
+
+                async def connect(**kwargs):
+                    return connection
+
+                publisher = AsyncPublisher(
+                    None, None, pool_size=pool_size, backoff=0.001, connect=connect
+                )
+            await publisher.start()
+            await publisher.declare_queue("bench_queue")
+            # One message at a time is slow: fewer of them are enough
+            n_messages = args.messages if concurrency > 1 else min(args.messages, 200)
+            rate = await bench(publisher, n_messages, concurrency)
+            await publisher.close()
+            results.append(
+                {
+                    "pool_size": pool_size,
+                    "concurrency": concurrency,
+                    "messages": n_messages,
+                    "messages_per_s": round(rate, 1),
+                }
+            )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Publisher throughput benchmark")
+    parser.add_argument("--messages", default=2000, type=int)
+    parser.add_argument("--concurrency", default=200, type=int)
+    parser.add_argument("--pool-sizes", default=[1, 4], type=int, nargs="+")
+    parser.add_argument("--rtt-ms", default=2.0, type=float, help="Stand-in broker round trip")
+    parser.add_argument("--fail-rate", default=0.0, type=float, help="Stand-in publish failures")
+    parser.add_argument("--host", default=None, help="Benchmark a real broker")
+    parser.add_argument("--port", default=5672, type=int)
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(run(args)), indent=2))
@@ -0,0 +1,219 @@
+"""Traffic Generator.
+
+Replays a realistic mix of recordings against the API and follows every ticket to
+completion, to measure the API, the queues and the workers together:
+
+- uploads arrive as a Poisson process of `--rate` uploads per second, for `--duration`
+  seconds, their lengths drawn from `--mix` (seconds:weight pairs)
+- each ticket is polled (`GET /tickets/{ticket_number}`) until done, giving the time
+  spent queued and the end-to-end latency, within the polling interval
+- the queue depths are sampled from the `/metrics` endpoint of the API
+
+Reports upload throughput and latency percentiles, queue depths and waits,
+and worker throughput (tickets and seconds of audio per second), as JSON.
+Runs against a running API with `--url`, see local_stack.py to run without one.
+
+Usage:
+    python tests/load/traffic.py --url http://localhost:8001 --rate 2 --duration 60
+
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import random
+import re
+import time
+import wave
+
+import httpx
+import numpy as np
+
+DEFAULT_MIX = "10:0.5,30:0.25,60:0.15,300:0.1"
+QUEUE_DEPTH_PATTERN = re.compile(r'^nbm_queue_depth\{queue="([^"]+)"\} ([0-9.e+]+)$', re.M)
+
+
+def parse_mix(mix) -> list:
+    """Parse `seconds:weight,...` into (seconds, weight) pairs."""
+    pairs = [item.split(":") for item in mix.split(",")]
+    return [(float(seconds), float(weight)) for seconds, weight in pairs]
+
+
+def make_wav(seconds, sample_rate=44100, seed=0) -> bytes:
+    """Build a 16-bit mono WAV file of low background noise."""
+    rng = np.random.default_rng(seed)
+    samples = rng.normal(0, 30, int(seconds * sample_rate)).astype("<i2")
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+def percentiles(values) -> dict:
+    values = sorted(values)
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    return {
+        f"p{p}": round(values[min(len(values) - 1, int(p / 100 * len(values)))], 3)
+        for p in (50, 95, 99)
+    }
+
+
+#################### CLIENTS ####################
+async def follow_ticket(client, content, seconds, email, poll_interval, deadline) -> dict:
+    """Upload a recording, then poll its ticket until done or until `deadline`."""
+    result = {"clip_seconds": seconds, "error": None, "wait_s": None, "latency_s": None}
+    start = time.perf_counter()
+    try:
+        response = await client.post(
+            "/upload",
+            files={"file": ("load_test.wav", io.BytesIO(content), "audio/wav")},
+            data={"email": email},
+        )
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        result["error"] = repr(e)
+        return result
+    result["upload_s"] = time.perf_counter() - start
+    ticket_number = response.json()["ticket_number"]
+
+    while time.perf_counter() < deadline:
+        await asyncio.sleep(poll_interval)
+        try:
+            response = await client.get(f"/tickets/{ticket_number}")
+            response.raise_for_status()
+        except httpx.HTTPError:
+            continue
+        status = response.json()["status"]
+        if status != "queued" and result["wait_s"] is None:
+            result["wait_s"] = time.perf_counter() - start
+        if status == "done":
+            result["latency_s"] = time.perf_counter() - start
+            break
+    return result
+
+
+async def sample_queue_depths(client, interval, samples) -> None:
+    """Append the queue depths exposed on /metrics to `samples`, every `interval` seconds."""
+    while True:
+        try:
+            response = await client.get("/metrics")
+            depths = QUEUE_DEPTH_PATTERN.findall(response.text)
+            samples.append({queue: float(depth) for queue, depth in depths})
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(interval)
+
+
+#################### REPLAY ####################
+async def replay(
+    client,
+    mix=DEFAULT_MIX,
+    rate=1.0,
+    duration=60.0,
+    poll_interval=0.5,
+    drain_timeout=300.0,
+    sample_interval=1.0,
+    email="load@example.com",
+    seed=0,
+) -> dict:
+    """Replay the traffic with an httpx client bound to the API (`base_url` or transport)."""
+    mix = parse_mix(mix)
+    rng = random.Random(seed)
+    clips = {seconds: make_wav(seconds) for seconds, _ in mix}
+
+    samples = []
+    sampler = asyncio.create_task(sample_queue_depths(client, sample_interval, samples))
+    start = time.perf_counter()
+    deadline = start + duration + drain_timeout
+    tickets = []
+    arrival = rng.expovariate(rate)
+    while arrival < duration:
+        await asyncio.sleep(max(0.0, start + arrival - time.perf_counter()))
+        seconds = rng.choices([s for s, _ in mix], weights=[w for _, w in mix])[0]
+        tickets.append(
+            asyncio.create_task(
+                follow_ticket(client, clips[seconds], seconds, email, poll_interval, deadline)
+            )
+        )
+        arrival += rng.expovariate(rate)
+    results = await asyncio.gather(*tickets)
+    elapsed = time.perf_counter() - start
+    sampler.cancel()
+
+    return summarize(results, samples, duration, elapsed)
+
+
+def summarize(results, samples, duration, elapsed) -> dict:
+    uploaded = [r for r in results if r["error"] is None]
+    done = [r for r in uploaded if r["latency_s"] is not None]
+    queues = sorted({queue for sample in samples for queue in sample})
+    return {
+        "api": {
+            "uploads": len(results),
+            "errors": len(results) - len(uploaded),
+            "uploads_per_s": round(len(uploaded) / duration, 3),
+            "upload_latency_s": percentiles([r["upload_s"] for r in uploaded]),
+        },
+        "queues": {
+            "max_depth": {q: max(s.get(q, 0) for s in samples) for q in queues},
+            "mean_depth": {
+                q: round(sum(s.get(q, 0) for s in samples) / len(samples), 2) for q in queues
+            },
+            "wait_s": percentiles([r["wait_s"] for r in uploaded if r["wait_s"] is not None]),
+        },
+        "workers": {
+            "tickets_done": len(done),
+            "unfinished": len(uploaded) - len(done),
+            "tickets_per_s": round(len(done) / elapsed, 3),
+            "audio_seconds_per_s": round(sum(r["clip_seconds"] for r in done) / elapsed, 2),
+            "end_to_end_s": percentiles([r["latency_s"] for r in done]),
+        },
+        "elapsed_s": round(elapsed, 2),
+    }
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser("Traffic generator", add_help=False)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Clip lengths, as seconds:weight,...")
+    parser.add_argument("--rate", default=1.0, type=float, help="Uploads per second")
+    parser.add_argument("--duration", default=60.0, type=float, help="Seconds of arrivals")
+    parser.add_argument("--poll-interval", default=0.5, type=float)
+    parser.add_argument(
+        "--drain-timeout",
+        default=300.0,
+        type=float,
+        help="Time to wait for the last tickets, after the arrivals",
+    )
+    parser.add_argument("--email", default="load@example.com")
+    parser.add_argument("--seed", default=0, type=int)
+    return parser
+
+
+def replay_kwargs(args) -> dict:
+    return {
+        "mix": args.mix,
+        "rate": args.rate,
+        "duration": args.duration,
+        "poll_interval": args.poll_interval,
+        "drain_timeout": args.drain_timeout,
+        "email": args.email,
+        "seed": args.seed,
+    }
+
+
+async def main(args) -> dict:
+    async with httpx.AsyncClient(base_url=args.url, timeout=120) as client:
+        return await replay(client, **replay_kwargs(args))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Traffic generator", parents=[get_args_parser()])
+    parser.add_argument("--url", default="http://localhost:8001")
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(main(args)), indent=2))
@@ -0,0 +1,88 @@
+"""Upload Load Test.
+
+Sends concurrent uploads to a running API and reports requests per second
+and latency percentiles.
+
+Usage:
+    python tests/load/upload_load.py --url http://localhost:8001 \
+        --requests 500 --concurrency 100 --size-kb 512
+
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import struct
+import time
+
+import httpx
+
+
+def make_wav(size_kb, sample_rate=44100) -> bytes:
+    """Build a silent 16-bit mono WAV file of about `size_kb` kilobytes."""
+    data_size = size_kb * 1024
+    header = b"RIFF" + struct.pack("<I", 36 + data_size) + b"WAVE"
+    header += b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, sample_rate, 2 * sample_rate, 2, 16)
+    header += b"data" + struct.pack("<I", data_size)
+    return header + bytes(data_size)
+
+
+async def upload(client, url, content, email, latencies, errors) -> None:
+    start = time.perf_counter()
+    try:
+        response = await client.post(
+            f"{url}/upload",
+            files={"file": ("load_test.wav", io.BytesIO(content), "audio/wav")},
+            data={"email": email},
+        )
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+    except httpx.HTTPError as e:
+        errors.append(str(e))
+
+
+async def run(url, n_requests, concurrency, size_kb, email) -> dict:
+    content = make_wav(size_kb)
+    latencies, errors = [], []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded_upload(client):
+        async with semaphore:
+            await upload(client, url, content, email, latencies, errors)
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(bounded_upload(client) for _ in range(n_requests)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else None
+
+    return {
+        "requests": n_requests,
+        "concurrency": concurrency,
+        "size_kb": size_kb,
+        "errors": len(errors),
+        "elapsed_s": elapsed,
+        "requests_per_s": len(latencies) / elapsed,
+        "latency_p50_s": percentile(0.5),
+        "latency_p95_s": percentile(0.95),
+        "latency_p99_s": percentile(0.99),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Concurrent upload load test")
+    parser.add_argument("--url", default="http://localhost:8001")
+    parser.add_argument("--requests", default=200, type=int)
+    parser.add_argument("--concurrency", default=50, type=int)
+    parser.add_argument("--size-kb", default=512, type=int)
+    parser.add_argument("--email", default="load@example.com")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.url, args.requests, args.concurrency, args.size_kb, args.email))
+    print(json.dumps(results, indent=2))
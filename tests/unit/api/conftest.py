@@ -0,0 +1,11 @@
+import os
+
+# The database engine is created when the API modules are imported
+for name, value in {
+    "POSTGRES_USER": "test_user",
+    "POSTGRES_PASSWORD": "test_password",
+    "POSTGRES_HOST": "localhost",
+    "POSTGRES_PORT": "5432",
+    "POSTGRES_DB": "test_db",
+}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,79 @@
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from api import crud
+from api.cache import BirdCache
+
+
+@pytest.mark.asyncio()
+async def test_populate_bird_table_single_statement():
+    session = MagicMock()
+    session.execute = AsyncMock()
+    session.commit = AsyncMock()
+
+    await crud.populate_bird_table(session)
+
+    session.execute.assert_awaited_once()
+    statement = session.execute.call_args.args[0]
+    sql = str(statement.compile(dialect=postgresql.dialect()))
+    assert "ON CONFLICT (id) DO NOTHING" in sql
+    assert len(statement.compile(dialect=postgresql.dialect()).params) == 2 * len(crud.BIRD_DICT)
+    session.commit.assert_awaited_once()
+
+
+@pytest.mark.asyncio()
+async def test_bird_cache_reads_through(monkeypatch):
+    get_bird = AsyncMock(return_value=SimpleNamespace(id=131, name="Bubo bubo"))
+    monkeypatch.setattr(crud, "get_birds", AsyncMock(return_value=[]))
+    monkeypatch.setattr(crud, "get_bird", get_bird)
+    cache = BirdCache()
+    await cache.load(None)
+
+    assert await cache.get_id(None, "Bubo bubo") == 131
+    assert await cache.get_name(None, 131) == "Bubo bubo"
+    get_bird.assert_awaited_once()
+
+
+@pytest.mark.asyncio()
+async def test_create_detections_single_executemany():
+    session = MagicMock()
+    session.execute = AsyncMock()
+    session.commit = AsyncMock()
+    detections = [
+        dict(bird_id=131, t_start=0.5, t_end=1.0, f_start=300.0, f_end=900.0, score=0.9),
+        dict(bird_id=6, t_start=2.0, t_end=2.4, f_start=500.0, f_end=1500.0, score=0.4),
+    ]
+
+    await crud.create_detections(session, 7, detections)
+
+    session.execute.assert_awaited_once()
+    statement, params = session.execute.call_args.args
+    assert statement.table.name == "detections"
+    assert [row["service_call_id"] for row in params] == [7, 7]
+    assert [row["bird_id"] for row in params] == [131, 6]
+    session.commit.assert_awaited_once()
+
+    session.execute.reset_mock()
+    await crud.create_detections(session, 7, [])
+    session.execute.assert_not_awaited()
+
+
+@pytest.mark.asyncio()
+async def test_populate_bird_table_sqlite():
+    pytest.importorskip("aiosqlite")
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+    from api.database import Base
+
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSession(engine) as session:
+        # Idempotent, like on every startup of the API
+        await crud.populate_bird_table(session)
+        await crud.populate_bird_table(session)
+        assert len(await crud.get_birds(session)) == len(crud.BIRD_DICT)
+    await engine.dispose()
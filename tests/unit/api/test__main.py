@@ -1,8 +1,23 @@
-import asyncio
-from unittest.mock import MagicMock
+import hashlib
+import io
+import wave
+from types import SimpleNamespace
+from unittest.mock import ANY, AsyncMock, MagicMock
 
 import pytest
-from fastapi import UploadFile
+from fastapi import HTTPException, UploadFile
+
+from api.cache import TTLCache
+
+
+def make_wav(n_frames=16000, sample_rate=16000) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(b"\x00\x01" * n_frames)
+    return buffer.getvalue()
 
 
 @pytest.fixture()
@@ -10,27 +25,20 @@ def mock_upload_file():
     mock_file = MagicMock(spec=UploadFile)
     mock_file.filename = "test.wav"
     mock_file.content_type = "audio/wav"
-
-    # Create a future object and set its result to the file content
-    future = asyncio.Future()
-    future.set_result(b"test file content")
-
-    # Mock the read method to return the future
-    mock_file.read.return_value = future
+    mock_file.file = io.BytesIO(make_wav())
     return mock_file
 
 
 @pytest.fixture()
 def mock_minio_client():
-    mock_client = MagicMock()
-    # Simulate that the file does not exist in MinIO by raising an exception
-    mock_client.stat_object.side_effect = Exception("File does not exist")
-    return mock_client
+    return MagicMock()
 
 
 @pytest.fixture()
-def mock_rabbitmq_channel():
-    return MagicMock()
+def mock_publisher():
+    publisher = MagicMock()
+    publisher.publish = AsyncMock()
+    return publisher
 
 
 @pytest.fixture()
@@ -43,80 +51,333 @@ def patch_env_vars(monkeypatch):
     monkeypatch.setenv("RABBITMQ_PORT", "5672")
     monkeypatch.setenv("RABBITMQ_QUEUE_API2INF", "forwarding_queue")
     monkeypatch.setenv("RABBITMQ_QUEUE_INF2API", "feedback_queue")
+    monkeypatch.setenv("POSTGRES_USER", "test_user")
+    monkeypatch.setenv("POSTGRES_PASSWORD", "test_password")
+    monkeypatch.setenv("POSTGRES_HOST", "localhost")
+    monkeypatch.setenv("POSTGRES_PORT", "5432")
+    monkeypatch.setenv("POSTGRES_DB", "test_db")
 
 
 @pytest.fixture()
-def patch_mocks(monkeypatch, mock_minio_client, mock_rabbitmq_channel):
-    mock_write_file_to_minio = MagicMock()
-    mock_publish_message = MagicMock()
-    mock_ensure_bucket_exists = MagicMock()
-    mock_minio = MagicMock(return_value=mock_minio_client)
+def patch_mocks(monkeypatch, patch_env_vars, mock_minio_client, mock_publisher):
+    # Import the API after setting the environment variables, its configuration is read at import
+    import app.api.main as main
 
-    monkeypatch.setattr("minio.Minio", mock_minio)
-    monkeypatch.setattr(
-        "app_utils.minio.ensure_bucket_exists", mock_ensure_bucket_exists
-    )
-    monkeypatch.setattr("app_utils.minio.write_file_to_minio", mock_write_file_to_minio)
-    monkeypatch.setattr(
-        "app_utils.rabbitmq.get_rabbit_connection",
-        MagicMock(
-            return_value=MagicMock(
-                channel=MagicMock(return_value=mock_rabbitmq_channel)
-            )
-        ),
-    )
-    monkeypatch.setattr("app_utils.rabbitmq.publish_message", mock_publish_message)
-
-    return (
-        mock_minio_client,
-        mock_rabbitmq_channel,
-        mock_write_file_to_minio,
-        mock_publish_message,
-        mock_ensure_bucket_exists,
-    )
+    # Consume the stream in parts, like a multipart upload
+    def read_stream(minio_client, bucket_name, file_name, stream, **kwargs):
+        while stream.read(1024):
+            pass
+
+    mock_stream_file_to_minio = MagicMock(side_effect=read_stream)
+
+    # The configuration may have been read before the environment variables were set
+    monkeypatch.setattr(main.config, "MINIO_BUCKET", "test_bucket")
+    monkeypatch.setattr(main.config, "FORWARDING_QUEUE", "forwarding_queue")
+    monkeypatch.setattr(main.config, "FEEDBACK_QUEUE", "feedback_queue")
+
+    main.registry.override("minio", mock_minio_client)
+    main.registry.override("publisher", mock_publisher)
+    monkeypatch.setattr(main, "stream_file_to_minio", mock_stream_file_to_minio)
+    monkeypatch.setattr(main, "record_service_call", AsyncMock())
+
+    yield main, mock_minio_client, mock_stream_file_to_minio, mock_publisher.publish
+
+    for name in ("minio", "minio_presign", "publisher"):
+        main.registry.reset(name)
 
 
 @pytest.mark.asyncio()
-async def test_upload_record(mock_upload_file, patch_env_vars, patch_mocks):
-    (
-        mock_minio_client,
-        mock_rabbitmq_channel,
-        mock_write_file_to_minio,
-        mock_publish_message,
-        mock_ensure_bucket_exists,
-    ) = patch_mocks
-
-    # Import the upload_record function after setting the environment variables and mocking the required objects
-    from app.api.main import upload_record
+async def test_upload_record(mock_upload_file, patch_mocks):
+    main, mock_minio_client, mock_stream_file_to_minio, mock_publish = patch_mocks
 
     # Call the upload_record coroutine
-    result = await upload_record(mock_upload_file, "test@example.com")
+    result = await main.upload_record(mock_upload_file, "test@example.com")
 
     # Assertions
-    assert result["filename"] == "test.wav"
+    assert result["filename"].startswith("audio/")
+    assert result["filename"].endswith("_test.wav")
     assert result["message"] == "Fichier enregistré avec succès"
     assert result["email"] == "test@example.com"
-    assert len(result["ticket_number"]) == 6
+    assert len(result["ticket_number"]) == 16
 
-    # Verify that the minio_client was called correctly
-    mock_minio_client.stat_object.assert_called_once_with("test_bucket", "test.wav")
+    # The file is streamed, hashed on the fly
+    wav_content = make_wav()
+    assert result["size"] == len(wav_content)
+    assert result["sha256"] == hashlib.sha256(wav_content).hexdigest()
+    mock_stream_file_to_minio.assert_called_once()
+    args, kwargs = mock_stream_file_to_minio.call_args
+    assert args[:3] == (mock_minio_client, "test_bucket", result["filename"])
+    assert kwargs["content_type"] == "audio/wav"
 
-    # Extract the result from the Future before making the assertion
-    file_content = await mock_upload_file.read()
-    mock_write_file_to_minio.assert_called_once_with(
-        mock_minio_client, "test_bucket", "test.wav", file_content
-    )
-
-    # Verify that the publish_message function was called correctly
-    mock_publish_message.assert_called_once_with(
-        mock_rabbitmq_channel,
-        "forwarding_queue",
+    # Verify that the message was published correctly
+    audio_name = result["filename"].split("/")[-1]
+    # One-second clip: interactive lane
+    mock_publish.assert_awaited_once_with(
+        "forwarding_queue.interactive",
         {
-            "minio_path": "test_bucket/test.wav",
-            "email": "test@example.com",
             "ticket_number": result["ticket_number"],
+            "email": "test@example.com",
+            "soundfile_minio_path": result["filename"],
+            "annotations_minio_path": f"annotations/{audio_name[: -len('test.wav')]}test_annot.txt",
+            "spectrogram_minio_path": f"spectrograms/{audio_name[: -len('test.wav')]}test_spectro.bspc",
+            "audio_length": 1.0,
+            "submitted_at": ANY,
+            "traceparent": ANY,
         },
     )
 
-    # Verify that the ensure_bucket_exists function was called
-    mock_ensure_bucket_exists.assert_called_once_with(mock_minio_client, "test_bucket")
+
+@pytest.mark.asyncio()
+async def test_upload_record_draws_ticket_number_again(monkeypatch, mock_upload_file, patch_mocks):
+    main, _, _, mock_publish = patch_mocks
+    # The first ticket number is already in use
+    record_service_call = AsyncMock(side_effect=[False, True])
+    monkeypatch.setattr(main, "record_service_call", record_service_call)
+
+    result = await main.upload_record(mock_upload_file, "test@example.com")
+
+    first, second = (call.args[0].ticket_number for call in record_service_call.await_args_list)
+    assert first != second
+    assert result["ticket_number"] == second
+    mock_publish.assert_awaited_once()
+
+
+@pytest.mark.asyncio()
+@pytest.mark.parametrize(
+    ("audio_path", "completed_twice_ok", "recorded"),
+    [
+        ("audio/abc/a.wav", True, True),
+        ("audio/abc/a.wav", False, False),
+        ("audio/abc/other.wav", True, False),
+    ],
+)
+async def test_record_service_call_conflict(
+    monkeypatch, patch_env_vars, audio_path, completed_twice_ok, recorded
+):
+    import app.api.main as main
+
+    session = AsyncMock()
+
+    async def get_async_session():
+        yield session
+
+    monkeypatch.setattr(main, "get_async_session", get_async_session)
+    monkeypatch.setattr(
+        main.crud,
+        "create_service_call",
+        AsyncMock(side_effect=main.IntegrityError("INSERT", {}, Exception("unique"))),
+    )
+    monkeypatch.setattr(
+        main.crud,
+        "get_service_call_by_ticket",
+        AsyncMock(return_value=SimpleNamespace(audio_path="audio/abc/a.wav")),
+    )
+    message = main.InferenceMessage(
+        soundfile_minio_path=audio_path,
+        email="test@example.com",
+        ticket_number="abc",
+        annotations_minio_path="annotations/a_annot.txt",
+        spectrogram_minio_path="spectrograms/a_spectro.bspc",
+    )
+
+    # Only an upload completed twice is recorded once, another upload is a conflict
+    assert await main.record_service_call(message, completed_twice_ok) is recorded
+    session.rollback.assert_awaited_once()
+
+
+@pytest.mark.asyncio()
+async def test_upload_record_invalid_wav(mock_upload_file, patch_mocks):
+    main, _, _, mock_publish = patch_mocks
+    mock_upload_file.file = io.BytesIO(b"not a wav file" * 100)
+
+    with pytest.raises(HTTPException) as exc_info:
+        await main.upload_record(mock_upload_file, "test@example.com")
+
+    assert exc_info.value.status_code == 400
+    mock_publish.assert_not_awaited()
+
+
+@pytest.mark.asyncio()
+async def test_direct_upload(monkeypatch, patch_mocks):
+    main, mock_minio_client, _, mock_publish = patch_mocks
+    mock_presign_client = MagicMock()
+    mock_presign_client.presigned_post_policy.return_value = {
+        "policy": "p",
+        "x-amz-signature": "s",
+    }
+    main.registry.override("minio_presign", mock_presign_client)
+
+    # In-memory storage for the pending job
+    storage = {}
+    monkeypatch.setattr(
+        main, "write_json_to_minio", lambda client, bucket, name, doc: storage.update({name: doc})
+    )
+    monkeypatch.setattr(
+        main, "read_json_from_minio", lambda client, bucket, name: storage.get(name)
+    )
+    monkeypatch.setattr(
+        main, "read_object_head", lambda client, bucket, name, length: make_wav()[:length]
+    )
+    mock_minio_client.remove_object.side_effect = lambda bucket, name: storage.pop(name)
+
+    upload_request = main.UploadRequest(email="test@example.com", filename="test.wav")
+    result = await main.create_upload(upload_request)
+
+    ticket_number = result["ticket_number"]
+    # The form only accepts this object name and content type
+    assert result["upload_fields"] == {
+        "policy": "p",
+        "x-amz-signature": "s",
+        "key": result["filename"],
+        "Content-Type": "audio/wav",
+    }
+    (policy,), _ = mock_presign_client.presigned_post_policy.call_args
+    assert policy._upper_limit == main.config.MAX_UPLOAD_BYTES
+    assert result["filename"].startswith(f"audio/{ticket_number}/")
+    mock_publish.assert_not_awaited()
+
+    # The storage notification completes the upload, the client call is then a no-op
+    event = {"Records": [{"s3": {"object": {"key": result["filename"]}}}]}
+    request = MagicMock()
+    request.json = AsyncMock(return_value=event)
+    monkeypatch.setattr(main.config, "MINIO_WEBHOOK_TOKEN", "secret")
+    assert await main.minio_events(request, "Bearer secret") == {"completed": [ticket_number]}
+
+    mock_publish.assert_awaited_once()
+    args, _ = mock_publish.call_args
+    assert args[1]["soundfile_minio_path"] == result["filename"]
+    with pytest.raises(HTTPException) as exc_info:
+        await main.complete_upload(ticket_number)
+    assert exc_info.value.status_code == 404
+
+
+@pytest.mark.asyncio()
+async def test_upload_record_broker_unavailable(mock_upload_file, patch_mocks):
+    main, _, _, mock_publish = patch_mocks
+    mock_publish.side_effect = ConnectionError("broker down")
+
+    with pytest.raises(HTTPException) as exc_info:
+        await main.upload_record(mock_upload_file, "test@example.com")
+
+    assert exc_info.value.status_code == 503
+
+
+@pytest.mark.asyncio()
+@pytest.mark.parametrize(
+    ("token", "authorization", "status_code"),
+    [
+        (None, None, 403),
+        (None, "Bearer ", 403),
+        ("secret", None, 401),
+        ("secret", "Bearer guess", 401),
+    ],
+)
+async def test_minio_events_requires_token(
+    monkeypatch, patch_mocks, token, authorization, status_code
+):
+    main, *_ = patch_mocks
+    monkeypatch.setattr(main.config, "MINIO_WEBHOOK_TOKEN", token)
+    request = MagicMock()
+    request.json = AsyncMock(return_value={"Records": []})
+
+    with pytest.raises(HTTPException) as exc_info:
+        await main.minio_events(request, authorization)
+    assert exc_info.value.status_code == status_code
+    request.json.assert_not_awaited()
+
+
+@pytest.mark.asyncio()
+async def test_get_ticket_cached(monkeypatch, patch_mocks):
+    main, _, _, _ = patch_mocks
+    service_call = SimpleNamespace(
+        ticket_number="abc123",
+        status="done",
+        audio_length=12.0,
+        inference_results=[
+            SimpleNamespace(
+                annotation_path="annotations/a.txt", spectrogram_path="spectrograms/a.pt"
+            )
+        ],
+        detections=[
+            SimpleNamespace(
+                bird_id=131, t_start=0.5, t_end=1.0, f_start=300.0, f_end=900.0, score=0.9
+            )
+        ],
+    )
+    get_service_call = AsyncMock(
+        side_effect=lambda session, ticket: service_call if ticket == "abc123" else None
+    )
+
+    async def get_async_session():
+        yield None
+
+    mock_presign_client = MagicMock()
+    mock_presign_client.presigned_get_object.side_effect = lambda bucket, name, expires: (
+        f"http://minio/{name}"
+    )
+    main.registry.override("minio_presign", mock_presign_client)
+    monkeypatch.setattr(main, "get_async_session", get_async_session)
+    monkeypatch.setattr(main.crud, "get_service_call_with_results", get_service_call)
+    monkeypatch.setattr(main.bird_cache, "get_name", AsyncMock(return_value="Bubo bubo"))
+    monkeypatch.setattr(main, "ticket_cache", TTLCache(ttl=60, maxsize=10))
+
+    ticket = await main.get_ticket("abc123")
+    assert ticket["status"] == "done"
+    assert ticket["annotation_url"] == "http://minio/annotations/a.txt"
+    assert ticket["detections"][0]["species"] == "Bubo bubo"
+
+    # Polling again is served by the cache
+    assert await main.get_ticket("abc123") == ticket
+    get_service_call.assert_awaited_once()
+
+    with pytest.raises(HTTPException) as exc_info:
+        await main.get_ticket("zzz999")
+    assert exc_info.value.status_code == 404
+
+
+@pytest.mark.asyncio()
+async def test_ticket_events_pushed(monkeypatch, patch_mocks):
+    main, _, _, _ = patch_mocks
+    statuses = iter(["queued", "processing", "done"])
+    monkeypatch.setattr(
+        main,
+        "get_ticket",
+        AsyncMock(side_effect=lambda ticket: {"ticket_number": ticket, "status": next(statuses)}),
+    )
+
+    response = await main.ticket_events("abc123")
+    assert response.media_type == "text/event-stream"
+    assert main.ticket_broker.subscriber_count("abc123") == 1
+
+    events = response.body_iterator
+    assert (await events.__anext__()).startswith("event: queued\n")
+    main.ticket_broker.publish("abc123", {"status": "processing"})
+    assert (await events.__anext__()).startswith("event: processing\n")
+    main.ticket_broker.publish("abc123", {"status": "done"})
+    assert (await events.__anext__()).startswith("event: done\n")
+
+    # The stream ends, and the subscription is closed, once the ticket is done
+    with pytest.raises(StopAsyncIteration):
+        await events.__anext__()
+    assert main.ticket_broker.subscriber_count("abc123") == 0
+
+
+@pytest.mark.asyncio()
+async def test_ticket_events_read_again_without_events(monkeypatch, patch_mocks):
+    main, _, _, _ = patch_mocks
+    # Done in another API process: no event reaches this one
+    statuses = iter(["queued", "queued", "done"])
+    monkeypatch.setattr(
+        main,
+        "get_ticket",
+        AsyncMock(side_effect=lambda ticket: {"ticket_number": ticket, "status": next(statuses)}),
+    )
+    monkeypatch.setattr(main.config, "TICKET_EVENTS_KEEPALIVE", 0.01)
+
+    response = await main.ticket_events("abc123")
+    events = response.body_iterator
+    assert (await events.__anext__()).startswith("event: queued\n")
+    assert await events.__anext__() == ": keepalive\n\n"
+    assert (await events.__anext__()).startswith("event: done\n")
+    with pytest.raises(StopAsyncIteration):
+        await events.__anext__()
@@ -0,0 +1,43 @@
+import io
+import struct
+import wave
+
+import pytest
+
+from app.app_utils.audio import WavStreamReader, parse_wav_header
+
+
+def make_wav(n_frames=8000, sample_rate=8000, channels=2) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(b"\x00\x00" * channels * n_frames)
+    return buffer.getvalue()
+
+
+def test_parse_wav_header_skips_metadata_chunks():
+    wav = make_wav()
+    # Insert an odd-sized LIST chunk, padded to an even size, before the fmt chunk
+    list_chunk = b"LIST" + struct.pack("<I", 5) + b"INFO!" + b"\x00"
+    wav = wav[:12] + list_chunk + wav[12:]
+
+    header = parse_wav_header(wav)
+
+    assert header["channels"] == 2
+    assert header["sample_rate"] == 8000
+    assert header["duration"] == pytest.approx(1.0)
+    assert parse_wav_header(wav[:30]) is None
+
+
+def test_wav_stream_reader_validates_and_hashes():
+    wav = make_wav()
+    reader = WavStreamReader(io.BytesIO(wav))
+    content = b"".join(iter(lambda: reader.read(7), b""))
+
+    assert content == wav
+    assert reader.header["duration"] == pytest.approx(1.0)
+
+    with pytest.raises(ValueError, match="Not a WAV file"):
+        WavStreamReader(io.BytesIO(b"RIFF\x00\x00\x00\x00AVI LIST")).read(1024)
@@ -0,0 +1,90 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from app.app_utils.clients import ClientRegistry
+
+
+def test_clients_built_on_first_use():
+    built = []
+    registry = ClientRegistry()
+    registry.register("storage", lambda: built.append("storage") or SimpleNamespace())
+
+    assert built == []
+    assert registry.get("storage") is registry.get("storage")
+    assert built == ["storage"]
+
+
+def test_per_thread_clients():
+    registry = ClientRegistry()
+    registry.register("connection", SimpleNamespace, per_thread=True)
+    clients = []
+
+    def get():
+        clients.append(registry.get("connection"))
+        clients.append(registry.get("connection"))
+
+    threads = [threading.Thread(target=get) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert clients[0] is clients[1]
+    assert clients[2] is clients[3]
+    assert clients[0] is not clients[2]
+
+
+def test_dead_clients_rebuilt_and_not_closed():
+    closed = []
+    registry = ClientRegistry()
+    registry.register(
+        "connection",
+        lambda: SimpleNamespace(is_closed=False),
+        close=closed.append,
+        is_alive=lambda connection: not connection.is_closed,
+    )
+
+    first = registry.get("connection")
+    first.is_closed = True
+    second = registry.get("connection")
+    assert second is not first
+
+    registry.close()
+    assert closed == [second]
+
+
+def test_override():
+    registry = ClientRegistry()
+    registry.register("storage", lambda: "real")
+
+    with registry.overridden("storage", "fake"):
+        assert registry.get("storage") == "fake"
+    assert registry.get("storage") == "real"
+
+
+@pytest.mark.asyncio()
+async def test_async_clients_closed_in_reverse_order():
+    events = []
+
+    async def start_publisher():
+        events.append("start publisher")
+        return "publisher"
+
+    async def close(client):
+        events.append(f"close {client}")
+
+    registry = ClientRegistry()
+    registry.register("storage", lambda: "storage", close=lambda _: events.append("close storage"))
+    registry.register("publisher", start_publisher, close=close)
+    registry.register("consumer", lambda: "consumer", close=close)
+
+    registry.get("storage")
+    assert await registry.aget("publisher") == await registry.aget("publisher")
+    await registry.aget("consumer")
+    await registry.aclose()
+
+    assert events == ["start publisher", "close consumer", "close publisher", "close storage"]
+    # Built again after being closed
+    assert await registry.aget("publisher") == "publisher"
@@ -0,0 +1,23 @@
+from prometheus_client import REGISTRY
+
+# Imported like the modules using it: metrics are registered once per process
+from app_utils.metrics import observe_stage, time_stage
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_observe_stages():
+    forward_count = sample("nbm_stage_seconds_count", stage="forward")
+    windows = sample("nbm_windows_total")
+
+    observe_stage("forward", 0.2, n_windows=10)
+    observe_stage("inference", 2.0, n_windows=50)
+    with time_stage("upload"):
+        pass
+
+    assert sample("nbm_stage_seconds_count", stage="forward") == forward_count + 1
+    assert sample("nbm_windows_total") == windows + 10
+    assert sample("nbm_windows_per_second") == 25
+    assert sample("nbm_stage_seconds_count", stage="upload") >= 1
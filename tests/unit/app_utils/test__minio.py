@@ -1,4 +1,5 @@
 import io
+import threading
 from unittest.mock import MagicMock
 
 import pytest
@@ -7,6 +8,7 @@ from app.app_utils.minio import (
     ensure_bucket_exists,
     fetch_file_from_minio,
     write_file_to_minio,
+    write_files_to_minio,
 )
 
 
@@ -39,9 +41,7 @@ def test_ensure_bucket_exists_bucket_does_not_exist(mock_minio_client):
 
 def test_write_file_to_minio_bytes(mock_minio_client):
     # Call the function with bytes data
-    write_file_to_minio(
-        mock_minio_client, "test_bucket", "test_file.txt", b"test content"
-    )
+    write_file_to_minio(mock_minio_client, "test_bucket", "test_file.txt", b"test content")
 
     # Assertions
     mock_minio_client.put_object.assert_called_once()
@@ -69,6 +69,32 @@ def test_write_file_to_minio_file_like(mock_minio_client):
     assert kwargs["length"] == len(b"test content")
 
 
+def test_write_files_to_minio_concurrently(mock_minio_client):
+    barrier = threading.Barrier(2, timeout=5)
+    # Both uploads must be in flight at the same time to pass the barrier
+    mock_minio_client.put_object.side_effect = lambda *args, **kwargs: barrier.wait()
+
+    write_files_to_minio(
+        mock_minio_client,
+        "test_bucket",
+        {"annotations/a.txt": b"annotations", "spectrograms/a.bspc": b"spectrogram"},
+        part_size=16 * 1024 * 1024,
+    )
+
+    assert mock_minio_client.put_object.call_count == 2
+    uploaded = {args[1]: kwargs for args, kwargs in mock_minio_client.put_object.call_args_list}
+    assert uploaded.keys() == {"annotations/a.txt", "spectrograms/a.bspc"}
+    assert all(kwargs["part_size"] == 16 * 1024 * 1024 for kwargs in uploaded.values())
+
+
+def test_write_files_to_minio_error(mock_minio_client):
+    mock_minio_client.put_object.side_effect = [None, Exception("Error writing file")]
+
+    with pytest.raises(Exception, match="Error writing file"):
+        write_files_to_minio(mock_minio_client, "test_bucket", {"a.txt": b"a", "b.txt": b"b"})
+    assert mock_minio_client.put_object.call_count == 2
+
+
 def test_fetch_file_from_minio_success(mock_minio_client):
     # Call the function
     result = fetch_file_from_minio(
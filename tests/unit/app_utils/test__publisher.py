@@ -0,0 +1,49 @@
+import json
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from app.app_utils.publisher import AsyncPublisher
+
+
+def make_publisher(publish):
+    channel = MagicMock()
+    channel.is_closed = False
+    channel.default_exchange.publish = publish
+    connection = MagicMock()
+    connection.channel = AsyncMock(return_value=channel)
+    publisher = AsyncPublisher(
+        "localhost",
+        5672,
+        pool_size=2,
+        max_retries=2,
+        backoff=0,
+        connect=AsyncMock(return_value=connection),
+    )
+    return publisher, connection
+
+
+@pytest.mark.asyncio()
+async def test_publish_retries_until_confirmed():
+    publish = AsyncMock(side_effect=[ConnectionError("reset"), None])
+    publisher, connection = make_publisher(publish)
+    await publisher.start()
+
+    await publisher.publish("queue", {"ticket_number": "abcdef"})
+
+    connection.channel.assert_awaited_with(publisher_confirms=True)
+    assert publish.await_count == 2
+    message = publish.call_args.args[0]
+    assert json.loads(message.body) == {"ticket_number": "abcdef"}
+    assert publish.call_args.kwargs["routing_key"] == "queue"
+
+
+@pytest.mark.asyncio()
+async def test_publish_raises_after_retries():
+    publish = AsyncMock(side_effect=ConnectionError("reset"))
+    publisher, _ = make_publisher(publish)
+    await publisher.start()
+
+    with pytest.raises(ConnectionError):
+        await publisher.publish("queue", {"ticket_number": "abcdef"})
+    assert publish.await_count == 3
@@ -0,0 +1,21 @@
+import pytest
+
+from app.app_utils.pubsub import TicketBroker
+
+
+@pytest.mark.asyncio()
+async def test_publish_to_ticket_subscribers():
+    broker = TicketBroker(queue_size=2)
+
+    with broker.subscription("abc123") as queue, broker.subscription("zzz999") as other:
+        broker.publish("abc123", {"status": "processing"})
+        assert queue.get_nowait() == {"status": "processing"}
+        assert other.empty()
+
+        # A lagging subscriber loses its oldest events
+        for status in ("queued", "processing", "done"):
+            broker.publish("abc123", {"status": status})
+        assert [queue.get_nowait()["status"] for _ in range(2)] == ["processing", "done"]
+
+    assert broker.subscriber_count() == 0
+    broker.publish("abc123", {"status": "done"})
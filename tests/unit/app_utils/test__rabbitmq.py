@@ -0,0 +1,247 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from app.app_utils import rabbitmq
+from app.app_utils.standins import StandInBlockingConnection, StandInBroker
+
+
+class FakeQueue:
+    def __init__(self, messages):
+        self.messages = messages
+
+    async def consume(self, callback):
+        for message in self.messages:
+            await callback(message)
+        return "consumer-tag"
+
+    async def cancel(self, consumer_tag):
+        pass
+
+
+def make_fake_connection(queue):
+    channel = MagicMock()
+    channel.set_qos = AsyncMock()
+    channel.declare_queue = AsyncMock(return_value=queue)
+    connection = MagicMock()
+    connection.channel = AsyncMock(return_value=channel)
+    connection.__aenter__ = AsyncMock(return_value=connection)
+    connection.__aexit__ = AsyncMock(return_value=None)
+    return connection, channel
+
+
+def make_message(body, redelivered=False):
+    message = MagicMock()
+    message.body = body
+    message.redelivered = redelivered
+    message.ack = AsyncMock()
+    message.nack = AsyncMock()
+    return message
+
+
+@pytest.mark.asyncio()
+async def test_consume_feedback_messages_concurrently(monkeypatch):
+    messages = [make_message(f"{i}".encode()) for i in range(4)]
+    failing = make_message(b"fail")
+    connection, channel = make_fake_connection(FakeQueue([*messages, failing]))
+    monkeypatch.setattr(rabbitmq.aio_pika, "connect_robust", AsyncMock(return_value=connection))
+
+    # Every message waits for the others: only completes if they are handled concurrently
+    barrier = asyncio.Barrier(len(messages))
+
+    async def process(body, *args):
+        if body == b"fail":
+            raise RuntimeError("database unavailable")
+        await barrier.wait()
+
+    monkeypatch.setattr(rabbitmq, "process_feedback_message", process)
+
+    stop_event = asyncio.Event()
+    stop_event.set()
+    await asyncio.wait_for(
+        rabbitmq.consume_feedback_messages(
+            "localhost",
+            5672,
+            "feedback_queue",
+            MagicMock(),
+            "bucket",
+            stop_event=stop_event,
+            prefetch_count=8,
+        ),
+        timeout=5,
+    )
+
+    channel.set_qos.assert_awaited_once_with(prefetch_count=8)
+    for message in messages:
+        message.ack.assert_awaited_once()
+    # First failure: requeued for another attempt
+    failing.nack.assert_awaited_once_with(requeue=True)
+    failing.ack.assert_not_awaited()
+
+
+def start_lanes(queues):
+    """Stand-in broker with messages waiting in the lanes of "jobs", and a worker channel."""
+    broker = StandInBroker()
+    for queue_name, bodies in queues.items():
+        for body in bodies:
+            broker.put(queue_name, body)
+    connection = StandInBlockingConnection(broker)
+    return broker, connection, connection.channel()
+
+
+def test_consume_lanes_prevents_starvation():
+    broker, connection, channel = start_lanes(
+        {
+            "jobs.interactive": [f"short{i}".encode() for i in range(6)],
+            "jobs": [b"long0", b"long1"],
+        }
+    )
+    stop_event = threading.Event()
+    served = []
+
+    def callback(body, lane):
+        served.append(body.decode())
+        if len(served) == 8:
+            stop_event.set()
+
+    rabbitmq.consume_lanes(
+        connection,
+        channel,
+        rabbitmq.get_lane_queues("jobs"),
+        callback,
+        starvation_limit=2,
+        stop_event=stop_event,
+    )
+
+    assert served == ["short0", "short1", "long0", "short2", "short3", "long1", "short4", "short5"]
+    # One consumer per lane, cancelled once stopped
+    assert channel.prefetch_count == 1
+    assert channel._consumers == {}
+    assert channel._unacked == {}
+
+
+def test_consume_lanes_requeues_undelivered_on_stop():
+    broker, connection, channel = start_lanes({"jobs.interactive": [b"short"], "jobs": [b"long"]})
+    stop_event = threading.Event()
+
+    def callback(body, lane):
+        stop_event.set()
+
+    rabbitmq.consume_lanes(
+        connection, channel, rabbitmq.get_lane_queues("jobs"), callback, stop_event=stop_event
+    )
+
+    # The bulk job was delivered to the worker, but not processed
+    assert broker.get("jobs") == (b"long", True)
+
+
+def test_route_by_duration():
+    assert rabbitmq.route_by_duration("jobs", 10.0, short_audio_seconds=60) == "jobs.interactive"
+    assert rabbitmq.route_by_duration("jobs", 7200.0, short_audio_seconds=60) == "jobs"
+    assert rabbitmq.route_by_duration("jobs", None, short_audio_seconds=60) == "jobs"
+
+
+@pytest.mark.asyncio()
+async def test_feedback_results_stored_in_one_transaction(monkeypatch):
+    pytest.importorskip("aiosqlite")
+    from sqlalchemy import func, select
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+    # The engine of the API is built at import, from the environment
+    monkeypatch.setenv("ASYNC_DATABASE_URL", "sqlite+aiosqlite://")
+    from api import crud, database
+    from api.models import Detection, InferenceResult
+
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(database.Base.metadata.create_all)
+
+    async def get_async_session():
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            yield session
+
+    monkeypatch.setattr(database, "get_async_session", get_async_session)
+    async with AsyncSession(engine) as session:
+        await crud.create_service_call(session, "a@b.co", "abc", "audio/abc.wav", 10.0)
+
+    detection = {
+        "bird_id": 1,
+        "t_start": 0,
+        "t_end": 1,
+        "f_start": 500,
+        "f_end": 900,
+        "score": 0.9,
+    }
+    body = (
+        rabbitmq.FeedbackMessage(
+            soundfile_minio_path="audio/abc.wav",
+            email="a@b.co",
+            ticket_number="abc",
+            annotations_minio_path="annotations/abc.txt",
+            spectrogram_minio_path="spectrograms/abc.bspc",
+            detections=[detection],
+        )
+        .json()
+        .encode()
+    )
+    email_dispatcher = MagicMock()
+    email_dispatcher.submit = AsyncMock()
+
+    async def count_rows():
+        async with AsyncSession(engine) as session:
+            return [
+                await session.scalar(select(func.count()).select_from(table))
+                for table in (InferenceResult, Detection)
+            ]
+
+    # A failure after the inference result is written keeps nothing
+    create_detections = crud.create_detections
+    monkeypatch.setattr(crud, "create_detections", AsyncMock(side_effect=RuntimeError("db")))
+    with pytest.raises(RuntimeError):
+        await rabbitmq.process_feedback_message(
+            body, None, "bucket", email_dispatcher=email_dispatcher
+        )
+    assert await count_rows() == [0, 0]
+
+    # The requeued message, then a redelivery of it, store the results once
+    monkeypatch.setattr(crud, "create_detections", create_detections)
+    for _ in range(2):
+        await rabbitmq.process_feedback_message(
+            body, None, "bucket", email_dispatcher=email_dispatcher
+        )
+    assert await count_rows() == [1, 1]
+    assert email_dispatcher.submit.await_count == 2
+
+    # A duplicate handled concurrently read the ticket before it was done: its claim fails
+    stale = SimpleNamespace(id=1, status="processing")
+    monkeypatch.setattr(crud, "get_service_call_by_ticket", AsyncMock(return_value=stale))
+    await rabbitmq.process_feedback_message(
+        body, None, "bucket", email_dispatcher=email_dispatcher
+    )
+    assert await count_rows() == [1, 1]
+    await engine.dispose()
+
+
+def test_consume_lanes_survives_failing_callback():
+    broker, connection, channel = start_lanes({"jobs.interactive": [b"fails", b"short"]})
+    stop_event = threading.Event()
+    attempts, served = [], []
+
+    def callback(body, lane):
+        if body == b"fails":
+            attempts.append(body)
+            raise RuntimeError("model")
+        served.append(body.decode())
+        stop_event.set()
+
+    rabbitmq.consume_lanes(
+        connection, channel, rabbitmq.get_lane_queues("jobs"), callback, stop_event=stop_event
+    )
+
+    # Requeued once for another attempt, then dropped
+    assert len(attempts) == 2
+    assert served == ["short"]
+    assert broker.depth("jobs.interactive") == 0
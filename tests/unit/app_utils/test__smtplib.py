@@ -0,0 +1,83 @@
+import asyncio
+import smtplib
+
+import pytest
+
+from app.app_utils.smtplib import EmailDispatcher
+
+
+class FakeConnection:
+    def __init__(self, smtp_server, smtp_port, failures=()):
+        self.sent = []
+        self.failures = list(failures)
+
+    def send(self, message):
+        if self.failures:
+            raise self.failures.pop(0)
+        self.sent.append(message)
+
+    def close(self):
+        pass
+
+
+def make_dispatcher(connection, **kwargs):
+    return EmailDispatcher(
+        None,
+        "test_bucket",
+        pool_size=1,
+        backoff=0.001,
+        connection_factory=lambda *args: connection,
+        **kwargs,
+    )
+
+
+@pytest.mark.asyncio()
+async def test_dispatcher_reuses_connection_and_retries():
+    connection = FakeConnection(None, None, failures=[smtplib.SMTPServerDisconnected("lost")])
+    dispatcher = make_dispatcher(connection)
+    await dispatcher.start()
+
+    for ticket_number in ("abc123", "def456"):
+        await dispatcher.submit(
+            "test@example.com", ticket_number, f"annotations/{ticket_number}.txt", b"0.1\t0.2"
+        )
+    await dispatcher.stop()
+
+    # The first email is retried after the connection is lost
+    assert [message["Subject"] for message in connection.sent] == [
+        "Classification Results - Ticket #abc123",
+        "Classification Results - Ticket #def456",
+    ]
+
+
+@pytest.mark.asyncio()
+async def test_dispatcher_does_not_retry_permanent_errors():
+    connection = FakeConnection(None, None, failures=[smtplib.SMTPDataError(550, b"rejected")])
+    dispatcher = make_dispatcher(connection)
+    await dispatcher.start()
+
+    await dispatcher.submit("test@example.com", "abc123", "annotations/abc123.txt", b"0.1\t0.2")
+    await dispatcher.stop()
+
+    assert connection.sent == []
+
+
+@pytest.mark.asyncio()
+async def test_dispatcher_digest():
+    connection = FakeConnection(None, None)
+    dispatcher = make_dispatcher(connection, digest_seconds=0.05, digest_max_tickets=10)
+    await dispatcher.start()
+
+    for ticket_number in ("abc123", "def456", "ghi789"):
+        await dispatcher.submit(
+            "test@example.com", ticket_number, f"annotations/{ticket_number}.txt", b"0.1\t0.2"
+        )
+    await dispatcher.submit("other@example.com", "jkl012", "annotations/jkl012.txt", b"0.1\t0.2")
+    await asyncio.sleep(0.1)
+    await dispatcher.stop()
+
+    messages = {message["To"]: message for message in connection.sent}
+    assert len(connection.sent) == 2
+    assert messages["test@example.com"]["Subject"] == "Classification Results - 3 tickets"
+    assert len(messages["test@example.com"].get_payload()) == 4  # body and 3 attachments
+    assert messages["other@example.com"]["Subject"] == "Classification Results - Ticket #jkl012"
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from app.app_utils.spectrogram import read_spectrogram, write_spectrogram
+
+
+def make_spectrogram(n_windows=3, shape=(375, 1024)):
+    rng = np.random.default_rng(0)
+    return [(idx * 2, rng.random(shape, dtype=np.float32)) for idx in range(n_windows)]
+
+
+@pytest.mark.parametrize(("dtype", "tolerance"), [("uint8", 1 / 255), ("float16", 1e-3)])
+def test_round_trip(dtype, tolerance):
+    spectrogram = make_spectrogram()
+    params = {"hop_length": 132}
+
+    artifact = read_spectrogram(
+        write_spectrogram(spectrogram, params=params, dtype=dtype, compression=None)
+    )
+
+    assert artifact.indices == [0, 2, 4]
+    assert artifact.params == params
+    for (idx, window), (read_idx, read_window) in zip(spectrogram, artifact):
+        assert read_idx == idx
+        assert read_window.dtype == np.float32
+        assert np.abs(read_window - window).max() <= tolerance
+
+
+def test_uint8_is_compact_and_zero_copy():
+    spectrogram = make_spectrogram()
+    buffer = write_spectrogram(spectrogram, dtype="uint8", compression=None)
+    assert len(buffer) < sum(window.nbytes for _, window in spectrogram) / 3.9
+
+    artifact = read_spectrogram(buffer)
+    assert np.shares_memory(artifact.data, np.frombuffer(buffer, dtype=np.uint8))
+
+
+def test_compressed_round_trip():
+    pytest.importorskip("zstandard")
+    spectrogram = make_spectrogram(n_windows=1)
+    artifact = read_spectrogram(write_spectrogram(spectrogram, compression="zstd"))
+    assert np.abs(artifact.window(0) - spectrogram[0][1]).max() <= 1 / 255
+
+
+def test_invalid_artifact():
+    with pytest.raises(ValueError, match="bad magic"):
+        read_spectrogram(b"PK\x03\x04" + b"\x00" * 32)
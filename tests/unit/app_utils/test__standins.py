@@ -0,0 +1,90 @@
+import asyncio
+import json
+
+import pytest
+
+from app.app_utils.minio import read_json_from_minio, write_file_to_minio, write_json_to_minio
+from app.app_utils.publisher import AsyncPublisher
+from app.app_utils.standins import (
+    StandInBlockingConnection,
+    StandInBroker,
+    StandInConnection,
+    StandInObjectStore,
+)
+
+
+def test_object_store():
+    store = StandInObjectStore()
+    store.make_bucket("bucket")
+    write_file_to_minio(store, "bucket", "audio/a.wav", b"RIFF1234")
+    write_json_to_minio(store, "bucket", "pending/abc.json", {"ticket_number": "abc"})
+
+    assert store.get_object("bucket", "audio/a.wav", offset=0, length=4).read() == b"RIFF"
+    assert read_json_from_minio(store, "bucket", "pending/abc.json") == {"ticket_number": "abc"}
+    assert [obj.object_name for obj in store.list_objects("bucket", prefix="audio/")] == [
+        "audio/a.wav"
+    ]
+
+    store.remove_object("bucket", "pending/abc.json")
+    # Missing objects raise like MinIO does
+    assert read_json_from_minio(store, "bucket", "pending/abc.json") is None
+
+
+@pytest.mark.asyncio()
+async def test_broker_between_api_and_worker():
+    broker = StandInBroker()
+
+    async def connect(**kwargs):
+        return StandInConnection(broker)
+
+    publisher = AsyncPublisher(None, None, pool_size=2, connect=connect)
+    await publisher.start()
+    await publisher.declare_queue("jobs")
+    await publisher.publish_many("jobs", [{"n": n} for n in range(3)])
+    assert await publisher.queue_depth("jobs") == 3
+
+    # Worker side: blocking channel, from a thread
+    channel = StandInBlockingConnection(broker).channel()
+    _, _, body = channel.basic_get("jobs")
+    assert json.loads(body) == {"n": 0}
+    await asyncio.to_thread(channel.basic_publish, "", "feedback", b"done")
+
+    # API side: consumed with at most `prefetch_count` unacknowledged messages
+    for n in range(3):
+        channel.basic_publish("", "feedback", f"{n}".encode())
+    delivered = []
+    consumer_channel = await (await connect()).channel()
+    await consumer_channel.set_qos(prefetch_count=2)
+    queue = await consumer_channel.declare_queue("feedback")
+
+    async def on_message(message):
+        delivered.append(message)
+
+    await queue.consume(on_message)
+    await asyncio.sleep(0.01)
+    assert [message.body for message in delivered] == [b"done", b"0"]
+
+    await delivered[1].nack(requeue=True)  # Requeued at the front
+    await delivered[0].ack()
+    await asyncio.sleep(0.01)
+    assert [(m.body, m.redelivered) for m in delivered[2:]] == [(b"0", True), (b"1", False)]
+    assert broker.depth("feedback") == 1
+    await publisher.close()
+
+
+def test_blocking_channel_empty_queue():
+    channel = StandInBlockingConnection(StandInBroker()).channel()
+    channel.queue_declare(queue="jobs", durable=True)
+    assert channel.basic_get("jobs") == (None, None, None)
+
+
+def test_blocking_channel_nack_requeues():
+    channel = StandInBlockingConnection(StandInBroker()).channel()
+    channel.queue_declare(queue="jobs", durable=True)
+    channel.basic_publish(exchange="", routing_key="jobs", body=b"0")
+    channel.basic_publish(exchange="", routing_key="jobs", body=b"1")
+
+    method_frame, _, body = channel.basic_get("jobs")
+    channel.basic_nack(delivery_tag=method_frame.delivery_tag, requeue=True)
+    method_frame, _, body = channel.basic_get("jobs")
+    assert (body, method_frame.redelivered) == (b"0", True)
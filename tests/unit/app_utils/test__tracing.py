@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+from app.app_utils.tracing import (
+    JsonLinesSink,
+    OTLPSink,
+    Tracer,
+    current_traceparent,
+    parse_traceparent,
+)
+
+
+class ListSink:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+
+def test_trace_propagated_through_traceparent():
+    sink = ListSink()
+    api, worker = Tracer(sink), Tracer(sink)
+
+    with api.span("enqueue", ticket_number="ABC123") as enqueue:
+        traceparent = current_traceparent()
+    assert current_traceparent() is None
+
+    # The worker continues the trace from the message
+    with worker.span("inference", traceparent=traceparent, lane="batch") as inference:
+        worker.record_stage("forward", 0.5, n_windows=8)
+
+    forward = sink.spans[1]
+    assert inference.trace_id == enqueue.trace_id == forward.trace_id
+    assert inference.parent_id == enqueue.span_id
+    assert forward.parent_id == inference.span_id
+    assert forward.attributes["n_windows"] == 8
+    assert forward.attributes["lane"] == "batch"
+    assert forward.end_ns - forward.start_ns == pytest.approx(0.5e9)
+    assert [span.name for span in sink.spans] == ["enqueue", "forward", "inference"]
+
+
+def test_invalid_traceparent_starts_new_trace():
+    assert parse_traceparent(None) is None
+    assert parse_traceparent("00-xyz-abc-01") is None
+
+    tracer = Tracer(ListSink())
+    with tracer.span("inference", traceparent="garbage") as span:
+        pass
+    assert span.parent_id is None
+    assert parse_traceparent(span.traceparent) == (span.trace_id, span.span_id)
+
+
+def test_span_records_error():
+    sink = ListSink()
+    tracer = Tracer(sink)
+    with pytest.raises(RuntimeError), tracer.span("upload"):
+        raise RuntimeError("boom")
+    assert "boom" in sink.spans[0].error
+
+
+def test_jsonl_sink(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    tracer = Tracer(JsonLinesSink(path))
+    with tracer.span("download", ticket_number="ABC123"):
+        pass
+
+    (line,) = path.read_text().splitlines()
+    span = json.loads(line)
+    assert span["name"] == "download"
+    assert span["attributes"]["ticket_number"] == "ABC123"
+    assert span["duration_s"] >= 0
+
+
+def test_otlp_payload():
+    sink = ListSink()
+    with Tracer(sink).span("enqueue", audio_length=1.5):
+        pass
+
+    payload = OTLPSink.span_to_otlp(sink.spans[0])
+    attributes = {attribute["key"]: attribute["value"] for attribute in payload["attributes"]}
+    assert attributes["audio_length"] == {"doubleValue": 1.5}
+    assert payload["parentSpanId"] == ""
@@ -0,0 +1,51 @@
+import pytest
+
+pytest.importorskip("librosa")
+torch = pytest.importorskip("torch")
+
+from app.inference.mapreduce import (
+    HOP_LENGTH,
+    HOP_SPECTRO,
+    count_windows,
+    make_partial,
+    plan_segments,
+    read_partial,
+    reduce_partials,
+    spectrogram_columns,
+)
+
+
+def test_plan_segments_follow_the_window_grid():
+    n_samples = 44100 * 600
+    segments = plan_segments(n_samples, segment_windows=50)
+
+    n_windows = count_windows(spectrogram_columns(n_samples))
+    assert sum(segment["n_windows"] for segment in segments) == n_windows
+    assert segments[-1]["end_sample"] == n_samples
+    for segment in segments:
+        # Each segment starts on a window of the whole recording
+        assert segment["start_sample"] == segment["first_window"] * HOP_SPECTRO * HOP_LENGTH
+        # and is cut into exactly its own windows
+        n_columns = spectrogram_columns(segment["end_sample"] - segment["start_sample"])
+        if segment is not segments[-1]:
+            assert count_windows(n_columns) == segment["n_windows"]
+
+
+def test_reduce_partials_restores_window_order():
+    window = {"1": {"bbox_coord": torch.Tensor(), "scores": torch.Tensor()}}
+    boxes = {"1": {"bbox_coord": torch.tensor([[0, 1, 2, 3]]), "scores": torch.tensor([[0.5]])}}
+    first = make_partial([[window, boxes, window]], [(1, torch.zeros(2, 2))], 0, 2, last=False)
+    second = make_partial([[window] * 2], [(0, torch.ones(2, 2))], 2, n_windows=2, last=True)
+
+    fp, outputs, spectrogram = reduce_partials(
+        [read_partial(second.getvalue()), read_partial(first.getvalue())],
+        spectrogram_length=5000,
+    )
+
+    assert len(outputs) == 1
+    assert len(outputs[0]) == 4
+    assert [idx for idx, _ in spectrogram] == [1, 2]
+    assert fp.spectrogram_length == 5000
+    # Detections survive the partial artifact unchanged
+    assert torch.equal(outputs[0][1]["1"]["bbox_coord"], boxes["1"]["bbox_coord"])
+    assert torch.equal(outputs[0][1]["1"]["scores"], boxes["1"]["scores"])
@@ -0,0 +1,60 @@
+import pytest
+
+pytest.importorskip("torch")
+
+import torch
+
+# Imported like the app does (see model_serve.model_serve), not as app.model_serve
+from model_serve import autotune
+
+
+@pytest.fixture()
+def fake_benchmark(monkeypatch):
+    # Batch time grows sub-linearly with batch size and shrinks with threads
+    def benchmark_setting(model, batch_size, num_threads, n_iter=2):
+        return (0.5 + 0.1 * batch_size) / num_threads
+
+    monkeypatch.setattr(autotune, "benchmark_setting", benchmark_setting)
+
+
+def test_autotune_selects_throughput_and_latency_settings(fake_benchmark):
+    profile = autotune.autotune(None, batch_sizes=(1, 4, 16), thread_counts=[1, 2])
+
+    assert len(profile["results"]) == 6
+    # Largest batch amortizes the fixed cost best
+    assert profile["throughput"] == {"batch_size": 16, "num_threads": 2}
+    # A 4-window clip is done in a single batch of 4
+    assert profile["latency"] == {"batch_size": 4, "num_threads": 2}
+
+
+def test_get_profile_uses_cache(fake_benchmark, monkeypatch, tmp_path):
+    profile_path = str(tmp_path / "profile.json")
+    config = type("Config", (), {"backbone": "resnet50", "dilation": True})()
+
+    profile = autotune.get_profile(
+        None, config, profile_path, batch_sizes=(1, 2), thread_counts=[1]
+    )
+
+    def fail(*args, **kwargs):
+        raise AssertionError("autotune should not run when the profile is cached")
+
+    monkeypatch.setattr(autotune, "autotune", fail)
+    assert autotune.get_profile(None, config, profile_path) == profile
+
+
+def test_torch_threads_restored():
+    initial = torch.get_num_threads()
+    with autotune.torch_threads(initial + 1):
+        assert torch.get_num_threads() == initial + 1
+    assert torch.get_num_threads() == initial
+
+
+def test_benchmark_restores_threads_on_failure():
+    initial = torch.get_num_threads()
+
+    def model(batch):
+        raise RuntimeError("out of memory")
+
+    with pytest.raises(RuntimeError, match="out of memory"):
+        autotune.benchmark_setting(model, batch_size=1, num_threads=initial + 1)
+    assert torch.get_num_threads() == initial
@@ -0,0 +1,56 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("librosa")
+
+ROOT = Path(__file__).resolve().parents[3]
+# Loaded on demand only: plotting, dataframes, dataset building, training and segmentation
+ON_DEMAND_MODULES = (
+    "matplotlib",
+    "pandas",
+    "imageio",
+    "scipy.optimize",
+    "src.features.prepare_dataset",
+    "src.models.matcher",
+    "src.models.segmentation",
+)
+IMPORT_BUDGET_SECONDS = float(os.getenv("IMPORT_BUDGET_SECONDS", "15"))
+
+
+def import_in_fresh_interpreter(module) -> dict:
+    """Import `module` like the worker does (from app/), return its import time and modules."""
+    code = (
+        "import json, sys, time\n"
+        f"sys.path[:0] = [{str(ROOT)!r}, {str(ROOT / 'app')!r}]\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "seconds = time.perf_counter() - start\n"
+        "print(json.dumps({'seconds': seconds, 'modules': sorted(sys.modules)}))\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT / "app", capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def test_model_server_import_skips_on_demand_modules():
+    result = import_in_fresh_interpreter("model_serve.model_serve")
+
+    loaded = [
+        name
+        for name in ON_DEMAND_MODULES
+        if any(module == name or module.startswith(f"{name}.") for module in result["modules"])
+    ]
+    assert loaded == []
+
+
+@pytest.mark.slow()
+def test_model_server_import_time_budget():
+    result = import_in_fresh_interpreter("model_serve.model_serve")
+    assert result["seconds"] < IMPORT_BUDGET_SECONDS